@@ -2,6 +2,57 @@
 import numpy as np
 cimport numpy as np
 
+# Loss (time penalty) methods, resolved once from the user supplied string
+cdef enum LossMethod:
+    LOSS_UNKNOWN = 0
+    LOSS_PROP_DIFF = 1
+    LOSS_ABS_DIFF = 2
+    LOSS_QUADRATIC = 3
+    LOSS_PROP_QUADRATIC = 4
+    LOSS_LOG_COSH = 5
+
+cdef int loss_method_code(str method)
+
+cdef void TSW_scoreMat_nogil(
+    double[:] s1_time,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_time,
+    int[:] s2_drugs,
+    int s2_len,
+    double g,
+    double T,
+    double[:, :] H,
+    double[:, :] TR,
+    double[:, :] TC,
+    int[:, :] traceMat,
+    double[:, :] s,
+    int method
+) noexcept nogil
+
+cdef int lowmem_ring_rows(double[:] s2_time, int s2_len) noexcept nogil
+
+cdef int window_last_row(double[:] s2_time, int s2_len, int row) noexcept nogil
+
+cdef void TSW_scoreMat_lowmem_nogil(
+    double[:] s1_time,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_time,
+    int[:] s2_drugs,
+    int s2_len,
+    double g,
+    double T,
+    double[:, :] H,
+    double[:, :] TR,
+    double[:, :] TC,
+    unsigned char[:, :] traceMat,
+    double[:] H_col,
+    double[:, :] s,
+    int method,
+    int last_row
+) noexcept nogil
+
 cdef TSW_scoreMat(
     double[:] s1_time,
     int[:] s1_drugs,
@@ -17,4 +68,4 @@ cdef TSW_scoreMat(
     int[:, :] traceMat,
     double[:, :] s,
     str method
-)
\ No newline at end of file
+)
@@ -1,13 +1,33 @@
 # cython: boundscheck=False, wraparound=False, nonecheck=True, cdivision=True, language_level=3
 import numpy as np
 cimport numpy as np
-from libc.math cimport fabs, fmax, pow, log, cosh
+from libc.math cimport fabs, fmax, fmin, pow, log, cosh
+
+
+# ----------------------------
+# Helper: Loss method lookup
+# Resolve the method string once per call
+# so the kernel only compares ints
+# ----------------------------
+cdef int loss_method_code(str method):
+    if method == "PropDiff":
+        return LOSS_PROP_DIFF
+    elif method == "AbsDiff":
+        return LOSS_ABS_DIFF
+    elif method == "Quadratic":
+        return LOSS_QUADRATIC
+    elif method == "PropQuadratic":
+        return LOSS_PROP_QUADRATIC
+    elif method == "LogCosh":
+        return LOSS_LOG_COSH
+    return LOSS_UNKNOWN
+
 
 # ----------------------------
 # Helper: Loss Function
 # Fully compiled to C so cdef
 # ----------------------------
-cdef inline double lossFunction(double T, double t1, double t2, str method, int i, int j):
+cdef inline double lossFunction(double T, double t1, double t2, int method, int i, int j) noexcept nogil:
     cdef double absDiff = fabs(t1 - t2)
     cdef double maxT = fmax(t1, t2)
     cdef double tp = 0.0
@@ -18,43 +38,29 @@ cdef inline double lossFunction(double T, double t1, double t2, str method, int
     if j == 1:
         return 1e-24
 
-    if method == "PropDiff":
+    if method == LOSS_PROP_DIFF:
         if t1 == 0.0 or t2 == 0.0:
             tp = T * absDiff / (maxT + 1)
         else:
             tp = T * absDiff / maxT
-    elif method == "AbsDiff":
+    elif method == LOSS_ABS_DIFF:
         tp = T * absDiff
-    elif method == "Quadratic":
+    elif method == LOSS_QUADRATIC:
         tp = T * pow(absDiff, 2)
-    elif method == "PropQuadratic":
+    elif method == LOSS_PROP_QUADRATIC:
         tp = (T * pow(absDiff, 2)) / maxT
-    elif method == "LogCosh":
+    elif method == LOSS_LOG_COSH:
         tp = cosh(log(absDiff))
     else:
         tp = 0.0
     return tp
 
 
-cdef double score(
-    double[:, :] s,
-    int x, 
-    int y
-):
-    """
-    Look up the score for (x, y) in the scoring matrix/dict `s`.
-    Returns a float (converted to double).
-    """
-    return float(s[x][y])
-
-
 # ----------------------------
-# Core Scoring Function
-# Will be called with python headers
-# python callable
-# (entrypoint in main)
+# Core Scoring Kernel
+# C types only, safe to run without the GIL
 # ----------------------------
-cdef TSW_scoreMat(
+cdef void TSW_scoreMat_nogil(
     double[:] s1_time,
     int[:] s1_drugs,
     int s1_len,
@@ -68,22 +74,20 @@ cdef TSW_scoreMat(
     double[:, :] TC,
     int[:, :] traceMat,
     double[:, :] s,
-    str method
-):
+    int method
+) noexcept nogil:
     """
-    Cython-accelerated version with separated time and drug lists.
-    Inputs:
-        s1_time, s2_time : float or double arrays/lists
-        s1_drugs, s2_drugs : lists of strings or comparable objects
-        H, TR, TC, traceMat : Python nested lists (matrices)
+    Fill H, TR, TC and traceMat for s1 (regimen) against s2 (drug record).
+    Moves are chosen exactly like max([0, Hup, Hmid, Hbot]) followed by
+    .index(): the first of the maximal candidates wins.
+    s2_drugs is re-ordered in place (dynamic re-ordering).
     """
-    cdef int i, j, k
+    cdef int i, j, k, tmp
+    cdef int move
     cdef double tp = 0.0
     cdef double tpx, tpy
     cdef double s2_time_i, s1_time_j
-    cdef object score_match, Hup, Hmid, Hbot
-    cdef int traceVal
-    cdef double matVal
+    cdef double Hup, Hmid, Hbot, best
 
     i = 1
     while i < s2_len + 1:
@@ -94,7 +98,7 @@ cdef TSW_scoreMat(
 
             # Dynamic re-ordering
             if i > 1 and i < s2_len:
-                if min(s1_time_j, s2_time_i) == 0.0:
+                if fmin(s1_time_j, s2_time_i) == 0.0:
                     if s1_drugs[j - 1] == s2_drugs[i - 1]:
                         # Start of regimen case
                         if j == 1 and s2_time_i == 0.0:
@@ -119,47 +123,275 @@ cdef TSW_scoreMat(
             if i == 1 and j == 1:
                 tp = 0.0
             else:
-                tpx = s2_time_i + float(TR[i - 1][j - 1])
-                tpy = s1_time_j + float(TC[i - 1][j - 1])
-                tp = float(lossFunction(T, tpx, tpy, method, i, j))
-
-            # Score
-            score_match = score(s, s1_drugs[j - 1], s2_drugs[i - 1])
+                tpx = s2_time_i + TR[i - 1, j - 1]
+                tpy = s1_time_j + TC[i - 1, j - 1]
+                tp = lossFunction(T, tpx, tpy, method, i, j)
 
             # Candidate scores
-            Hup = H[i - 1][j - 1] + score_match - tp
-            Hmid = H[i - 1][j] - g
-            Hbot = H[i][j - 1] - g
+            Hup = H[i - 1, j - 1] + s[s1_drugs[j - 1], s2_drugs[i - 1]] - tp
+            Hmid = H[i - 1, j] - g
+            Hbot = H[i, j - 1] - g
 
-            # Select move
-            H[i][j] = max([0, Hup, Hmid, Hbot])
-            traceMat[i][j] = [0, Hup, Hmid, Hbot].index(H[i][j])
+            # Select move, first maximum wins
+            best = 0.0
+            move = 0
+            if Hup > best:
+                best = Hup
+                move = 1
+            if Hmid > best:
+                best = Hmid
+                move = 2
+            if Hbot > best:
+                best = Hbot
+                move = 3
 
-            traceVal = int(traceMat[i][j])
-            matVal = float(H[i][j])
+            H[i, j] = best
+            traceMat[i, j] = move
 
             # DIAGONAL
-            if traceVal == 1:
-                TR[i][j] = 0
-                TC[i][j] = 0
+            if move == 1:
+                TR[i, j] = 0
+                TC[i, j] = 0
             # HORIZONTAL
-            elif traceVal == 2:
-                TR[i][j] = TR[i - 1][j] + s2_time_i
-                TC[i][j] = TC[i - 1][j]
+            elif move == 2:
+                TR[i, j] = TR[i - 1, j] + s2_time_i
+                TC[i, j] = TC[i - 1, j]
             # VERTICAL
-            elif traceVal == 3:
-                TR[i][j] = TC[i][j - 1]
-                TC[i][j] = TC[i][j - 1] + s1_time_j
+            elif move == 3:
+                TR[i, j] = TC[i, j - 1]
+                TC[i, j] = TC[i, j - 1] + s1_time_j
 
             # Edge penalty
             if j == s1_len and i < s2_len:
                 if s2_time[i] < s1_time[0]:
-                    H[i][j] = max(
-                        H[i][j]
-                        - lossFunction(T, s2_time[i], s1_time[0], method, i, j),
-                        0,
-                    )
+                    best = H[i, j] - lossFunction(T, s2_time[i], s1_time[0], method, i, j)
+                    if best < 0:
+                        best = 0.0
+                    H[i, j] = best
 
             j += 1
         i += 1
 
+
+# ----------------------------
+# Low-memory variant
+# Rolling H/TR/TC rows, 2-bit packed trace
+# ----------------------------
+cdef int lowmem_ring_rows(double[:] s2_time, int s2_len) noexcept nogil:
+    """
+    Number of rolling rows needed by TSW_scoreMat_lowmem_nogil.
+    Dynamic re-ordering steps back one row per consecutive same-day entry,
+    so the ring spans the longest run of zero gaps plus two rows.
+    """
+    cdef int i
+    cdef int run = 0
+    cdef int longest = 0
+
+    for i in range(s2_len):
+        if s2_time[i] == 0.0:
+            run += 1
+            if run > longest:
+                longest = run
+        else:
+            run = 0
+    return longest + 2
+
+
+cdef int window_last_row(double[:] s2_time, int s2_len, int row) noexcept nogil:
+    """
+    Last row to fill so that rows 0..row end up exactly as in a full pass.
+    A later row can only step back (dynamic re-ordering) across zero gaps,
+    so the window is extended over the same-day run following `row`.
+    """
+    while row < s2_len and s2_time[row] == 0.0:
+        row += 1
+    return row
+
+
+cdef void TSW_scoreMat_lowmem_nogil(
+    double[:] s1_time,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_time,
+    int[:] s2_drugs,
+    int s2_len,
+    double g,
+    double T,
+    double[:, :] H,
+    double[:, :] TR,
+    double[:, :] TC,
+    unsigned char[:, :] traceMat,
+    double[:] H_col,
+    double[:, :] s,
+    int method,
+    int last_row
+) noexcept nogil:
+    """
+    Same recurrences as TSW_scoreMat_nogil, with linear memory.
+    H, TR, TC : (lowmem_ring_rows, s1_len + 1) rolling rows, row i in i % n.
+    traceMat : (last_row + 1, s1_len // 4 + 1) moves, four cells per byte,
+    or an empty (0, 0) array for a score-only pass.
+    H_col : (s2_len + 1) last column of H, the input of find_best_score_col.
+    last_row : fill rows 1..last_row only (s2_len for a full pass, see
+    window_last_row).
+    None of the buffers need to be zeroed by the caller.
+    """
+    cdef int n_rows = H.shape[0]
+    cdef bint keep_trace = traceMat.shape[0] > 0
+    cdef int i, j, k, tmp
+    cdef int cur, prev, top
+    cdef int move, shift
+    cdef double tp = 0.0
+    cdef double tpx, tpy
+    cdef double s2_time_i, s1_time_j
+    cdef double Hup, Hmid, Hbot, best
+
+    # Row 0: all zeros
+    for j in range(s1_len + 1):
+        H[0, j] = 0.0
+        TR[0, j] = 0.0
+        TC[0, j] = 0.0
+    for j in range(traceMat.shape[1]):
+        traceMat[0, j] = 0
+    H_col[0] = 0.0
+    top = 0
+
+    i = 1
+    while i < last_row + 1:
+        # First visit of row i: clear its ring slot and trace row
+        if i > top:
+            cur = i % n_rows
+            for j in range(s1_len + 1):
+                H[cur, j] = 0.0
+                TR[cur, j] = 0.0
+                TC[cur, j] = 0.0
+            if keep_trace:
+                for j in range(traceMat.shape[1]):
+                    traceMat[i, j] = 0
+            top = i
+
+        j = 1
+        while j < s1_len + 1:
+            cur = i % n_rows
+            prev = (i - 1) % n_rows
+            s2_time_i = s2_time[i - 1]
+            s1_time_j = s1_time[j - 1]
+
+            # Dynamic re-ordering
+            if i > 1 and i < s2_len:
+                if fmin(s1_time_j, s2_time_i) == 0.0:
+                    if s1_drugs[j - 1] == s2_drugs[i - 1]:
+                        # Start of regimen case
+                        if j == 1 and s2_time_i == 0.0:
+                            k = i - 1
+                            tmp = s2_drugs[i - 1]
+                            s2_drugs[i - 1] = s2_drugs[k - 1]
+                            s2_drugs[k - 1] = tmp
+                            i -= 1
+                            continue
+
+                        # End of regimen case
+                        elif j == s1_len and s2_time_i == 0.0:
+                            k = i + 1
+                            if s2_time[k - 1] == 0.0:
+                                tmp = s2_drugs[i - 1]
+                                s2_drugs[i - 1] = s2_drugs[k - 1]
+                                s2_drugs[k - 1] = tmp
+                                i -= 1
+                                continue
+
+            # Time penalty
+            if i == 1 and j == 1:
+                tp = 0.0
+            else:
+                tpx = s2_time_i + TR[prev, j - 1]
+                tpy = s1_time_j + TC[prev, j - 1]
+                tp = lossFunction(T, tpx, tpy, method, i, j)
+
+            # Candidate scores
+            Hup = H[prev, j - 1] + s[s1_drugs[j - 1], s2_drugs[i - 1]] - tp
+            Hmid = H[prev, j] - g
+            Hbot = H[cur, j - 1] - g
+
+            # Select move, first maximum wins
+            best = 0.0
+            move = 0
+            if Hup > best:
+                best = Hup
+                move = 1
+            if Hmid > best:
+                best = Hmid
+                move = 2
+            if Hbot > best:
+                best = Hbot
+                move = 3
+
+            H[cur, j] = best
+            if keep_trace:
+                shift = (j & 3) << 1
+                traceMat[i, j >> 2] = (traceMat[i, j >> 2] & ~(3 << shift)) | (move << shift)
+
+            # DIAGONAL
+            if move == 1:
+                TR[cur, j] = 0
+                TC[cur, j] = 0
+            # HORIZONTAL
+            elif move == 2:
+                TR[cur, j] = TR[prev, j] + s2_time_i
+                TC[cur, j] = TC[prev, j]
+            # VERTICAL
+            elif move == 3:
+                TR[cur, j] = TC[cur, j - 1]
+                TC[cur, j] = TC[cur, j - 1] + s1_time_j
+
+            if j == s1_len:
+                # Edge penalty
+                if i < s2_len and s2_time[i] < s1_time[0]:
+                    best = H[cur, j] - lossFunction(T, s2_time[i], s1_time[0], method, i, j)
+                    if best < 0:
+                        best = 0.0
+                    H[cur, j] = best
+                H_col[i] = H[cur, j]
+
+            j += 1
+        i += 1
+
+
+# ----------------------------
+# Core Scoring Function
+# Will be called with python headers
+# python callable
+# (entrypoint in main)
+# ----------------------------
+cdef TSW_scoreMat(
+    double[:] s1_time,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_time,
+    int[:] s2_drugs,
+    int s2_len,
+    double g,
+    double T,
+    double[:, :] H,
+    double[:, :] TR,
+    double[:, :] TC,
+    int[:, :] traceMat,
+    double[:, :] s,
+    str method
+):
+    """
+    Cython-accelerated version with separated time and drug lists.
+    Inputs:
+        s1_time, s2_time : float or double arrays/lists
+        s1_drugs, s2_drugs : lists of strings or comparable objects
+        H, TR, TC, traceMat : Python nested lists (matrices)
+    """
+    cdef int method_code = loss_method_code(method)
+
+    with nogil:
+        TSW_scoreMat_nogil(
+            s1_time, s1_drugs, s1_len,
+            s2_time, s2_drugs, s2_len,
+            g, T, H, TR, TC, traceMat, s,
+            method_code,
+        )
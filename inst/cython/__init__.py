@@ -1,5 +1,27 @@
-from .run_TSW import align_patients_regimens_fast
+from .run_TSW import (
+    align_patients_regimens_fast,
+    align_patient_regimens,
+    iter_alignments,
+    write_alignments,
+    encode_bulk,
+    unique_records,
+    CohortStore,
+    AlignmentCache,
+    RegimenCatalog,
+    AlignmentResults,
+    Workspace,
+)
 
 __all__ = [
     align_patients_regimens_fast,
+    align_patient_regimens,
+    iter_alignments,
+    write_alignments,
+    encode_bulk,
+    unique_records,
+    CohortStore,
+    AlignmentCache,
+    RegimenCatalog,
+    AlignmentResults,
+    Workspace,
 ]
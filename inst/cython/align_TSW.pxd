@@ -15,4 +15,54 @@ cdef aTSW (
     np.ndarray[np.int32_t, ndim=2] mem_index,
     np.ndarray[np.float64_t, ndim=1] mem_score,
     np.ndarray[object, ndim=1] drug_names
-)
\ No newline at end of file
+)
+
+cdef aTSW_packed (
+    unsigned char[:, :] traceMat,
+    double[:] s1_times,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_times,
+    int[:] s2_drugs,
+    int s2_len,
+    np.ndarray[np.int32_t, ndim=2] mem_index,
+    np.ndarray[np.float64_t, ndim=1] mem_score,
+    np.ndarray[object, ndim=1] drug_names
+)
+
+# Traced paths of one endpoint set: aligned s1 / s2 index per step (-1 for
+# a gap), grown with realloc by trace_paths_nogil, released by free_paths
+cdef struct PathBuffer:
+    int* s1
+    int* s2
+    Py_ssize_t cap
+
+cdef int trace_paths_nogil(
+    int[:, :] traceMat,
+    unsigned char[:, :] packed,
+    bint is_packed,
+    int s1_len,
+    int s2_len,
+    int[:, :] mem_index,
+    double[:] mem_score,
+    int n,
+    PathBuffer* paths,
+    int[:] path_off,
+    double[:, :] scores,
+    int[:, :] pos
+) noexcept nogil
+
+cdef void free_paths(PathBuffer* paths) noexcept nogil
+
+cdef np.ndarray render_paths(
+    PathBuffer* paths,
+    int[:] path_off,
+    int n,
+    double[:] s1_times,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_times,
+    int[:] s2_drugs,
+    int s2_len,
+    np.ndarray[object, ndim=1] drug_names
+)
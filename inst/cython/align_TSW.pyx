@@ -3,29 +3,19 @@
 import numpy as np
 cimport numpy as np
 from libc.math cimport fabs, fmax
-from cpython.unicode cimport PyUnicode_AsUTF8AndSize
+from libc.stdlib cimport free, realloc
 
-# ---- helper must be at top-level ----
-cdef inline int count_trailing_gaps(str seq):
-    cdef:
-        const char* data
-        Py_ssize_t length
-        int i, count = 0
-
-    data = PyUnicode_AsUTF8AndSize(seq, &length)
-    if data == NULL:
-        return 0  # safety fallback
-
-    i = <int>length - 1
-    while i >= 1:
-        if data[i] == ord('_') and data[i-1] == ord('_'):
-            count += 1
-            i -= 2
-            if i >= 0 and data[i] == ord(';'):
-                i -= 1
-        else:
-            break
-    return count
+# ---- trace lookup, plain int matrix or 2-bit packed rows ----
+cdef inline int trace_at(
+    int[:, :] traceMat,
+    unsigned char[:, :] packed,
+    bint is_packed,
+    int j,
+    int i
+) noexcept nogil:
+    if is_packed:
+        return (packed[j, i >> 2] >> ((i & 3) << 1)) & 3
+    return traceMat[j, i]
 
 
 cdef aTSW (
@@ -40,113 +30,286 @@ cdef aTSW (
     np.ndarray[np.float64_t, ndim=1] mem_score,
     np.ndarray[object, ndim=1] drug_names
 ):
+    return traceback_alignments(
+        traceMat, None, False,
+        s1_times, s1_drugs, s1_len,
+        s2_times, s2_drugs, s2_len,
+        mem_index, mem_score, drug_names,
+    )
+
+
+cdef aTSW_packed (
+    unsigned char[:, :] traceMat,
+    double[:] s1_times,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_times,
+    int[:] s2_drugs,
+    int s2_len,
+    np.ndarray[np.int32_t, ndim=2] mem_index,
+    np.ndarray[np.float64_t, ndim=1] mem_score,
+    np.ndarray[object, ndim=1] drug_names
+):
+    """
+    aTSW on the packed trace of TSW_scoreMat_lowmem_nogil
+    (four 2-bit moves per byte).
+    """
+    return traceback_alignments(
+        None, traceMat, True,
+        s1_times, s1_drugs, s1_len,
+        s2_times, s2_drugs, s2_len,
+        mem_index, mem_score, drug_names,
+    )
+
+
+cdef inline str path_token(int k, double[:] times, int[:] drugs, np.ndarray[object, ndim=1] drug_names):
+    cdef float time = times[k]
+    return f"{<int>time}.{drug_names[drugs[k]]}"
+
+
+cdef void free_paths(PathBuffer* paths) noexcept nogil:
+    free(paths.s1)
+    free(paths.s2)
+    paths.s1 = NULL
+    paths.s2 = NULL
+    paths.cap = 0
+
+
+cdef int _reserve_paths(PathBuffer* paths, Py_ssize_t need) noexcept nogil:
+    # Grows both buffers to at least need steps, -1 if out of memory
+    cdef Py_ssize_t cap
+    cdef int* grown
+    if need <= paths.cap:
+        return 0
+    cap = max(need, 2 * paths.cap)
+    grown = <int*>realloc(paths.s1, cap * sizeof(int))
+    if grown == NULL:
+        return -1
+    paths.s1 = grown
+    grown = <int*>realloc(paths.s2, cap * sizeof(int))
+    if grown == NULL:
+        return -1
+    paths.s2 = grown
+    paths.cap = cap
+    return 0
+
+
+cdef int trace_paths_nogil(
+    int[:, :] traceMat,
+    unsigned char[:, :] packed,
+    bint is_packed,
+    int s1_len,
+    int s2_len,
+    int[:, :] mem_index,
+    double[:] mem_score,
+    int n,
+    PathBuffer* paths,
+    int[:] path_off,
+    double[:, :] scores,
+    int[:, :] pos
+) noexcept nogil:
+    """
+    Traceback of the first n endpoints as integer paths, steps collected
+    end to start in paths, path idx at path_off[idx]:path_off[idx + 1].
+    Writes the scores (Score, adjustedS) and pos (regimen_Start,
+    regimen_End, drugRec_Start, drugRec_End, Aligned_Seq_len, totAlign)
+    rows of each endpoint. Returns -1 if the path buffer cannot grow.
+    """
     cdef:
-        int n = mem_index.shape[0]
-        int idx
-        int max_j, max_i, i, j
+        int idx, step
+        int max_j, max_i
+        int move
         int totAligned
-        int drug_id_1, drug_id_2
-        float time_1, time_2
-        int t1, t2
-        str s1_aligned, s2_aligned, temp_s1_aligned, temp_s2_aligned
+        int n_s1, n_s2
         int s_f_len, s1_end_gaps, s1_end, s2_end
         int s1_start, s2_start
+        int start, stop
+        Py_ssize_t used = 0
         double adjustedS
 
-    cdef object[:, :] results = np.empty((n, 10), dtype=object)
-
+    path_off[0] = 0
     for idx in range(n):
+        # A path has at most s1_len + s2_len + 1 steps
+        if _reserve_paths(paths, used + s1_len + s2_len + 1) < 0:
+            return -1
+
         max_j = mem_index[idx, 0]
         max_i = mem_index[idx, 1]
-        i = s1_len
-        j = s2_len
         totAligned = 0
-        s1_aligned = ""
-        s2_aligned = ""
-
-
-        # ---- traceback loop ----
-        while traceMat[max_j, max_i] > 0:
-            if traceMat[max_j, max_i] == 1:
-                time_1 = s1_times[max_i - 1]
-                drug_id_1 = s1_drugs[max_i - 1]
-                time_2 = s2_times[max_j - 1]
-                drug_id_2 = s2_drugs[max_j - 1]
-                t1 = <int>time_1
-                t2 = <int>time_2
-                temp_s1_aligned = f"{t1}.{drug_names[drug_id_1]}"
-                temp_s2_aligned = f"{t2}.{drug_names[drug_id_2]}"
+        n_s1 = 0
+        n_s2 = 0
+        s1_end_gaps = 0
+        start = <int>used
+
+        # ---- traceback loop, steps collected end to start ----
+        move = trace_at(traceMat, packed, is_packed, max_j, max_i)
+        while move > 0:
+            if move == 1:
+                paths.s1[used] = max_i - 1
+                paths.s2[used] = max_j - 1
                 max_i -= 1
                 max_j -= 1
-                i -= 1
-                j -= 1
                 totAligned += 1
-            elif traceMat[max_j, max_i] == 3:
-                time_1 = s1_times[max_i - 1]
-                t1 = <int>time_1
-                drug_id_1 = s1_drugs[max_i - 1]
-                temp_s1_aligned = f"{t1}.{drug_names[drug_id_1]}"
-                temp_s2_aligned = "__"
+            elif move == 3:
+                paths.s1[used] = max_i - 1
+                paths.s2[used] = -1
                 max_i -= 1
-                i -= 1
-            elif traceMat[max_j, max_i] == 2:
-                time_2 = s2_times[max_j - 1]
-                t2 = <int>time_2
-                drug_id_2 = s2_drugs[max_j - 1]
-                temp_s1_aligned = "__"
-                temp_s2_aligned = f"{t2}.{drug_names[drug_id_2]}"
+            elif move == 2:
+                paths.s1[used] = -1
+                paths.s2[used] = max_j - 1
                 max_j -= 1
-                j -= 1
-            s1_aligned = f"{temp_s1_aligned};{s1_aligned}"
-            s2_aligned = f"{temp_s2_aligned};{s2_aligned}"
+            used += 1
+            move = trace_at(traceMat, packed, is_packed, max_j, max_i)
 
         if max_i != 0 and max_j != 0:
-            time_1 = s1_times[max_i - 1]
-            drug_id_1 = s1_drugs[max_i - 1]
-            time_2 = s2_times[max_j - 1]
-            drug_id_2 = s2_drugs[max_j - 1]
-            t1 = <int>time_1
-            t2 = <int>time_2
-            temp_s1_aligned = f"{t1}.{drug_names[drug_id_1]}"
-            temp_s2_aligned = f"{t2}.{drug_names[drug_id_2]}"
+            paths.s1[used] = max_i - 1
+            paths.s2[used] = max_j - 1
             max_i -= 1
             max_j -= 1
-            i -= 1
-            j -= 1
             totAligned += 1
-            s1_aligned = f"{temp_s1_aligned};{s1_aligned}"
-            s2_aligned = f"{temp_s2_aligned};{s2_aligned}"
+            used += 1
+
+        stop = <int>used
+        path_off[idx + 1] = stop
+
+        # ---- post metrics from the path ----
+        for step in range(start, stop):
+            if paths.s1[step] >= 0:
+                n_s1 += 1
+            if paths.s2[step] >= 0:
+                n_s2 += 1
 
-        # ---- post metrics ----
-        s1_aligned_t = s1_aligned[:-1]
-        s2_aligned_t = s2_aligned[:-1]
+        # Trailing s1 gaps are the first steps of the reversed path
+        step = start
+        while step < stop and paths.s1[step] < 0:
+            s1_end_gaps += 1
+            step += 1
 
-        s_f_len = max(s1_aligned.count('.'), s2_aligned.count('.'))
+        s_f_len = max(n_s1, n_s2)
 
-        s1_end_gaps = count_trailing_gaps(s1_aligned_t)
-        
         s1_end = mem_index[idx, 1]
-        
+
         s2_end = mem_index[idx, 0] - s1_end_gaps
-        
+
         s1_start = max_i
         s2_start = max_j
         if (s1_start + 1) > 1:
-            totAligned = totAligned + (s1_end - (s1_start + 1))     
+            totAligned = totAligned + (s1_end - (s1_start + 1))
             s_f_len = s_f_len + (s1_end - (s1_start + 1))
 
         adjustedS = mem_score[idx] / totAligned
 
         # ---- save row ----
-        results[idx, 0] = s1_aligned_t       
-        results[idx, 1] = s2_aligned_t       
-        results[idx, 2] = mem_score[idx]     
-        results[idx, 3] = adjustedS          
-        results[idx, 4] = s1_start + 1       
-        results[idx, 5] = s1_end             
-        results[idx, 6] = s2_start + 1       
-        results[idx, 7] = s2_end             
-        results[idx, 8] = s_f_len            
-        results[idx, 9] = totAligned         
-
-    return np.asarray(results)
+        scores[idx, 0] = mem_score[idx]
+        scores[idx, 1] = adjustedS
+        pos[idx, 0] = s1_start + 1
+        pos[idx, 1] = s1_end
+        pos[idx, 2] = s2_start + 1
+        pos[idx, 3] = s2_end
+        pos[idx, 4] = s_f_len
+        pos[idx, 5] = totAligned
+
+    return 0
+
+
+cdef np.ndarray render_paths(
+    PathBuffer* paths,
+    int[:] path_off,
+    int n,
+    double[:] s1_times,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_times,
+    int[:] s2_drugs,
+    int s2_len,
+    np.ndarray[object, ndim=1] drug_names
+):
+    """
+    Regimen and DrugRecord strings (n, 2) of the paths of trace_paths_nogil,
+    one token per sequence element.
+    """
+    cdef:
+        int idx, k, step, start, stop
+        list s1_tokens, s2_tokens, parts
+    cdef np.ndarray seqs_arr = np.empty((n, 2), dtype=object)
+    cdef object[:, :] seqs = seqs_arr
+
+    s1_tokens = [path_token(k, s1_times, s1_drugs, drug_names) for k in range(s1_len)]
+    s2_tokens = [None] * s2_len
+
+    for idx in range(n):
+        start = path_off[idx]
+        stop = path_off[idx + 1]
+
+        parts = []
+        for step in range(stop - 1, start - 1, -1):
+            k = paths.s1[step]
+            parts.append("__" if k < 0 else s1_tokens[k])
+        seqs[idx, 0] = ";".join(parts)
+
+        parts = []
+        for step in range(stop - 1, start - 1, -1):
+            k = paths.s2[step]
+            if k < 0:
+                parts.append("__")
+            else:
+                if s2_tokens[k] is None:
+                    s2_tokens[k] = path_token(k, s2_times, s2_drugs, drug_names)
+                parts.append(s2_tokens[k])
+        seqs[idx, 1] = ";".join(parts)
+
+    return seqs_arr
+
+
+cdef traceback_alignments (
+    int[:, :] traceMat,
+    unsigned char[:, :] packed,
+    bint is_packed,
+    double[:] s1_times,
+    int[:] s1_drugs,
+    int s1_len,
+    double[:] s2_times,
+    int[:] s2_drugs,
+    int s2_len,
+    np.ndarray[np.int32_t, ndim=2] mem_index,
+    np.ndarray[np.float64_t, ndim=1] mem_score,
+    np.ndarray[object, ndim=1] drug_names
+):
+    """
+    Traceback of every endpoint as integer paths, metrics from the paths,
+    strings rendered at the end.
+    Returns typed columns (seqs, scores, pos):
+    seqs (n, 2) object: Regimen, DrugRecord
+    scores (n, 2) float64: Score, adjustedS
+    pos (n, 6) int32: regimen_Start, regimen_End, drugRec_Start,
+    drugRec_End, Aligned_Seq_len, totAlign
+    """
+    cdef:
+        int n = mem_index.shape[0]
+        int failed
+        PathBuffer paths
+        np.ndarray[np.int32_t, ndim=1] path_off = np.zeros(n + 1, dtype=np.int32)
+
+    cdef np.ndarray scores_arr = np.empty((n, 2), dtype=np.float64)
+    cdef np.ndarray pos_arr = np.empty((n, 6), dtype=np.int32)
+
+    paths.s1 = NULL
+    paths.s2 = NULL
+    paths.cap = 0
+    try:
+        failed = trace_paths_nogil(
+            traceMat, packed, is_packed, s1_len, s2_len,
+            mem_index, mem_score, n, &paths, path_off, scores_arr, pos_arr,
+        )
+        if failed:
+            raise MemoryError()
+        seqs_arr = render_paths(
+            &paths, path_off, n,
+            s1_times, s1_drugs, s1_len,
+            s2_times, s2_drugs, s2_len,
+            drug_names,
+        )
+    finally:
+        free_paths(&paths)
+
+    return seqs_arr, scores_arr, pos_arr
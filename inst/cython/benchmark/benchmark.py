@@ -1,157 +1,394 @@
-import pandas as pd
-import math as math
+"""
+Benchmark suite for the alignment backends.
 
-import sys 
+Every scenario of a fixed matrix (regimen length x record length x
+vocabulary size x cohort size) is built with sampling.generate and aligned
+by every backend in a fresh process: warmup runs first, then timed repeats.
+Like the R loader, that process imports the backend from its own directory
+only (--python-dir or --cython-dir on its PYTHONPATH), so the two main
+modules never meet. Results (time statistics, pairs/s and cells/s over the
+eligible pairs, and peak RSS) are written as JSON, and can be compared
+against a baseline JSON of an earlier run.
 
-sys.path.append("../../python")
-from init import *
-from score import *
-from align import *
-from score import TSW_scoreMat_cleaned as python_func
+Examples
+--------
+Build the Cython package first (python3 setup.py build_ext --inplace in
+inst/cython), then
 
-# ADD TSW_Package to path
-from TSW_Package import TSWc as cython_func
+    python benchmark.py --matrix quick --output base.json
+    # ... change something, rebuild ...
+    python benchmark.py --matrix quick --output new.json --baseline base.json
 
-from sampling import generate
+exits with status 1 when a scenario got slower (--statistic of the
+repeats, min by default) or bigger (peak RSS) than the baseline by more
+than the tolerances, or when the backends disagree on an alignment.
+"""
 
-# measure time
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
 import time
 
-def timit(tag, func, data):
-    start = time.perf_counter()
-    func(*data)
-    end = time.perf_counter()
-    print(f"{tag} - Execution time: {end - start:.6f} seconds")
-
-def test():
-    s1 = [
-        ["1", "a"],
-        ["1", "a"],
-    ]
-    s2 = [
-        ["0", "a"],
-        ["10", "a"],
-        ["11", "a"],
-    ]
-
-
-    s = {
-        "a": [1.0, -1.1, -1.1],
-        "b": [-1.1, 1.0, -1.1],
-        "c": [-1.1, -1.1, 1.0],
-    }
-    s = pd.DataFrame(s, index=["a", "b", "c"])
-    return s1,s2,s 
+import numpy as np
+import pandas as pd
 
+from sampling import generate
 
-def run_benchmark(s1, s2, s, print_mat=False):
+HERE = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.abspath(os.path.join(HERE, "..", "..", "python"))
+CYTHON_DIR = os.path.abspath(os.path.join(HERE, ".."))
 
-    g = 0.4
-    T = 0.5
-    method = "PropDiff"
+# regimen length x record length x vocabulary size x cohort size
+MATRICES = {
+    "quick": {
+        "regimen_length": [5],
+        "record_length": [50, 200],
+        "vocabulary": [6],
+        "cohort": [20],
+    },
+    "full": {
+        "regimen_length": [5, 20],
+        "record_length": [50, 500],
+        "vocabulary": [6, 30],
+        "cohort": [10, 100],
+    },
+}
 
-    s1_len = len(s1)
-    s2_len = len(s2)
-    # ------------------ python -------------------
+N_REGIMENS = 4
+N_TIMES = 3
 
-    # Initialise the 3 score matrices and the traceback matrix
-    H = init_Hmat(s1_len, s2_len, g)
-    TR = init_TRmat(s1, s1_len, s2, s2_len)
-    TC = init_TCmat(s1, s1_len, s2, s2_len)
-    traceMat = init_traceMat(s1_len, s2_len)
+BACKENDS = ["python", "cython", "cython-threads"]
 
-    timit("PYTHON", python_func, [s1, s1_len, s2, s2_len, g, T, H, TR, TC, traceMat, s, method])
 
-    if print_mat:
-        print("H =\n", H)
-        print("TR =\n", TR)
-        print("TC =\n", TC)
-        print("traceMat =\n", traceMat)
+def scenarios(matrix):
+    """
+    Scenario dicts of a matrix, with a stable name for comparisons.
+    """
+    keys = list(matrix)
+    for values in itertools.product(*(matrix[k] for k in keys)):
+        scenario = dict(zip(keys, values))
+        scenario["name"] = "reg{regimen_length}-rec{record_length}-voc{vocabulary}-n{cohort}".format(
+            **scenario
+        )
+        yield scenario
 
 
-    # ------------------ cython -------------------
+def make_cohort(scenario, seed=0):
+    """
+    Patients, regimens and similarity matrix of a scenario.
 
-    ## IMPORTANT ! Adding prep steps
+    Every regimen is the s1 of a generate call, and every patient record the
+    s2 of another one, with noise blocks sized so the record has about
+    record_length entries (N_TIMES embeddings of a regimen).
 
-    # This step prepare inputs for cythonized call make sure it has correct data and dtypes
-    drug2idx = {k: i for i, k in enumerate(s.keys())}
-    s_df = pd.DataFrame(s, index=["a", "b", "c"])
-    s_arr = np.ascontiguousarray(s_df.to_numpy(dtype=np.float64))  # matrix for cython
-    s1_times = np.ascontiguousarray([float(t) for t, d in s1], dtype=np.float64)
-    s2_times = np.ascontiguousarray([float(t) for t, d in s2], dtype=np.float64)
-    s1_drugs = np.ascontiguousarray([drug2idx[d] for t, d in s1], dtype=np.int32)
-    s2_drugs = np.ascontiguousarray([drug2idx[d] for t, d in s2], dtype=np.int32)
+    Returns
+    -------
+    patients, regimens, s : pandas.DataFrame
+    """
+    n_labels = scenario["vocabulary"]
+    seq_length = scenario["regimen_length"]
+    noise = max(0, scenario["record_length"] // N_TIMES - seq_length)
 
-    # Re-Initialise the 3 score matrices and the traceback matrix
-    H = init_Hmat(s1_len, s2_len, g)
-    TR = init_TRmat(s1, s1_len, s2, s2_len)
-    TC = init_TCmat(s1, s1_len, s2, s2_len)
-    traceMat = init_traceMat(s1_len, s2_len)
+    def seq(pairs):
+        return "".join(f"{t}.{d};" for t, d in pairs)
 
-    # Set dtypes
-    H        = np.ascontiguousarray(H, dtype=np.float64)
-    TR       = np.ascontiguousarray(TR, dtype=np.float64)
-    TC       = np.ascontiguousarray(TC, dtype=np.float64)
-    traceMat = np.ascontiguousarray(traceMat, dtype=np.int32)
-    s_arr    = np.ascontiguousarray(s_arr, dtype=np.float64)
+    s, _, _ = generate(n_labels=n_labels, seq_length=seq_length, seed=seed)
+    regimens = []
+    for k in range(N_REGIMENS):
+        _, s1, _ = generate(n_labels=n_labels, seq_length=seq_length, seed=seed + k)
+        regimens.append((f"R{k}", seq(s1)))
 
-    timit("CYTHON", cython_func, [s1_times, s1_drugs, s1_len,
-        s2_times, s2_drugs, s2_len,
-        g, T, H, TR, TC, traceMat,
-        s_arr, method])
+    patients = []
+    for k in range(scenario["cohort"]):
+        _, _, s2 = generate(
+            n_labels=n_labels,
+            seq_length=seq_length,
+            n_times=N_TIMES,
+            noise_block_len=(noise, noise),
+            seed=seed + N_REGIMENS + k,
+        )
+        patients.append((k, seq(s2)))
 
-    if print_mat:
-        print("H =\n", H)
-        print("TR =\n", TR)
-        print("TC =\n", TC)
-        print("traceMat =\n", traceMat)
+    return (
+        pd.DataFrame(patients, columns=["person_id", "seq"]),
+        pd.DataFrame(regimens, columns=["regName", "shortString"]),
+        s,
+    )
 
-if __name__ == "__main__":
 
-    print("Small test:")
-    s1,s2,s = test()
+def _load_backend(backend):
+    """
+    Alignment function of a backend, taking (patients, regimens, s), and its
+    RegimenCatalog class.
+
+    The backend directory has to be on the path of this process (run_case
+    is started by _run_isolated with it on PYTHONPATH).
+    """
+    if backend == "python":
+        from main import align_patients_regimens, RegimenCatalog
+
+        return lambda p, r, s: align_patients_regimens(p, r, s=s), RegimenCatalog
+
+    from run_TSW import align_patients_regimens_fast, RegimenCatalog
+
+    n_threads = os.cpu_count() if backend == "cython-threads" else 1
+    align = lambda p, r, s: align_patients_regimens_fast(
+        p, r, s=s, n_threads=n_threads, progress=False
+    )
+    return align, RegimenCatalog
+
+
+def _eligible_work(patients, regimens, catalog_class):
+    """
+    Number of (patient, regimen) pairs the aligners fill a matrix for, and
+    their cells (sum of record length x regimen length).
+
+    Pairs whose regimen has a drug missing from the record are skipped by
+    the aligners (RegimenCatalog.eligible), so they are not counted.
+    """
+    catalog = catalog_class(regimens)
+    regimen_lengths = np.diff(catalog.offsets)
+    n_pairs = 0
+    n_cells = 0
+    for seq in patients["seq"]:
+        record = [item.split(".")[1] for item in seq.rstrip(";").split(";")]
+        ids = catalog.eligible(set(record))
+        n_pairs += len(ids)
+        n_cells += len(record) * int(regimen_lengths[ids].sum())
+    return n_pairs, n_cells
+
+
+def _peak_rss_mb():
+    import resource
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_case(scenario, backend, warmup, repeats):
+    """
+    Time one backend on one scenario (run in a fresh process, so the peak
+    RSS is the one of this case alone).
+
+    Pairs/s and cells/s only count the eligible pairs (_eligible_work), and
+    are 0 when no pair is eligible.
 
-    run_benchmark(s1,s2,s)
+    Returns
+    -------
+    dict
+        Result record (see main).
+    """
+    align, catalog_class = _load_backend(backend)
+    patients, regimens, s = make_cohort(scenario)
 
-    print("Medium test:")
-    s, s1,s2 =  generate(
-            n_labels=6,
-            seq_length=5,     # your default request
-            n_times=3,        # three repetitions of s1
-            noise_block_len=(18,100),
-            seed=123
+    for _ in range(warmup):
+        align(patients, regimens, s)
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = align(patients, regimens, s)
+        times.append(time.perf_counter() - start)
+
+    n_pairs, n_cells = _eligible_work(patients, regimens, catalog_class)
+    median = statistics.median(times)
+
+    return {
+        "scenario": scenario["name"],
+        "params": {k: v for k, v in scenario.items() if k != "name"},
+        "backend": backend,
+        "warmup": warmup,
+        "repeats": repeats,
+        "times": times,
+        "min": min(times),
+        "median": median,
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "max": max(times),
+        "n_pairs": n_pairs,
+        "n_cells": n_cells,
+        "pairs_per_s": n_pairs / median if n_pairs else 0.0,
+        "cells_per_s": n_cells / median if n_cells else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "n_rows": int(out.shape[0]),
+        "digest": hashlib.sha1(out.to_csv(index=False).encode()).hexdigest(),
+    }
+
+
+def _run_isolated(scenario, backend, warmup, repeats, backend_dir):
+    """
+    run_case in a new interpreter whose PYTHONPATH holds backend_dir, so
+    only that backend can be imported (and peak RSS is the case's own).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        result = os.path.join(tmp, "result.json")
+        case = {
+            "scenario": scenario,
+            "backend": backend,
+            "warmup": warmup,
+            "repeats": repeats,
+        }
+        env = dict(os.environ, PYTHONPATH=backend_dir)
+        subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--case",
+                json.dumps(case),
+                "--result",
+                result,
+            ],
+            env=env,
+            check=True,
         )
-    
-    run_benchmark(s1,s2,s)
-
-    
-    print("Large test:")
-    s, s1,s2 =  generate(
-            n_labels=20,
-            seq_length=30,     # your default request
-            n_times=5,        # three repetitions of s1
-            noise_block_len=(180,1000),
-            seed=123
+        with open(result) as f:
+            return json.load(f)
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance, statistic="min"):
+    """
+    Regressions of results against a baseline run.
+
+    A case regresses when its time statistic ("min", "median" or "mean"
+    of the repeats) exceeds the baseline one by more than time_tolerance
+    (a fraction), or its peak RSS the baseline one by more than
+    memory_tolerance. Cases missing from either run are skipped.
+
+    Returns
+    -------
+    list of str
+        One message per regression.
+    """
+    base = {(r["scenario"], r["backend"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = base.get((r["scenario"], r["backend"]))
+        if b is None:
+            continue
+        ratio = r[statistic] / b[statistic]
+        memory = r["peak_rss_mb"] / b["peak_rss_mb"]
+        print(
+            f"{r['scenario']:<28} {r['backend']:<15} "
+            f"time x{ratio:5.2f}  rss x{memory:5.2f}"
         )
-    
-    print(s.shape)
-    print(len(s1), len(s1[1]))
-    print(len(s2), len(s2[1]))
-
-    
-    run_benchmark(s1,s2,s)
-
-    print("Huge test:")
-    s, s1,s2 =  generate(
-            n_labels=20,
-            seq_length=30,     # your default request
-            n_times=10,        # three repetitions of s1
-            noise_block_len=(2000,10000),
-            seed=123
+        if ratio > 1 + time_tolerance:
+            regressions.append(
+                f"{r['scenario']} {r['backend']}: {statistic} {r[statistic]:.4f}s "
+                f"vs {b[statistic]:.4f}s (x{ratio:.2f})"
+            )
+        if memory > 1 + memory_tolerance:
+            regressions.append(
+                f"{r['scenario']} {r['backend']}: peak RSS {r['peak_rss_mb']:.1f} MB "
+                f"vs {b['peak_rss_mb']:.1f} MB (x{memory:.2f})"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--matrix", choices=sorted(MATRICES), default="quick")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="JSON of an earlier run to compare against")
+    parser.add_argument(
+        "--statistic",
+        choices=["min", "median", "mean"],
+        default="min",
+        help="Time statistic compared against the baseline (default min)",
+    )
+    parser.add_argument(
+        "--time-tolerance",
+        type=float,
+        default=0.10,
+        help="Allowed slowdown, as a fraction (default 0.10)",
+    )
+    parser.add_argument(
+        "--memory-tolerance",
+        type=float,
+        default=0.10,
+        help="Allowed growth of the peak RSS, as a fraction (default 0.10)",
+    )
+    parser.add_argument(
+        "--python-dir",
+        default=PYTHON_DIR,
+        help="Directory importing as the Python backend (main)",
+    )
+    parser.add_argument(
+        "--cython-dir",
+        default=CYTHON_DIR,
+        help="Directory importing as the Cython backend (run_TSW, built in place)",
+    )
+    # Internal: run a single case in this process (see _run_isolated)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        with open(args.result, "w") as f:
+            json.dump(run_case(**json.loads(args.case)), f)
+        return 0
+
+    results = []
+    mismatches = []
+    for scenario in scenarios(MATRICES[args.matrix]):
+        for backend in args.backends:
+            backend_dir = args.python_dir if backend == "python" else args.cython_dir
+            r = _run_isolated(
+                scenario, backend, args.warmup, args.repeats, backend_dir
+            )
+            results.append(r)
+            print(
+                f"{r['scenario']:<28} {r['backend']:<15} "
+                f"median {r['median']:9.4f}s  {r['pairs_per_s']:10.1f} pairs/s  "
+                f"{r['cells_per_s']:12.0f} cells/s  {r['peak_rss_mb']:7.1f} MB"
+            )
+
+        # All backends must give the same alignments
+        digests = {r["digest"] for r in results if r["scenario"] == scenario["name"]}
+        if len(digests) > 1:
+            mismatches.append(scenario["name"])
+            print(f"MISMATCH: backends disagree on {scenario['name']}")
+
+    report = {
+        "meta": {
+            "matrix": args.matrix,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results,
+            baseline,
+            args.time_tolerance,
+            args.memory_tolerance,
+            args.statistic,
         )
-    
-    print(s.shape)
-    print(len(s1), len(s1[1]))
-    print(len(s2), len(s2[1]))
-    
-    run_benchmark(s1,s2,s)
\ No newline at end of file
+        for msg in regressions:
+            print("REGRESSION:", msg)
+    return 1 if regressions or mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,20 @@ import string
 import random
 from typing import Tuple, List
 
+def make_labels(n_labels: int) -> List[str]:
+    """
+    ASCII drug labels: a..z, then aa, ab, ..., zz, aaa, ...
+    """
+    labels = []
+    for i in range(1, n_labels + 1):
+        label = ""
+        while i:
+            i, r = divmod(i - 1, 26)
+            label = string.ascii_lowercase[r] + label
+        labels.append(label)
+    return labels
+
+
 def generate(
     n_labels: int = 6,
     seq_length: int = 3,              # ← default as requested
@@ -31,25 +45,7 @@ def generate(
     random.seed(seed)
     np.random.seed(seed)
 
-    # --- labels (ASCII) ---
-    if n_labels <= 26:
-        labels = list(string.ascii_lowercase[:n_labels])
-    else:
-        # extend beyond 'z' as aa, ab, ...
-        base = list(string.ascii_lowercase)
-        extra = []
-        k = n_labels - 26
-        i = 0
-        while len(extra) < k:
-            for a in base:
-                for b in base:
-                    extra.append(a + b)
-                    if len(extra) == k:
-                        break
-                if len(extra) == k:
-                    break
-            i += 1
-        labels = list(string.ascii_lowercase) + extra
+    labels = make_labels(n_labels)
 
     # --- similarity matrix s ---
     lo, hi = s_range
@@ -79,6 +75,111 @@ def generate(
     return s, s1, s2
 
 
+
+def generate_cohort(
+    n_patients: int = 1000,
+    n_regimens: int = 100,
+    n_labels: int = 60,
+    drugs_per_regimen: Tuple[int, int] = (1, 4),
+    cycle_lengths: Tuple[int, ...] = (21, 28, 14, 7),
+    cycles: Tuple[int, int] = (2, 6),
+    lines: Tuple[int, int] = (1, 4),
+    skew: float = 1.1,
+    length_sigma: float = 0.6,
+    noise: float = 0.1,
+    delay: float = 0.15,
+    seed: int = 42,
+):
+    """
+    Returns a synthetic cohort in the schema of align_patients_regimens:
+      patients : DataFrame [person_id, seq], seq = "gap.drug;gap.drug;..."
+      regimens : DataFrame [regName, shortString, cycleLength]
+
+    Regimens are 1-4 drugs given on the same day every cycleLength days
+    (one of cycle_lengths) for a number of cycles. Drugs are drawn with a
+    Zipf-like popularity (exponent skew), so popular drugs are shared by
+    many regimens.
+
+    Every patient goes through `lines` regimens, drawn with the same
+    popularity skew, each for a log-normal number of cycles (sigma
+    length_sigma around the regimen's own), so record lengths are heavy
+    tailed. Cycles are delayed by 1-7 days with probability delay, a drug
+    of a cycle is missed with probability noise / 2, and noise * events
+    unrelated drugs are added on random days. Drugs given on the same day
+    form one block, sorted by name, as in records built from a CDM.
+    """
+    if n_patients < 0 or n_regimens < 1 or n_labels < 1:
+        raise ValueError("n_patients must be >= 0, n_regimens and n_labels >= 1")
+    if drugs_per_regimen[0] < 1 or drugs_per_regimen[1] < drugs_per_regimen[0]:
+        raise ValueError("drugs_per_regimen must be a valid (min,max) with min>=1")
+    if cycles[0] < 1 or cycles[1] < cycles[0] or lines[0] < 1 or lines[1] < lines[0]:
+        raise ValueError("cycles and lines must be valid (min,max) with min>=1")
+
+    rng = np.random.default_rng(seed)
+    labels = np.array(make_labels(n_labels), dtype=object)
+
+    def zipf(n):
+        p = 1.0 / np.arange(1, n + 1) ** skew
+        return p / p.sum()
+
+    # --- regimens ---
+    drug_p = zipf(n_labels)
+    reg_drugs, reg_cycle, reg_cycles, rows = [], [], [], []
+    for j in range(n_regimens):
+        k = min(n_labels, rng.integers(drugs_per_regimen[0], drugs_per_regimen[1] + 1))
+        drugs = sorted(labels[rng.choice(n_labels, k, replace=False, p=drug_p)])
+        cycle = int(rng.choice(cycle_lengths))
+        n_cycles = int(rng.integers(cycles[0], cycles[1] + 1))
+        short = "".join(
+            f"{cycle if (q == 0 and c > 0) else 0}.{d};"
+            for c in range(n_cycles)
+            for q, d in enumerate(drugs)
+        )
+        reg_drugs.append(drugs)
+        reg_cycle.append(cycle)
+        reg_cycles.append(n_cycles)
+        rows.append((f"Regimen{j + 1}", short, cycle))
+    regimens = pd.DataFrame(rows, columns=["regName", "shortString", "cycleLength"])
+
+    # --- patients ---
+    reg_p = zipf(n_regimens)
+    rows = []
+    for person in range(1, n_patients + 1):
+        days, drugs = [], []
+        day = 0
+        n_lines = int(rng.integers(lines[0], lines[1] + 1))
+        for j in rng.choice(n_regimens, n_lines, p=reg_p):
+            n_cycles = max(1, int(round(rng.lognormal(np.log(reg_cycles[j]), length_sigma))))
+            for c in range(n_cycles):
+                if c > 0:
+                    day += reg_cycle[j]
+                    if rng.random() < delay:
+                        day += int(rng.integers(1, 8))
+                for d in reg_drugs[j]:
+                    if rng.random() >= noise / 2:
+                        days.append(day)
+                        drugs.append(d)
+            # time to the next line of treatment
+            day += int(rng.integers(reg_cycle[j], 4 * reg_cycle[j] + 60))
+
+        n_noise = rng.poisson(noise * max(1, len(days)))
+        days.extend(rng.integers(0, day + 1, n_noise).tolist())
+        drugs.extend(labels[rng.choice(n_labels, n_noise, p=drug_p)].tolist())
+        if not days:
+            days, drugs = [0], [reg_drugs[0][0]]
+
+        events = sorted(set(zip(days, drugs)))
+        prev = events[0][0]
+        seq = []
+        for d, drug in events:
+            seq.append(f"{d - prev}.{drug};")
+            prev = d
+        rows.append((person, "".join(seq)))
+    patients = pd.DataFrame(rows, columns=["person_id", "seq"])
+
+    return patients, regimens
+
+
 # --- Example run (seq_length=3 by default) ---
 if __name__ == "__main__":
     s, s1, s2 = generate(
@@ -8,4 +8,29 @@ cdef find_best_score(
     int s2_len,
     int mem,  # mem is often used as a control flow variable, keeping as 'int' is fine
     int verbose
-)
\ No newline at end of file
+)
+
+cdef find_best_score_col(
+    double[:] H_col,
+    int s1_len,
+    int s2_len,
+    int mem,
+    int verbose
+)
+
+# One candidate endpoint of select_endpoints_nogil
+cdef struct Endpoint:
+    double score
+    int row
+
+cdef int select_endpoints_nogil(
+    double[:] H_col,
+    int s1_len,
+    int s2_len,
+    int mem,
+    bint use_min_score,
+    double min_score,
+    Endpoint* order,
+    int[:, :] mem_index,
+    double[:] mem_score
+) noexcept nogil
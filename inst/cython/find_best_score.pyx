@@ -5,6 +5,7 @@
 import numpy as np
 cimport numpy as np
 import math
+from libc.stdlib cimport qsort
 
 
 cdef find_best_score(
@@ -18,74 +19,124 @@ cdef find_best_score(
     Cythonized version of find_best_score.
     Calculates best score and a list of potential alignment endpoints.
     """
+    return find_best_score_col(H[:, s1_len], s1_len, s2_len, mem, verbose)
+
+
+cdef find_best_score_col(
+    double[:] H_col,
+    int s1_len,
+    int s2_len,
+    int mem,
+    int verbose
+):
+    """
+    Same as find_best_score, but takes only the last column of H
+    (the only part of H that is ever read).
+    The mem-th best score is found by partial selection (O(n)); only the
+    endpoints within 90% of it are sorted, highest score first and ties by
+    highest row (a stable ascending sort, reversed).
+    Raises ValueError when mem is larger than the number of scores.
+    """
     cdef np.ndarray[np.float64_t, ndim=1] mem_score
-    cdef np.ndarray[np.float64_t, ndim=1] mem_score_sorted
-    cdef np.ndarray[np.int32_t, ndim=2] mem_index
-    cdef np.ndarray[np.int32_t, ndim=2] mem_index_sorted
+    cdef np.ndarray[np.int64_t, ndim=1] rows
     cdef np.ndarray[np.float64_t, ndim=1] mem_score_final
     cdef np.ndarray[np.int32_t, ndim=2] mem_index_final
 
-    cdef double max_score
-    cdef int max_idx, i
-    cdef tuple max_index
+    cdef int n = s2_len + 1
+    cdef int which_mem, k
     cdef double mem_min
 
-    # 1. Get score and index arrays
-    mem_score = np.asarray(H[:, s1_len].copy())
+    # 1. Get score array
+    mem_score = np.asarray(H_col, dtype=np.float64)
 
-    mem_index = np.empty((s2_len + 1, 2), dtype=np.int32)
-    
-    for i in range(s2_len + 1):
-        mem_index[i, 0] = i
-        mem_index[i, 1] = s1_len
-
-
-    # 2. Find max score
-    max_idx = np.argmax(mem_score)
-    max_score = mem_score[max_idx]
-    max_index = (max_idx, s1_len)
-
-
-    # 3. Sort arrays based on score
-    sort_indices = mem_score.argsort()
-    # Apply the sort indices to both arrays
-    mem_score_sorted = mem_score[sort_indices]
-    mem_index_sorted = mem_index[sort_indices]
+    # 2. Number of endpoints asked for
+    if mem == 0:
+        # Return empty 2D int array and 1D float array
+        mem_index_final = np.empty((0, 2), dtype=np.int32)
+        mem_score_final = np.empty((0,), dtype=np.float64)
+        return mem_index_final, mem_score_final
 
-    # 4. Filtering Logic
     if mem == -1:
         which_mem = max(1, math.floor(s2_len / s1_len))
-        # Get the score of the N-th best alignment (using negative index on sorted array)
-        mem_min = mem_score_sorted[-which_mem]
-        
-        # Create a boolean mask for filtering
-        mask = mem_score_sorted >= mem_min * 0.9
-
-        # Apply the mask to both arrays (these slices remain 1D/2D typed arrays)
-        mem_score_final = mem_score_sorted[mask]
-        mem_index_final = mem_index_sorted[mask]
-        
         if verbose == 2:
             print("Calculated mem: ")
             print(mem)
+    else: # mem >= 1
+        which_mem = mem
 
-    elif mem == 0:
-        # Return empty 2D int array and 1D float array
-        mem_index_final = np.empty((0, 2), dtype=np.int32)
-        mem_score_final = np.empty((0,), dtype=np.float64)
+    # 3. Score of the N-th best alignment, by partial selection
+    if which_mem > n:
+        raise ValueError(f"mem={which_mem} is larger than the number of scores ({n})")
+    k = n - which_mem
+    mem_min = np.partition(mem_score, k)[k]
 
-    else: # mem >= 1
-        mem_min = mem_score_sorted[-mem]
-        
-        mask = mem_score_sorted >= mem_min * 0.9
-        
-        mem_score_final = mem_score_sorted[mask]
-        mem_index_final = mem_index_sorted[mask]
+    # 4. Filtering Logic: every endpoint within 90% of it
+    rows = np.flatnonzero(mem_score >= mem_min * 0.9)
 
+    # 5. Highest score first
+    rows = rows[np.lexsort((rows, mem_score[rows]))[::-1]]
 
-    # 5. Reverse the order (highest score first)
-    # The arrays are currently sorted ascending by score; reverse to get descending.
-    mem_score_final = mem_score_final[::-1]
-    mem_index_final = mem_index_final[::-1]
+    mem_score_final = mem_score[rows]
+    mem_index_final = np.empty((rows.shape[0], 2), dtype=np.int32)
+    mem_index_final[:, 0] = rows
+    mem_index_final[:, 1] = s1_len
 
     return mem_index_final, mem_score_final
+
+
+cdef int _endpoint_order(const void* a, const void* b) noexcept nogil:
+    # Highest score first, ties by highest row
+    cdef const Endpoint* x = <const Endpoint*>a
+    cdef const Endpoint* y = <const Endpoint*>b
+    if x.score != y.score:
+        return -1 if x.score > y.score else 1
+    return y.row - x.row
+
+
+cdef int select_endpoints_nogil(
+    double[:] H_col,
+    int s1_len,
+    int s2_len,
+    int mem,
+    bint use_min_score,
+    double min_score,
+    Endpoint* order,
+    int[:, :] mem_index,
+    double[:] mem_score
+) noexcept nogil:
+    """
+    find_best_score_col without the GIL, for the parallel pair loop.
+    Writes the endpoints, in the same order, to mem_index and mem_score,
+    keeping only those with score > min_score if use_min_score. order is scratch space for s2_len + 1 endpoints.
+    Returns the number of endpoints, or -1 when mem is larger than the
+    number of scores.
+    """
+    cdef int n = s2_len + 1
+    cdef int which_mem, r, k = 0
+    cdef double cutoff
+
+    if mem == 0:
+        return 0
+    which_mem = mem
+    if mem == -1:
+        which_mem = max(1, s2_len // s1_len)
+    if which_mem > n:
+        return -1
+
+    # Sorted once: the mem-th best score, then the endpoints in order
+    for r in range(n):
+        order[r].score = H_col[r]
+        order[r].row = r
+    qsort(order, n, sizeof(Endpoint), _endpoint_order)
+
+    cutoff = order[which_mem - 1].score * 0.9
+    for r in range(n):
+        if not order[r].score >= cutoff:
+            break
+        if use_min_score and not order[r].score > min_score:
+            continue
+        mem_index[k, 0] = order[r].row
+        mem_index[k, 1] = s1_len
+        mem_score[k] = order[r].score
+        k += 1
+    return k
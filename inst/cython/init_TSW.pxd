@@ -9,13 +9,13 @@ ctypedef np.float64_t DTYPE_t
 ctypedef np.int32_t DTYPE_i
 
 # Initialize H matrix
-cdef init_Hmat(int s1_len, int s2_len)
+cdef init_Hmat(int s1_len, int s2_len, object workspace=*)
 
 # Initialize TR matrix
-cdef init_TRmat(int s1_len, int s2_len)
+cdef init_TRmat(int s1_len, int s2_len, object workspace=*)
 
 # Initialize TC matrix
-cdef init_TCmat(int s1_len, int s2_len)
+cdef init_TCmat(int s1_len, int s2_len, object workspace=*)
 
 # Initialize trace matrix
-cdef init_traceMat(int s1_len, int s2_len)
+cdef init_traceMat(int s1_len, int s2_len, object workspace=*)
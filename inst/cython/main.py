@@ -12,7 +12,15 @@ import sys, os
 # cython_dir = os.path.abspath(current_dir)  # normalize path
 # Add to Python path so you can import
 # sys.path.append(cython_dir)
-from TSW_Package import align_patients_regimens_fast
+from TSW_Package import (
+    align_patients_regimens_fast,
+    iter_alignments,
+    write_alignments,
+    CohortStore,
+    AlignmentCache,
+    RegimenCatalog,
+    Workspace,
+)
 
 
 pd.options.display.max_columns = None
@@ -32,6 +40,13 @@ def align_patients_regimens(
     mem=-1,
     removeOverlap=1,
     method="PropDiff",
+    n_threads=1,
+    low_memory=False,
+    min_score=None,
+    workspace=None,
+    cache=None,
+    min_adjusted_score=None,
+    window_margin=None,
 ):
     return align_patients_regimens_fast(
         patients,
@@ -47,6 +62,13 @@ def align_patients_regimens(
         mem=mem,
         removeOverlap=removeOverlap,
         method=method,
+        n_threads=n_threads,
+        low_memory=low_memory,
+        min_score=min_score,
+        workspace=workspace,
+        cache=cache,
+        min_adjusted_score=min_adjusted_score,
+        window_margin=window_margin,
     )
 
 
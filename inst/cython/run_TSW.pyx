@@ -7,6 +7,7 @@ from tqdm import tqdm
 
 # --- ADD TSW_Package to sys.path
 import sys, os
+import importlib.util
 
 # Full path to the current script
 #current_file = os.path.abspath(__file__)
@@ -19,10 +20,120 @@ import sys, os
 #sys.path.append(cython_dir)
 from init_TSW cimport init_Hmat, init_TCmat, init_TRmat, init_traceMat
 from TSW_scoreMat cimport TSW_scoreMat as TSWc
+from TSW_scoreMat cimport TSW_scoreMat_nogil, loss_method_code
+from TSW_scoreMat cimport TSW_scoreMat_lowmem_nogil, lowmem_ring_rows, window_last_row
 from find_best_score cimport find_best_score as fbs
-from align_TSW cimport aTSW
+from find_best_score cimport find_best_score_col as fbs_col
+from find_best_score cimport Endpoint, select_endpoints_nogil
+from align_TSW cimport aTSW, aTSW_packed
+from align_TSW cimport PathBuffer, trace_paths_nogil, render_paths, free_paths
+from libc.stdlib cimport calloc, free
+from cython.parallel cimport prange, parallel, threadid
+cimport openmp
 
 
+def _python_dir():
+    """
+    Directory of the Python backend (inst/python, installed as python/).
+    This module is built in cython/ or copied to cython/TSW_Package/, and
+    python/ is a sibling of cython/.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    for parent in (os.path.dirname(here), os.path.dirname(os.path.dirname(here))):
+        path = os.path.join(parent, "python")
+        if os.path.isfile(os.path.join(path, "catalog.py")):
+            return path
+    raise ImportError(f"Python backend directory not found next to {here}")
+
+
+def _load_python_modules(names):
+    """
+    Load modules of the Python backend under private names (_artemis_<name>),
+    so that modules of the same name elsewhere can neither shadow them nor
+    be shadowed. While they run, their flat imports of each other (e.g.
+    `from encoding import ...` in catalog) are pointed at the private
+    modules; sys.modules entries under the flat names are put back after.
+    Returns the modules by name, loaded in the given (dependency) order.
+    """
+    path = _python_dir()
+    saved = {name: sys.modules.get(name) for name in names}
+    modules = {}
+    try:
+        for name in names:
+            spec = importlib.util.spec_from_file_location(
+                f"_artemis_{name}", os.path.join(path, f"{name}.py")
+            )
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[spec.name] = module
+            sys.modules[name] = module
+            spec.loader.exec_module(module)
+            modules[name] = module
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+    return modules
+
+
+# The pure Python parts (DP workspace, drug record encoding, cohort store,
+# regimen catalog, alignment results and cache) are shared with the Python
+# backend rather than copied here
+_shared = _load_python_modules(
+    ["init", "encoding", "results", "cache", "catalog", "cohort"]
+)
+Workspace = _shared["init"].Workspace
+encode_bulk = _shared["encoding"].encode_bulk
+unique_records = _shared["encoding"].unique_records
+CohortStore = _shared["cohort"].CohortStore
+CohortWriter = _shared["cohort"].CohortWriter
+RegimenCatalog = _shared["catalog"].RegimenCatalog
+ALIGNMENT_COLUMNS = _shared["results"].ALIGNMENT_COLUMNS
+AlignmentResults = _shared["results"].AlignmentResults
+write_alignments = _shared["results"].write_alignments
+AlignmentCache = _shared["cache"].AlignmentCache
+
+# Pairs scored per thread before the (serial) traceback of a chunk
+cdef int PAIRS_PER_THREAD = 4
+
+
+cpdef np.ndarray similarity_matrix(list labels, object s=None):
+    """
+    Build the dense similarity array for a vocabulary of drug names.
+
+    Parameters
+    ----------
+    labels : list
+        Drug names, in drug id order.
+    s : pandas.DataFrame or None
+        User supplied similarity matrix, labelled by drug name on both axes.
+        With None, same drugs have similarity 1 and all others -1.1.
+
+    Returns
+    -------
+    numpy.ndarray
+        (len(labels), len(labels)) float64 array with sim[a, b] equal to
+        s[labels[a]][labels[b]], as in the Python backend.
+    """
+    cdef np.ndarray[np.float64_t, ndim=2] mat
+    cdef list missing
+
+    if s is None:
+        mat = np.identity(len(labels), dtype=np.float64)
+        mat[mat == 0] = -1.1
+        return mat
+
+    missing = [d for d in labels if d not in s.index or d not in s.columns]
+    if missing:
+        raise ValueError(
+            "Similarity matrix s has no entry for drug(s): "
+            + ", ".join([str(d) for d in missing])
+        )
+
+    # Copy: to_numpy() may hand out a read-only view
+    return np.array(s.loc[labels, labels].to_numpy(dtype=np.float64).T, order="C")
+
 
 cpdef object make_matrix(object val1, object val2):
     """
@@ -38,12 +149,11 @@ cpdef object make_matrix(object val1, object val2):
 
     Returns
     -------
-    pandas.DataFrame
-        Similarity matrix.
+    (numpy.ndarray, list)
+        Similarity matrix and its labels.
     """
-    cdef Py_ssize_t i, n1, n2, n
+    cdef Py_ssize_t i, n1, n2
     cdef list all_second, unique_vals
-    cdef np.ndarray[np.float64_t, ndim=2] mat
 
     n1 = len(val1)
     n2 = len(val2)
@@ -53,59 +163,89 @@ cpdef object make_matrix(object val1, object val2):
 
     # Remove duplicates while preserving order
     unique_vals = list(dict.fromkeys(all_second))
-    n = len(unique_vals)
-
-    # Create identity matrix with 1 on diagonal, -1.1 elsewhere
-    mat = np.identity(n, dtype=np.float64)
-    mat[mat == 0] = -1.1
 
-    # Build labeled DataFrame
-    return mat, unique_vals
+    return similarity_matrix(unique_vals), unique_vals
 
 
-cpdef object temporal_alignment(
-    object s1,
-    object s2,
+cdef object _align_pair(
+    double[:] s1_times,
+    int[:] s1_drugs,
+    double[:] s2_times,
+    int[:] s2_drugs,
     double g,
     double T,
-    object s,
-    bint verbose,
-    int mem=-1,
-    int removeOverlap=0,
-    object method="PropDiff"
+    double[:, :] s,
+    np.ndarray drug_names,
+    int verbose,
+    int mem,
+    str method,
+    bint low_memory=False,
+    object min_score=None,
+    object workspace=None,
 ):
     """
-    Perform temporal alignment between two drug records using the TSW algorithm.
-
-    Parameters
-    ----------
-    s1, s2 : list of [time, drug] pairs
-    g, T   : float penalties
-    s      : similarity matrix (or None)
-    verbose : bool
-    mem, removeOverlap : optional alignment controls
-    method : str
+    Align one encoded pair (drug ids into `s` and `drug_names`).
+    s2_drugs is re-ordered in place, pass a copy.
+    low_memory scores with rolling rows and a 2-bit packed trace.
+    min_score switches to the two-phase mode (_align_pair_two_phase).
+    The matrices are views of `workspace` (a Workspace), a fresh one if None.
     """
-    cdef int s1_len = len(s1)
-    cdef int s2_len = len(s2)
+    cdef int s1_len = s1_times.shape[0]
+    cdef int s2_len = s2_times.shape[0]
+    cdef int n_rows
+    cdef double[:, :] H_rows, TR_rows, TC_rows
+    cdef unsigned char[:, :] packed
+    cdef double[:] H_col
+    cdef int method_code
 
-    # Create similarity matrix if not provided
-    if s is None:
-        s, labels = make_matrix(s1, s2)
+    if workspace is None:
+        workspace = Workspace()
 
-    # Create matrices (H, TR, TC, traceMat)
-    H = init_Hmat(s1_len, s2_len)
+    if min_score is not None:
+        return _align_pair_two_phase(
+            s1_times, s1_drugs, s2_times, s2_drugs,
+            g, T, s, drug_names, verbose, mem, method, min_score, workspace,
+        )
 
-    TR = init_TRmat(s1_len, s2_len)
-    TC = init_TCmat(s1_len, s2_len)
-    traceMat = init_traceMat(s1_len, s2_len)
+    if low_memory:
+        # The low-memory kernel initialises its buffers itself
+        method_code = loss_method_code(method)
+        n_rows = lowmem_ring_rows(s2_times, s2_len)
+        H_rows = workspace.empty("H_rows", (n_rows, s1_len + 1), np.float64)
+        TR_rows = workspace.empty("TR_rows", (n_rows, s1_len + 1), np.float64)
+        TC_rows = workspace.empty("TC_rows", (n_rows, s1_len + 1), np.float64)
+        packed = workspace.empty("packed", (s2_len + 1, s1_len // 4 + 1), np.uint8)
+        H_col = workspace.empty("H_col", (s2_len + 1,), np.float64)
 
-    # Map drugs to numeric indices
-    cdef dict drug2idx = {k: i for i, k in enumerate(labels)}
-    cdef double[:] s1_times = np.ascontiguousarray([float(t) for t, d in s1], dtype=np.float64)
-    cdef double[:] s2_times = np.ascontiguousarray([float(t) for t, d in s2], dtype=np.float64)
-    cdef int[:] s1_drugs = np.ascontiguousarray([drug2idx[d] for t, d in s1], dtype=np.int32)
-    cdef int[:] s2_drugs = np.ascontiguousarray([drug2idx[d] for t, d in s2], dtype=np.int32)
+        with nogil:
+            TSW_scoreMat_lowmem_nogil(
+                s1_times, s1_drugs, s1_len,
+                s2_times, s2_drugs, s2_len,
+                g, T, H_rows, TR_rows, TC_rows, packed, H_col, s,
+                method_code, s2_len,
+            )
+
+        mem_index, mem_score = fbs_col(H_col, s1_len, s2_len, mem, verbose)
+        returnDat = aTSW_packed(
+            packed,
+            s1_times,
+            s1_drugs,
+            s1_len,
+            s2_times,
+            s2_drugs,
+            s2_len,
+            mem_index,
+            mem_score,
+            drug_names,
+        )
+        return _alignment_frame(returnDat)
+
+    # Create matrices (H, TR, TC, traceMat)
+    H = init_Hmat(s1_len, s2_len, workspace)
+
+    TR = init_TRmat(s1_len, s2_len, workspace)
+    TC = init_TCmat(s1_len, s2_len, workspace)
+    traceMat = init_traceMat(s1_len, s2_len, workspace)
 
     # Call temporal scoring function (TSWc)
     TSWc(
@@ -129,8 +269,6 @@ cpdef object temporal_alignment(
     mem_index, mem_score = fbs(H, s1_len, s2_len, mem, verbose)
 
     # Perform alignment reconstruction
-    drug_names = np.array(list(drug2idx.keys()), dtype=object)
-
     returnDat = aTSW(
         traceMat,
         s1_times,
@@ -145,21 +283,134 @@ cpdef object temporal_alignment(
     )
 
     # Return as DataFrame
-    returnDat = pd.DataFrame(returnDat)
-    returnDat.columns = [
-        "Regimen",
-        "DrugRecord",
-        "Score",
-        "adjustedS",
-        "regimen_Start",
-        "regimen_End",
-        "drugRec_Start",
-        "drugRec_End",
-        "Aligned_Seq_len",
-        "totAlign",
-    ]
+    return _alignment_frame(returnDat)
+
+
+cdef tuple _select_endpoints(
+    np.ndarray mem_index, np.ndarray mem_score, double min_score
+):
+    """
+    Endpoints of find_best_score_col scoring above min_score.
+    adjustedS = Score / totAlign with totAlign >= 1, so an endpoint with
+    Score <= min_score can never pass an adjustedS > min_score filter.
+    """
+    keep = mem_score > min_score
+    return mem_index[keep], mem_score[keep]
+
+
+cdef object _align_pair_two_phase(
+    double[:] s1_times,
+    int[:] s1_drugs,
+    double[:] s2_times,
+    int[:] s2_drugs,
+    double g,
+    double T,
+    double[:, :] s,
+    np.ndarray drug_names,
+    int verbose,
+    int mem,
+    str method,
+    double min_score,
+    object workspace,
+):
+    """
+    Two-phase alignment of one encoded pair.
+    Phase one only computes the last column of H (no trace matrix) and
+    selects the endpoints (mem, then min_score). Phase two, for pairs that
+    kept an endpoint, re-fills the rows up to the deepest one with a packed
+    trace and traces back. Rows are those of _align_pair restricted to
+    Score > min_score.
+    """
+    cdef int s1_len = s1_times.shape[0]
+    cdef int s2_len = s2_times.shape[0]
+    cdef int method_code = loss_method_code(method)
+    cdef int n_rows = lowmem_ring_rows(s2_times, s2_len)
+    cdef int last_row
+    cdef double[:, :] H_rows = workspace.empty("H_rows", (n_rows, s1_len + 1), np.float64)
+    cdef double[:, :] TR_rows = workspace.empty("TR_rows", (n_rows, s1_len + 1), np.float64)
+    cdef double[:, :] TC_rows = workspace.empty("TC_rows", (n_rows, s1_len + 1), np.float64)
+    cdef double[:] H_col = workspace.empty("H_col", (s2_len + 1,), np.float64)
+    cdef unsigned char[:, :] packed = workspace.empty("packed", (0, 0), np.uint8)
+    # Phase one re-orders a scratch copy, phase two starts from s2_drugs
+    cdef int[:] s2_scratch = workspace.empty("s2_scratch", (s2_len,), np.int32)
+    s2_scratch[:] = s2_drugs
+
+    with nogil:
+        TSW_scoreMat_lowmem_nogil(
+            s1_times, s1_drugs, s1_len,
+            s2_times, s2_scratch, s2_len,
+            g, T, H_rows, TR_rows, TC_rows, packed, H_col, s,
+            method_code, s2_len,
+        )
+
+    mem_index, mem_score = fbs_col(H_col, s1_len, s2_len, mem, verbose)
+    mem_index, mem_score = _select_endpoints(mem_index, mem_score, min_score)
+
+    if mem_index.shape[0] > 0:
+        last_row = window_last_row(s2_times, s2_len, mem_index[:, 0].max())
+        packed = workspace.empty("packed", (last_row + 1, s1_len // 4 + 1), np.uint8)
+        with nogil:
+            TSW_scoreMat_lowmem_nogil(
+                s1_times, s1_drugs, s1_len,
+                s2_times, s2_drugs, s2_len,
+                g, T, H_rows, TR_rows, TC_rows, packed, H_col, s,
+                method_code, last_row,
+            )
+
+    returnDat = aTSW_packed(
+        packed,
+        s1_times,
+        s1_drugs,
+        s1_len,
+        s2_times,
+        s2_drugs,
+        s2_len,
+        mem_index,
+        mem_score,
+        drug_names,
+    )
+    return _alignment_frame(returnDat)
+
+
+cpdef object temporal_alignment(
+    object s1,
+    object s2,
+    double g,
+    double T,
+    object s,
+    bint verbose,
+    int mem=-1,
+    int removeOverlap=0,
+    object method="PropDiff"
+):
+    """
+    Perform temporal alignment between two drug records using the TSW algorithm.
+
+    Parameters
+    ----------
+    s1, s2 : list of [time, drug] pairs
+    g, T   : float penalties
+    s      : similarity matrix (pandas.DataFrame labelled by drug) or None
+    verbose : bool
+    mem, removeOverlap : optional alignment controls
+    method : str
+    """
+    # Vocabulary of this pair only; runs share one (see align_patients_regimens_fast)
+    cdef list labels = list(dict.fromkeys([d for t, d in s1] + [d for t, d in s2]))
+    cdef dict drug2idx = {k: i for i, k in enumerate(labels)}
 
-    return returnDat
+    s_arr = similarity_matrix(labels, s)
+    drug_names = np.array(labels, dtype=object)
+
+    s1_times = np.ascontiguousarray([float(t) for t, d in s1], dtype=np.float64)
+    s2_times = np.ascontiguousarray([float(t) for t, d in s2], dtype=np.float64)
+    s1_drugs = np.ascontiguousarray([drug2idx[d] for t, d in s1], dtype=np.int32)
+    s2_drugs = np.ascontiguousarray([drug2idx[d] for t, d in s2], dtype=np.int32)
+
+    return _align_pair(
+        s1_times, s1_drugs, s2_times, s2_drugs,
+        g, T, s_arr, drug_names, verbose, mem, method,
+    )
 
 
 cdef list encode_c(str str_seq):
@@ -180,6 +431,787 @@ cdef list encode_c(str str_seq):
     return s_encoded
 
 
+cdef tuple _take_ranges(np.ndarray times, np.ndarray drug_ids, np.ndarray starts, np.ndarray ends):
+    """
+    CSR arrays (offsets, times, drug_ids) of the event ranges starts:ends
+    of (times, drug_ids).
+    """
+    lengths = ends - starts
+    new_offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    n = len(starts)
+    events = np.arange(new_offsets[n]) + np.repeat(starts - new_offsets[:n], lengths)
+    return new_offsets, np.ascontiguousarray(times[events]), np.ascontiguousarray(drug_ids[events])
+
+
+cdef object _alignment_frame(tuple block):
+    """
+    DataFrame of a single aTSW block.
+    """
+    results = AlignmentResults(capacity=block[0].shape[0])
+    results.append(block)
+    return results.to_frame()
+
+
+cdef void _zero_block(double[:, :] M, int n_rows, int n_cols) noexcept nogil:
+    cdef int i, j
+    for i in range(n_rows):
+        for j in range(n_cols):
+            M[i, j] = 0.0
+
+
+cdef void _score_pair(
+    double[:] reg_times,
+    int[:] reg_drugs,
+    int r0,
+    int s1_len,
+    double[:] pat_times,
+    int[:] pat_drugs,
+    int p0,
+    int s2_len,
+    double g,
+    double T,
+    double[:, :] H,
+    double[:, :] TR,
+    double[:, :] TC,
+    int[:, :] traceMat,
+    double[:] H_col,
+    int[:] s2_drugs,
+    double[:, :] s,
+    int method
+) noexcept nogil:
+    """
+    Score one (regimen, patient) pair inside thread-owned workspaces.
+    Leaves the last column of H in H_col and the re-ordered patient drugs
+    in s2_drugs for the traceback.
+    """
+    cdef int i, j
+
+    for i in range(s2_len):
+        s2_drugs[i] = pat_drugs[p0 + i]
+
+    _zero_block(H, s2_len + 1, s1_len + 1)
+    _zero_block(TR, s2_len + 1, s1_len + 1)
+    _zero_block(TC, s2_len + 1, s1_len + 1)
+    for i in range(s2_len + 1):
+        for j in range(s1_len + 1):
+            traceMat[i, j] = 0
+
+    TSW_scoreMat_nogil(
+        reg_times[r0:r0 + s1_len],
+        reg_drugs[r0:r0 + s1_len],
+        s1_len,
+        pat_times[p0:p0 + s2_len],
+        s2_drugs[:s2_len],
+        s2_len,
+        g,
+        T,
+        H[:s2_len + 1, :s1_len + 1],
+        TR[:s2_len + 1, :s1_len + 1],
+        TC[:s2_len + 1, :s1_len + 1],
+        traceMat[:s2_len + 1, :s1_len + 1],
+        s,
+        method,
+    )
+
+    for i in range(s2_len + 1):
+        H_col[i] = H[i, s1_len]
+
+
+cdef void _score_pair_lowmem(
+    double[:] reg_times,
+    int[:] reg_drugs,
+    int r0,
+    int s1_len,
+    double[:] pat_times,
+    int[:] pat_drugs,
+    int p0,
+    int s2_len,
+    double g,
+    double T,
+    double[:, :] H,
+    double[:, :] TR,
+    double[:, :] TC,
+    unsigned char[:, :] traceMat,
+    double[:] H_col,
+    int[:] s2_drugs,
+    double[:, :] s,
+    int method,
+    int last_row
+) noexcept nogil:
+    """
+    _score_pair with rolling H/TR/TC rows and a packed trace, filled up to
+    last_row. An empty traceMat gives a score-only pass (H_col only).
+    """
+    cdef int i
+
+    for i in range(s2_len):
+        s2_drugs[i] = pat_drugs[p0 + i]
+
+    TSW_scoreMat_lowmem_nogil(
+        reg_times[r0:r0 + s1_len],
+        reg_drugs[r0:r0 + s1_len],
+        s1_len,
+        pat_times[p0:p0 + s2_len],
+        s2_drugs[:s2_len],
+        s2_len,
+        g,
+        T,
+        H[:, :s1_len + 1],
+        TR[:, :s1_len + 1],
+        TC[:, :s1_len + 1],
+        traceMat[:last_row + 1, :s1_len // 4 + 1],
+        H_col[:s2_len + 1],
+        s,
+        method,
+        last_row,
+    )
+
+
+cdef dict _run_vocabulary(object catalog, list patients_encoded):
+    """
+    Intern every drug name of the run once. Regimen drugs keep their
+    catalog ids, drugs only seen in patient records are appended.
+    """
+    cdef dict drug2idx = dict(catalog.drug2idx)
+    cdef list rec
+    for rec in patients_encoded:
+        for t, d in rec:
+            if d not in drug2idx:
+                drug2idx[d] = len(drug2idx)
+    return drug2idx
+
+
+cdef void _align_patient_batch(
+    double[:] s2_times,
+    int[:] s2_drugs,
+    object catalog,
+    np.ndarray regimen_ids,
+    double g,
+    double T,
+    double[:, :] s,
+    np.ndarray drug_names,
+    int verbose,
+    int mem,
+    str method,
+    object min_score,
+    object workspace,
+    object results,
+    int patient=-1,
+):
+    """
+    Align one encoded patient against the catalog regimens `regimen_ids`.
+
+    The patient arrays are prepared once; every regimen is then scored in a
+    single nogil sweep (rolling H/TR/TC rows shared by all regimens, one
+    packed trace and H column per regimen) and traced back.
+    s2_drugs is not modified.
+    Rows are appended to `results` (an AlignmentResults) in regimen_ids
+    order, as rows of patient index `patient`.
+    """
+    cdef np.int64_t[:] r_off = catalog.offsets
+    cdef double[:] r_times = catalog.flat_times
+    cdef int[:] r_drugs = catalog.flat_drug_ids
+    cdef np.int64_t[:] ids = np.ascontiguousarray(regimen_ids, dtype=np.int64)
+    cdef Py_ssize_t n = ids.shape[0]
+    cdef int s2_len = s2_times.shape[0]
+    cdef int max_s1 = 0
+    cdef int r0, s1_len
+    cdef Py_ssize_t k
+
+    for k in range(n):
+        max_s1 = max(max_s1, <int>(r_off[ids[k] + 1] - r_off[ids[k]]))
+
+    cdef bint two_phase = min_score is not None
+    cdef int method_code = loss_method_code(method)
+    cdef int n_rows = lowmem_ring_rows(s2_times, s2_len)
+    cdef double[:, :] H_rows = workspace.empty("H_rows", (n_rows, max_s1 + 1), np.float64)
+    cdef double[:, :] TR_rows = workspace.empty("TR_rows", (n_rows, max_s1 + 1), np.float64)
+    cdef double[:, :] TC_rows = workspace.empty("TC_rows", (n_rows, max_s1 + 1), np.float64)
+    cdef unsigned char[:, :, :] packed_ws = workspace.empty(
+        "batch_packed", (n, s2_len + 1, max_s1 // 4 + 1), np.uint8
+    )
+    cdef double[:, :] col_ws = workspace.empty("batch_col", (n, s2_len + 1), np.float64)
+    cdef int[:, :] drugs_ws = workspace.empty("batch_drugs", (n, max(s2_len, 1)), np.int32)
+    cdef int[:] last_rows = workspace.empty("batch_last_rows", (n,), np.int32)
+    cdef unsigned char[:, :] no_trace = np.zeros((0, 0), dtype=np.uint8)
+
+    # --- Sweep 1: all regimens (score-only in two-phase mode) ---
+    with nogil:
+        for k in range(n):
+            r0 = <int>r_off[ids[k]]
+            s1_len = <int>(r_off[ids[k] + 1] - r0)
+            last_rows[k] = s2_len
+            _score_pair_lowmem(
+                r_times, r_drugs, r0, s1_len,
+                s2_times, s2_drugs, 0, s2_len,
+                g, T,
+                H_rows, TR_rows, TC_rows,
+                no_trace if two_phase else packed_ws[k], col_ws[k], drugs_ws[k],
+                s, method_code, s2_len,
+            )
+
+    # --- Endpoint selection ---
+    cdef list selected = []
+    for k in range(n):
+        s1_len = <int>(r_off[ids[k] + 1] - r_off[ids[k]])
+        mem_index, mem_score = fbs_col(col_ws[k, :s2_len + 1], s1_len, s2_len, mem, verbose)
+        if two_phase:
+            mem_index, mem_score = _select_endpoints(mem_index, mem_score, min_score)
+            last_rows[k] = -1
+            if mem_index.shape[0] > 0:
+                last_rows[k] = window_last_row(s2_times, s2_len, mem_index[:, 0].max())
+        selected.append((mem_index, mem_score))
+
+    # --- Sweep 2 (two-phase): traces of the regimens that kept an endpoint ---
+    if two_phase:
+        with nogil:
+            for k in range(n):
+                if last_rows[k] < 0:
+                    continue
+                r0 = <int>r_off[ids[k]]
+                s1_len = <int>(r_off[ids[k] + 1] - r0)
+                _score_pair_lowmem(
+                    r_times, r_drugs, r0, s1_len,
+                    s2_times, s2_drugs, 0, s2_len,
+                    g, T,
+                    H_rows, TR_rows, TC_rows,
+                    packed_ws[k], col_ws[k], drugs_ws[k],
+                    s, method_code, last_rows[k],
+                )
+
+    # --- Traceback ---
+    for k in range(n):
+        mem_index, mem_score = selected[k]
+        if mem_index.shape[0] == 0:
+            continue
+        r0 = <int>r_off[ids[k]]
+        s1_len = <int>(r_off[ids[k] + 1] - r0)
+        block = aTSW_packed(
+            packed_ws[k, :last_rows[k] + 1, :s1_len // 4 + 1],
+            r_times[r0:r0 + s1_len],
+            r_drugs[r0:r0 + s1_len],
+            s1_len,
+            s2_times,
+            drugs_ws[k, :s2_len],
+            s2_len,
+            mem_index,
+            mem_score,
+            drug_names,
+        )
+        results.append(block, ids[k], patient)
+
+
+def align_patient_regimens(
+    patient,
+    regimens,
+    regimen_ids=None,
+    double g=0.4,
+    double T=0.5,
+    s=None,
+    int verbose=0,
+    int mem=-1,
+    str method="PropDiff",
+    min_score=None,
+    workspace=None,
+):
+    """
+    Align one patient record against many regimens in one batched call.
+
+    patient : drug record, as a seq string ("t.drug;...") or as encoded
+    [time, drug] pairs.
+    regimens : RegimenCatalog (or regimen DataFrame with regName and
+    shortString columns).
+    regimen_ids : catalog indices of the regimens to align, by default the
+    eligible ones (every regimen drug in the record).
+    s, mem, method, min_score, workspace : as in align_patients_regimens_fast.
+    Returns one DataFrame (alignment columns, regName, Regimen_full), rows
+    in regimen_ids order.
+    """
+    if not isinstance(regimens, RegimenCatalog):
+        regimens = RegimenCatalog(regimens)
+    catalog = regimens
+
+    cdef list encoded = encode_c(patient) if isinstance(patient, str) else list(patient)
+    if regimen_ids is None:
+        regimen_ids = catalog.eligible(set(d for t, d in encoded))
+    if workspace is None:
+        workspace = Workspace()
+
+    cdef dict drug2idx = _run_vocabulary(catalog, [encoded])
+    cdef np.ndarray drug_names = np.array(list(drug2idx.keys()), dtype=object)
+    cdef double[:, :] s_arr = similarity_matrix(list(drug2idx.keys()), s)
+    s2_times = np.ascontiguousarray([float(t) for t, d in encoded], dtype=np.float64)
+    s2_drugs = np.ascontiguousarray([drug2idx[d] for t, d in encoded], dtype=np.int32)
+
+    results = AlignmentResults(catalog)
+    _align_patient_batch(
+        s2_times, s2_drugs, catalog, np.asarray(regimen_ids),
+        g, T, s_arr, drug_names, verbose, mem, method, min_score, workspace,
+        results,
+    )
+    return results.to_frame()
+
+
+cdef void _align_pairs_parallel(
+    object results,
+    object catalog,
+    list pairs,
+    np.int64_t[:] p_off,
+    double[:] p_times,
+    int[:] p_drugs,
+    double[:, :] s_arr,
+    np.ndarray drug_names,
+    double g,
+    double T,
+    int verbose,
+    int mem,
+    str method,
+    int n_threads,
+    bint low_memory=False,
+    object min_score=None,
+    object workspace=None,
+    bint progress=True,
+):
+    """
+    Score all eligible pairs with OpenMP and trace them back in pair order.
+
+    Pairs are processed in chunks: every pair of a chunk is scored, its
+    endpoints selected and traced back as integer paths in parallel
+    (each thread owns its H/TR/TC workspace, each pair its trace matrix
+    and output buffers), then the strings of the chunk are rendered and
+    its rows appended serially, so rows come out in the same order as the
+    serial loop.
+    With low_memory the thread workspaces only hold rolling rows and the
+    trace matrices are packed.
+    With min_score each pair is scored twice: a score-only pass, the
+    endpoint selection, then a packed re-fill up to the deepest endpoint
+    if it kept one.
+    All workspaces are views of `workspace` (a Workspace), so repeated
+    calls only allocate when a larger batch arrives.
+    Rows are appended to `results` (an AlignmentResults).
+    """
+    cdef np.int64_t[:] r_off = catalog.offsets
+    cdef double[:] r_times = catalog.flat_times
+    cdef int[:] r_drugs = catalog.flat_drug_ids
+
+    cdef Py_ssize_t n_pairs = len(pairs)
+    cdef np.int64_t[:] pair_pat = np.array([p for p, r in pairs], dtype=np.int64)
+    cdef np.int64_t[:] pair_reg = np.array([r for p, r in pairs], dtype=np.int64)
+
+    cdef bint two_phase = min_score is not None
+    cdef bint packed_trace = low_memory or two_phase
+    cdef int max_s2 = 0
+    cdef int max_s1 = 0
+    cdef int n_rows = 2
+    cdef Py_ssize_t k
+    for k in range(n_pairs):
+        max_s2 = max(max_s2, <int>(p_off[pair_pat[k] + 1] - p_off[pair_pat[k]]))
+        max_s1 = max(max_s1, <int>(r_off[pair_reg[k] + 1] - r_off[pair_reg[k]]))
+        if packed_trace:
+            n_rows = max(n_rows, lowmem_ring_rows(
+                p_times[p_off[pair_pat[k]]:p_off[pair_pat[k] + 1]],
+                <int>(p_off[pair_pat[k] + 1] - p_off[pair_pat[k]]),
+            ))
+
+    # Thread-owned score workspaces, pair-owned trace workspaces
+    cdef int chunk = n_threads * PAIRS_PER_THREAD
+    cdef int ws_rows = n_rows if packed_trace else max_s2 + 1
+    # (every kernel initialises the part of its workspace it reads)
+    if workspace is None:
+        workspace = Workspace()
+    cdef double[:, :, :] H_ws = workspace.empty("H_ws", (n_threads, ws_rows, max_s1 + 1), np.float64)
+    cdef double[:, :, :] TR_ws = workspace.empty("TR_ws", (n_threads, ws_rows, max_s1 + 1), np.float64)
+    cdef double[:, :, :] TC_ws = workspace.empty("TC_ws", (n_threads, ws_rows, max_s1 + 1), np.float64)
+    cdef int[:, :, :] trace_ws
+    cdef unsigned char[:, :, :] packed_ws
+    cdef unsigned char[:, :] no_trace = np.zeros((0, 0), dtype=np.uint8)
+    cdef int[:, :] no_int_trace = np.zeros((0, 0), dtype=np.int32)
+    if packed_trace:
+        trace_ws = np.zeros((1, 1, 1), dtype=np.int32)
+        packed_ws = workspace.empty("packed_ws", (chunk, max_s2 + 1, max_s1 // 4 + 1), np.uint8)
+    else:
+        trace_ws = workspace.empty("trace_ws", (chunk, max_s2 + 1, max_s1 + 1), np.int32)
+        packed_ws = np.zeros((1, 1, 1), dtype=np.uint8)
+    cdef double[:, :] col_ws = workspace.empty("col_ws", (chunk, max_s2 + 1), np.float64)
+    cdef int[:, :] drugs_ws = workspace.empty("drugs_ws", (chunk, max(max_s2, 1)), np.int32)
+
+    # Pair-owned endpoint and traceback outputs, strings rendered after the
+    # parallel block
+    cdef int[:] n_ends = workspace.empty("n_ends", (chunk,), np.int32)
+    cdef int[:, :, :] index_ws = workspace.empty("index_ws", (chunk, max_s2 + 1, 2), np.int32)
+    cdef double[:, :] score_ws = workspace.empty("score_ws", (chunk, max_s2 + 1), np.float64)
+    cdef double[:, :, :] scores_out = workspace.empty("scores_out", (chunk, max_s2 + 1, 2), np.float64)
+    cdef int[:, :, :] pos_out = workspace.empty("pos_out", (chunk, max_s2 + 1, 6), np.int32)
+    cdef int[:, :] path_off = workspace.empty("path_off", (chunk, max_s2 + 2), np.int32)
+    cdef unsigned char[:] order_buf = workspace.empty(
+        "order_ws", (chunk * (max_s2 + 1) * sizeof(Endpoint),), np.uint8
+    )
+    cdef Endpoint* order_ws = <Endpoint*>&order_buf[0]
+    cdef PathBuffer* paths = <PathBuffer*>calloc(chunk, sizeof(PathBuffer))
+    if paths == NULL:
+        raise MemoryError()
+
+    cdef int method_code = loss_method_code(method)
+    cdef bint use_min_score = two_phase
+    cdef double score_cutoff = min_score if two_phase else 0.0
+    cdef Py_ssize_t start, end, slot, pi, rj
+    cdef int tid, s1_len, s2_len, p0, r0, n_end, row, last_row, i, failed
+    cdef np.ndarray seqs
+
+    bar = tqdm(total=n_pairs, desc="Aligning pairs", disable=not progress)
+    try:
+        for start in range(0, n_pairs, chunk):
+            end = min(start + chunk, n_pairs)
+
+            with nogil, parallel(num_threads=n_threads):
+                tid = threadid()
+                for k in prange(start, end, schedule="dynamic"):
+                    slot = k - start
+                    pi = pair_pat[k]
+                    rj = pair_reg[k]
+                    p0 = <int>p_off[pi]
+                    r0 = <int>r_off[rj]
+                    s2_len = <int>(p_off[pi + 1] - p0)
+                    s1_len = <int>(r_off[rj + 1] - r0)
+                    last_row = s2_len
+                    if two_phase:
+                        _score_pair_lowmem(
+                            r_times, r_drugs, r0, s1_len,
+                            p_times, p_drugs, p0, s2_len,
+                            g, T,
+                            H_ws[tid], TR_ws[tid], TC_ws[tid],
+                            no_trace, col_ws[slot], drugs_ws[slot],
+                            s_arr, method_code, s2_len,
+                        )
+                    elif low_memory:
+                        _score_pair_lowmem(
+                            r_times, r_drugs, r0, s1_len,
+                            p_times, p_drugs, p0, s2_len,
+                            g, T,
+                            H_ws[tid], TR_ws[tid], TC_ws[tid],
+                            packed_ws[slot], col_ws[slot], drugs_ws[slot],
+                            s_arr, method_code, s2_len,
+                        )
+                    else:
+                        _score_pair(
+                            r_times, r_drugs, r0, s1_len,
+                            p_times, p_drugs, p0, s2_len,
+                            g, T,
+                            H_ws[tid], TR_ws[tid], TC_ws[tid],
+                            trace_ws[slot], col_ws[slot], drugs_ws[slot],
+                            s_arr, method_code,
+                        )
+
+                    # Endpoint selection (-1: mem larger than the column)
+                    n_end = select_endpoints_nogil(
+                        col_ws[slot, :s2_len + 1], s1_len, s2_len, mem,
+                        use_min_score, score_cutoff,
+                        order_ws + slot * (max_s2 + 1),
+                        index_ws[slot], score_ws[slot],
+                    )
+                    n_ends[slot] = n_end
+                    if n_end <= 0:
+                        continue
+
+                    if two_phase:
+                        # Packed re-fill up to the deepest endpoint
+                        row = 0
+                        for i in range(n_end):
+                            row = max(row, index_ws[slot, i, 0])
+                        last_row = window_last_row(p_times[p0:p0 + s2_len], s2_len, row)
+                        _score_pair_lowmem(
+                            r_times, r_drugs, r0, s1_len,
+                            p_times, p_drugs, p0, s2_len,
+                            g, T,
+                            H_ws[tid], TR_ws[tid], TC_ws[tid],
+                            packed_ws[slot], col_ws[slot], drugs_ws[slot],
+                            s_arr, method_code, last_row,
+                        )
+
+                    # Integer-path traceback (-2: the path buffer could not grow)
+                    if packed_trace:
+                        failed = trace_paths_nogil(
+                            no_int_trace, packed_ws[slot, :last_row + 1, :s1_len // 4 + 1], True,
+                            s1_len, s2_len, index_ws[slot], score_ws[slot], n_end,
+                            &paths[slot], path_off[slot], scores_out[slot], pos_out[slot],
+                        )
+                    else:
+                        failed = trace_paths_nogil(
+                            trace_ws[slot, :s2_len + 1, :s1_len + 1], no_trace, False,
+                            s1_len, s2_len, index_ws[slot], score_ws[slot], n_end,
+                            &paths[slot], path_off[slot], scores_out[slot], pos_out[slot],
+                        )
+                    if failed < 0:
+                        n_ends[slot] = -2
+
+            for k in range(start, end):
+                slot = k - start
+                pi = pair_pat[k]
+                rj = pair_reg[k]
+                p0 = <int>p_off[pi]
+                r0 = <int>r_off[rj]
+                s2_len = <int>(p_off[pi + 1] - p0)
+                s1_len = <int>(r_off[rj + 1] - r0)
+                n_end = n_ends[slot]
+                if verbose == 2 and mem == -1:
+                    print("Calculated mem: ")
+                    print(mem)
+                if n_end == -1:
+                    raise ValueError(f"mem={mem} is larger than the number of scores ({s2_len + 1})")
+                if n_end == -2:
+                    raise MemoryError()
+                if n_end == 0:
+                    continue
+
+                seqs = render_paths(
+                    &paths[slot], path_off[slot], n_end,
+                    r_times[r0:r0 + s1_len],
+                    r_drugs[r0:r0 + s1_len],
+                    s1_len,
+                    p_times[p0:p0 + s2_len],
+                    drugs_ws[slot, :s2_len],
+                    s2_len,
+                    drug_names,
+                )
+                results.append(
+                    (
+                        seqs,
+                        np.asarray(scores_out[slot, :n_end]),
+                        np.asarray(pos_out[slot, :n_end]),
+                    ),
+                    rj, pi,
+                )
+
+            bar.update(end - start)
+    finally:
+        for slot in range(chunk):
+            free_paths(&paths[slot])
+        free(paths)
+    bar.close()
+
+
+def _score_threshold(min_score, min_adjusted_score):
+    """
+    Score cutoff of a run: rows need Score > min_score, and as
+    adjustedS = Score / totAlign <= Score, adjustedS > min_adjusted_score
+    needs Score > min_adjusted_score too. None if neither is set.
+    """
+    cutoffs = [x for x in (min_score, min_adjusted_score) if x is not None]
+    return max(cutoffs) if cutoffs else None
+
+
+cdef np.ndarray _bounded_regimens(
+    object catalog, np.ndarray s_mat, np.ndarray drugs, np.ndarray regimen_ids,
+    double min_score, object min_adjusted_score,
+):
+    """
+    The regimens of regimen_ids whose score bounds against a record (drug
+    ids over the run vocabulary) allow a row with Score > min_score and
+    adjustedS > min_adjusted_score.
+    """
+    ids, counts = np.unique(drugs, return_counts=True)
+    # s_mat[a, b]: similarity of regimen drug a to record drug b
+    score, step = catalog.score_bounds(
+        s_mat[:len(catalog.vocabulary)][:, ids], counts, regimen_ids
+    )
+
+    keep = score > min_score
+    if min_adjusted_score is not None:
+        keep &= step > min_adjusted_score
+    return regimen_ids[keep]
+
+
+cdef tuple _window_pairs(
+    object catalog, np.ndarray p_off, np.ndarray p_drugs, list regimen_ids, int margin,
+):
+    """
+    The (record, regimen) pairs of regimen_ids, in record then regimen
+    order, and their record windows (see RegimenCatalog.windows).
+    Returns int64 (pair_pat, pair_reg) and the windows of every pair as
+    CSR arrays: window offsets per pair, then the pair, start and end
+    (within the record) of every window.
+    """
+    cdef list pair_pat = []
+    cdef list pair_reg = []
+    cdef list w_off = [0]
+    cdef list w_start = []
+    cdef list w_end = []
+    cdef Py_ssize_t i, n_windows = 0
+    for i in range(len(regimen_ids)):
+        drugs = p_drugs[p_off[i]:p_off[i + 1]]
+        for j in regimen_ids[i]:
+            starts, ends = catalog.windows(drugs, j, margin)
+            pair_pat.append(i)
+            pair_reg.append(j)
+            w_start.append(starts)
+            w_end.append(ends)
+            n_windows += starts.shape[0]
+            w_off.append(n_windows)
+
+    offsets = np.array(w_off, dtype=np.int64)
+    return (
+        np.array(pair_pat, dtype=np.int64),
+        np.array(pair_reg, dtype=np.int64),
+        offsets,
+        np.repeat(np.arange(len(pair_pat), dtype=np.int64), np.diff(offsets)),
+        np.concatenate(w_start + [np.empty(0, dtype=np.int64)]),
+        np.concatenate(w_end + [np.empty(0, dtype=np.int64)]),
+    )
+
+
+cdef void _align_window_pairs(
+    object results,
+    object catalog,
+    np.int64_t[:] pair_pat,
+    np.int64_t[:] pair_reg,
+    np.int64_t[:] w_off,
+    np.int64_t[:] w_pair,
+    np.int64_t[:] w_start,
+    np.int64_t[:] w_end,
+    np.int64_t[:] p_off,
+    double[:] p_times,
+    int[:] p_drugs,
+    double[:, :] s_arr,
+    np.ndarray drug_names,
+    double g,
+    double T,
+    int verbose,
+    int mem,
+    str method,
+    int n_threads,
+    object min_score=None,
+    object workspace=None,
+    bint progress=True,
+):
+    """
+    Windowed mode: align every pair on its record windows only.
+
+    Pairs are processed in chunks. The windows of a chunk are scored with
+    OpenMP, each with a packed trace and its own re-ordered record drugs
+    (_score_pair_lowmem). Every pair then gets the last H column of its
+    windows, rows outside the windows scoring 0, and its endpoints are
+    selected over the whole record (mem=-1 counts the full record length,
+    then min_score). Each endpoint is traced back in its window; endpoints
+    outside the windows are not aligned.
+    Rows are appended to `results` (an AlignmentResults) in pair order.
+    """
+    cdef np.int64_t[:] r_off = catalog.offsets
+    cdef double[:] r_times = catalog.flat_times
+    cdef int[:] r_drugs = catalog.flat_drug_ids
+
+    cdef Py_ssize_t n_pairs = pair_pat.shape[0]
+    cdef int chunk = n_threads * PAIRS_PER_THREAD
+    cdef int max_len = 0
+    cdef int max_s1 = 0
+    cdef int max_windows = 0
+    cdef int n_rows = 2
+    cdef Py_ssize_t k, w, start, end, slot, pi, rj, w0, w1
+    cdef int tid, s1_len, s2_len, p0, r0, a
+    for k in range(n_pairs):
+        max_s1 = max(max_s1, <int>(r_off[pair_reg[k] + 1] - r_off[pair_reg[k]]))
+    for w in range(w_start.shape[0]):
+        p0 = <int>(p_off[pair_pat[w_pair[w]]] + w_start[w])
+        s2_len = <int>(w_end[w] - w_start[w])
+        max_len = max(max_len, s2_len)
+        n_rows = max(n_rows, lowmem_ring_rows(p_times[p0:p0 + s2_len], s2_len))
+    for start in range(0, n_pairs, chunk):
+        end = min(start + chunk, n_pairs)
+        max_windows = max(max_windows, <int>(w_off[end] - w_off[start]))
+
+    # Thread-owned score rows, window-owned packed traces
+    if workspace is None:
+        workspace = Workspace()
+    cdef double[:, :, :] H_ws = workspace.empty("H_ws", (n_threads, n_rows, max_s1 + 1), np.float64)
+    cdef double[:, :, :] TR_ws = workspace.empty("TR_ws", (n_threads, n_rows, max_s1 + 1), np.float64)
+    cdef double[:, :, :] TC_ws = workspace.empty("TC_ws", (n_threads, n_rows, max_s1 + 1), np.float64)
+    cdef unsigned char[:, :, :] packed_ws = workspace.empty(
+        "packed_ws", (max_windows, max_len + 1, max_s1 // 4 + 1), np.uint8
+    )
+    cdef double[:, :] col_ws = workspace.empty("col_ws", (max_windows, max_len + 1), np.float64)
+    cdef int[:, :] drugs_ws = workspace.empty("drugs_ws", (max_windows, max(max_len, 1)), np.int32)
+
+    cdef int method_code = loss_method_code(method)
+    cdef np.ndarray starts, ends
+
+    bar = tqdm(total=n_pairs, desc="Aligning pairs", disable=not progress)
+    for start in range(0, n_pairs, chunk):
+        end = min(start + chunk, n_pairs)
+        w0 = w_off[start]
+        w1 = w_off[end]
+
+        with nogil, parallel(num_threads=n_threads):
+            tid = threadid()
+            for w in prange(w0, w1, schedule="dynamic"):
+                slot = w - w0
+                k = w_pair[w]
+                p0 = <int>(p_off[pair_pat[k]] + w_start[w])
+                r0 = <int>r_off[pair_reg[k]]
+                s2_len = <int>(w_end[w] - w_start[w])
+                s1_len = <int>(r_off[pair_reg[k] + 1] - r0)
+                _score_pair_lowmem(
+                    r_times, r_drugs, r0, s1_len,
+                    p_times, p_drugs, p0, s2_len,
+                    g, T,
+                    H_ws[tid], TR_ws[tid], TC_ws[tid],
+                    packed_ws[slot], col_ws[slot], drugs_ws[slot],
+                    s_arr, method_code, s2_len,
+                )
+
+        for k in range(start, end):
+            pi = pair_pat[k]
+            rj = pair_reg[k]
+            r0 = <int>r_off[rj]
+            s1_len = <int>(r_off[rj + 1] - r0)
+            s2_len = <int>(p_off[pi + 1] - p_off[pi])
+            starts = np.asarray(w_start[w_off[k]:w_off[k + 1]])
+            ends = np.asarray(w_end[w_off[k]:w_off[k + 1]])
+
+            H_col = np.zeros(s2_len + 1, dtype=np.float64)
+            for w in range(w_off[k], w_off[k + 1]):
+                H_col[w_start[w]:w_end[w] + 1] = col_ws[w - w0, :w_end[w] - w_start[w] + 1]
+
+            mem_index, mem_score = fbs_col(H_col, s1_len, s2_len, mem, verbose)
+            if min_score is not None:
+                mem_index, mem_score = _select_endpoints(mem_index, mem_score, min_score)
+
+            rows = mem_index[:, 0]
+            window = np.searchsorted(starts, rows, side="right") - 1
+            inside = (window >= 0) & (rows <= ends[np.maximum(window, 0)])
+            mem_index, mem_score, window = mem_index[inside], mem_score[inside], window[inside]
+
+            n = mem_index.shape[0]
+            seqs = np.empty((n, 2), dtype=object)
+            scores = np.empty((n, 2), dtype=np.float64)
+            pos = np.empty((n, 6), dtype=np.int32)
+            for wi in np.unique(window):
+                rows = np.flatnonzero(window == wi)
+                w = w_off[k] + wi
+                slot = w - w0
+                a = <int>w_start[w]
+                p0 = <int>(p_off[pi] + a)
+                index = mem_index[rows]
+                index[:, 0] -= a
+                seqs[rows], scores[rows], pos[rows] = aTSW_packed(
+                    packed_ws[slot, :w_end[w] - a + 1, :s1_len // 4 + 1],
+                    r_times[r0:r0 + s1_len],
+                    r_drugs[r0:r0 + s1_len],
+                    s1_len,
+                    p_times[p0:p0 + w_end[w] - a],
+                    drugs_ws[slot, :w_end[w] - a],
+                    <int>(w_end[w] - a),
+                    index,
+                    mem_score[rows],
+                    drug_names,
+                )
+                pos[rows, 2:4] += a
+
+            results.append((seqs, scores, pos), rj, pi)
+
+        bar.update(end - start)
+    bar.close()
+
+
 def align_patients_regimens_fast(
     patients,
     regimens,
@@ -194,64 +1226,313 @@ def align_patients_regimens_fast(
     int mem=-1,
     int removeOverlap=1,
     str method="PropDiff",
+    int n_threads=1,
+    bint low_memory=False,
+    min_score=None,
+    workspace=None,
+    bint progress=True,
+    cache=None,
+    min_adjusted_score=None,
+    window_margin=None,
 ):
     """
     Fast version using NumPy arrays instead of Pandas iteration.
+    Patients with identical seq strings are aligned once and the rows are
+    repeated for each of them, in input order.
+
+    patients : patient DataFrame, or a CohortStore written from one.
+    regimens : regimen DataFrame, or a RegimenCatalog built once from it
+    and reused across calls.
+    s : similarity matrix (pandas.DataFrame labelled by drug name) or None
+    for the default. Built once per run over the run vocabulary.
+    n_threads : number of OpenMP threads used to score (patient, regimen)
+    pairs. 1 keeps the serial loop, 0 or less uses all available cores.
+    Rows are returned in the same order for any n_threads.
+    low_memory : keep only rolling rows of H/TR/TC and pack the traceback
+    matrix 2 bits per cell, instead of four full (s2+1) x (s1+1) matrices.
+    Results are identical, memory per pair drops from 28 to ~0.25 bytes
+    per cell. The serial loop (batched per patient, see
+    align_patient_regimens) always works this way.
+    min_score : if set, two-phase mode. Pairs are first scored without a
+    trace matrix; only endpoints with Score > min_score (after the mem
+    selection) are re-scored with a trace and aligned. Rows with
+    Score <= min_score are dropped; they can never pass an
+    adjustedS > min_score filter (postprocessDF uses 0.501).
+    workspace : Workspace holding the DP matrices, grown to the largest pair
+    and reused by every pair (and by later calls, if passed in). A new one
+    is created by default; its peak_nbytes reports the memory used.
+    progress : show the tqdm progress bar.
+    cache : AlignmentCache (or the path of its SQLite file). Only the
+    (record, regimen) pairs not found in it are aligned; the output is the
+    same as without a cache.
+    min_adjusted_score : if set, drop rows with adjustedS <= it. As
+    adjustedS <= Score, this runs in two-phase mode with min_score raised to
+    the cutoff, so lower endpoints are not traced back.
+    With min_score or min_adjusted_score, pairs whose score bounds
+    (RegimenCatalog.score_bounds) cannot pass are not aligned at all (for
+    g >= 0 and T >= 0).
+    window_margin : windowed mode for long records. Each regimen is only
+    aligned inside the regions of the record where its drugs occur
+    (RegimenCatalog.windows), padded by window_margin record entries.
+    Only the DP is windowed: the endpoints of a pair are selected over all
+    its windows as over the whole record (mem=-1 counts the full record
+    length), rows ending outside every window are dropped. Rows keep the
+    positions of the full record.
     """
 
-    # --- Extract arrays ---
-    cdef np.ndarray patient_ids = patients[col_name_patient_id].to_numpy(dtype=object)
-    cdef np.ndarray patient_records = patients[col_name_patient_record].to_numpy(dtype=object)
-    cdef Py_ssize_t n_patients = patient_records.shape[0]
+    if not isinstance(regimens, RegimenCatalog):
+        regimens = RegimenCatalog(
+            regimens,
+            col_name_regimens=col_name_regimens,
+            col_name_regName=col_name_regName,
+        )
+    catalog = regimens
 
-    cdef np.ndarray regimen_names = regimens[col_name_regName].to_numpy(dtype=object)
-    cdef np.ndarray regimen_seqs = regimens[col_name_regimens].to_numpy(dtype=object)
-    cdef Py_ssize_t n_regimens = regimen_seqs.shape[0]
+    # --- Records as CSR arrays over the run vocabulary ---
+    # (the catalog vocabulary first, so patient drug ids are catalog ids):
+    # the memory maps of a CohortStore, or the seq column parsed once
+    # Identical records are aligned once: the records below are the unique
+    # ones, in order of first appearance. The ids and seq strings of a
+    # CohortStore are only decoded for the rows of the output (and for the
+    # cache keys)
+    cdef object patient_ids
+    cdef object patient_records
+    if isinstance(patients, CohortStore):
+        patient_ids, patient_records = patients.columns()
+        codes, first = patients.unique_records()
+        p_off, p_times, p_drugs, vocabulary = patients.csr(catalog.vocabulary)
+        if first.shape[0] < len(patients):
+            p_off, p_times, p_drugs = _take_ranges(p_times, p_drugs, p_off[first], p_off[first + 1])
+    else:
+        patient_ids = patients[col_name_patient_id].to_numpy(dtype=object)
+        patient_records = patients[col_name_patient_record].to_numpy(dtype=object)
+        codes, first = unique_records(patient_records)
+        p_off, p_times, p_drugs, vocabulary = encode_bulk(patient_records[first], catalog.vocabulary)
+    cdef Py_ssize_t n_patients = first.shape[0]
+    cdef np.ndarray drug_names = np.array(vocabulary, dtype=object)
+    cdef np.ndarray s_mat = similarity_matrix(vocabulary, s)
+    cdef double[:, :] s_arr = s_mat
 
-    # --- Initialize results list ---
-    cdef list dfs = []
-    cdef object s1, s2, s1_copy, df
-    cdef set s1_drugs, s2_drugs
-    cdef str patient_seq, regimen_seq
+    # --- Typed result columns (one row block per unique record), one
+    # DataFrame at the end ---
+    results = AlignmentResults(catalog, patient_ids, patient_records)
+    computed = AlignmentResults()
     cdef Py_ssize_t i, j
+    cdef list pairs
+    cdef list regimen_ids = [
+        catalog.eligible_ids(p_drugs[p_off[i]:p_off[i + 1]]) for i in range(n_patients)
+    ]
 
-    # --- Main loop ---
-    for i in tqdm(range(n_patients), desc="Processing patients"):
-        patient_seq = patient_records[i]
-        s1 = encode_c(patient_seq)
-        s1_drugs = set(item[1] for item in s1)
-
-        for j in range(n_regimens):
-            regimen_seq = regimen_seqs[j]
-            s2 = encode_c(regimen_seq)
-            s2_drugs = set(item[1] for item in s2)
-
-            if s2_drugs.issubset(s1_drugs):
-                s1_copy = [x[:] for x in s1]
-
-                df = temporal_alignment(
-                    s2,
-                    s1_copy,
-                    g=g,
-                    T=T,
-                    s=s,
-                    verbose=verbose,
-                    mem=mem,
-                    removeOverlap=removeOverlap,
-                    method=method,
-                )
+    if n_threads <= 0:
+        n_threads = openmp.omp_get_max_threads()
+
+    if workspace is None:
+        workspace = Workspace()
+
+    # --- Pairs to align: all eligible ones (within the score bounds), or
+    # the misses of the cache ---
+    params = AlignmentCache.params(
+        g, T, method, mem, min_score, s, min_adjusted_score, window_margin
+    )
+    min_score = _score_threshold(min_score, min_adjusted_score)
+    if min_score is not None and g >= 0 and T >= 0:
+        regimen_ids = [
+            _bounded_regimens(
+                catalog, s_mat, p_drugs[p_off[i]:p_off[i + 1]], regimen_ids[i],
+                min_score, min_adjusted_score,
+            )
+            for i in range(n_patients)
+        ]
+
+    if cache is not None:
+        if isinstance(cache, str):
+            cache = AlignmentCache(cache)
+        regimen_ids, pending = cache.lookup(
+            patient_records[first], catalog.seqs, regimen_ids, params
+        )
+
+    # --- Windowed mode: every pair is scored on its record windows only ---
+    if window_margin is not None:
+        pair_pat, pair_reg, w_off, w_pair, w_start, w_end = _window_pairs(
+            catalog, p_off, p_drugs, regimen_ids, int(window_margin)
+        )
+        _align_window_pairs(
+            computed,
+            catalog,
+            pair_pat,
+            pair_reg,
+            w_off,
+            w_pair,
+            w_start,
+            w_end,
+            p_off,
+            p_times,
+            p_drugs,
+            s_arr,
+            drug_names,
+            g,
+            T,
+            verbose,
+            mem,
+            method,
+            n_threads,
+            min_score,
+            workspace,
+            progress,
+        )
+
+    # --- Parallel path: collect the pairs, score them with OpenMP ---
+    elif n_threads > 1:
+        pairs = []
+        for i in range(n_patients):
+            for j in regimen_ids[i]:
+                pairs.append((i, j))
+
+        _align_pairs_parallel(
+            computed,
+            catalog,
+            pairs,
+            p_off,
+            p_times,
+            p_drugs,
+            s_arr,
+            drug_names,
+            g,
+            T,
+            verbose,
+            mem,
+            method,
+            n_threads,
+            low_memory,
+            min_score,
+            workspace,
+            progress,
+        )
+
+    else:
+        # --- Main loop: one batched call per patient ---
+        for i in tqdm(range(n_patients), desc="Processing patients", disable=not progress):
+            if regimen_ids[i].shape[0] == 0:
+                continue
+
+            p0, p1 = p_off[i], p_off[i + 1]
+            _align_patient_batch(
+                p_times[p0:p1],
+                p_drugs[p0:p1],
+                catalog,
+                regimen_ids[i],
+                g,
+                T,
+                s_arr,
+                drug_names,
+                verbose,
+                mem,
+                method,
+                min_score,
+                workspace,
+                computed,
+                i,
+            )
+
+    if min_adjusted_score is not None:
+        computed.keep(computed.scores[:computed.n_rows, 1] > min_adjusted_score)
+
+    if cache is not None:
+        merged = AlignmentResults()
+        cache.merge(merged, pending, computed)
+        computed = merged
+
+    # --- Rows of every unique record, for each patient sharing it ---
+    results.extend_shared(computed, codes)
+
+    # --- One DataFrame from the typed columns ---
+    if len(results):
+        return results.to_frame()
+    return pd.DataFrame()
 
-                df["regName"] = regimen_names[j]
-                df["Regimen_full"] = regimen_seq
-                df["personID"] = patient_ids[i]
-                df["DrugRecord_full"] = patient_seq
 
-                dfs.append(df)
+def iter_alignments(
+    patients,
+    regimens,
+    Py_ssize_t batch_size=1000,
+    str col_name_patient_id="person_id",
+    str col_name_patient_record="seq",
+    str col_name_regimens="shortString",
+    str col_name_regName="regName",
+    double g=0.4,
+    double T=0.5,
+    s=None,
+    int verbose=0,
+    int mem=-1,
+    int removeOverlap=1,
+    str method="PropDiff",
+    int n_threads=1,
+    bint low_memory=False,
+    min_score=None,
+    workspace=None,
+    cache=None,
+    min_adjusted_score=None,
+    window_margin=None,
+):
+    """
+    Streaming align_patients_regimens_fast: yields one result DataFrame per
+    batch of patients, as soon as the batch is aligned.
+
+    patients : patient DataFrame or CohortStore, cut into batches of
+    batch_size patients, or an iterable of patient DataFrames (e.g.
+    pd.read_csv(..., chunksize=n)), each one taken as a batch.
+    The regimen catalog and the workspace are shared by all batches, so
+    memory is bounded by the largest batch. Batches without alignments are
+    skipped. The index continues across batches: pd.concat of all chunks
+    equals the align_patients_regimens_fast result.
+    Other arguments as in align_patients_regimens_fast. See
+    write_alignments to append the chunks to a file.
+    """
+    if not isinstance(regimens, RegimenCatalog):
+        regimens = RegimenCatalog(
+            regimens,
+            col_name_regimens=col_name_regimens,
+            col_name_regName=col_name_regName,
+        )
+    if workspace is None:
+        workspace = Workspace()
+    if isinstance(cache, str):
+        cache = AlignmentCache(cache)
 
-    # --- Combine all DataFrames ---
-    if dfs:
-        result = pd.concat(dfs, ignore_index=True)
+    if isinstance(patients, (pd.DataFrame, CohortStore)):
+        batch_size = max(batch_size, 1)
+        rows = patients.iloc if isinstance(patients, pd.DataFrame) else patients
+        batches = (
+            rows[k:k + batch_size] for k in range(0, len(patients), batch_size)
+        )
     else:
-        result = pd.DataFrame()
+        batches = patients
 
-    return result
\ No newline at end of file
+    cdef Py_ssize_t n_rows = 0
+    for batch in tqdm(batches, desc="Processing patient batches"):
+        df = align_patients_regimens_fast(
+            batch,
+            regimens,
+            col_name_patient_id=col_name_patient_id,
+            col_name_patient_record=col_name_patient_record,
+            g=g,
+            T=T,
+            s=s,
+            verbose=verbose,
+            mem=mem,
+            removeOverlap=removeOverlap,
+            method=method,
+            n_threads=n_threads,
+            low_memory=low_memory,
+            min_score=min_score,
+            workspace=workspace,
+            progress=False,
+            cache=cache,
+            min_adjusted_score=min_adjusted_score,
+            window_margin=window_margin,
+        )
+        if df.shape[0] == 0:
+            continue
+        df.index = pd.RangeIndex(n_rows, n_rows + df.shape[0])
+        n_rows += df.shape[0]
+        yield df
@@ -33,7 +33,8 @@ extensions = [
         name="run_TSW",
         sources=["run_TSW.pyx"],
         include_dirs=[numpy.get_include()],
-        extra_compile_args=["-O3"],
+        extra_compile_args=["-O3", "-fopenmp"],
+        extra_link_args=["-fopenmp"],
     ),
 ]
 
@@ -1,49 +1,84 @@
-def align_TSW(traceMat, s1, s2, s1_len, s2_len, max_index):
-    s1_aligned = ""
-    s2_aligned = ""
-    temp_s1_aligned = ""
-    temp_s2_aligned = ""
+import numpy as np
+
+# Gap marker in the integer paths, rendered as "__"
+GAP = -1
+
+
+def trace_path(traceMat, s1_len, s2_len, max_index):
+    """
+    Traceback from max_index as integer paths.
+
+    Returns path_s1, path_s2 (int arrays, left to right: the aligned index
+    of s1 and s2 at each step, or GAP), the number of aligned pairs and the
+    start cell (max_i, max_j) of the alignment.
+    """
+    path_s1 = []
+    path_s2 = []
     max_j, max_i = max_index
-    i = s1_len
-    j = s2_len
 
     totAligned = 0
 
     while traceMat[max_j][max_i] > 0:
         if traceMat[max_j][max_i] == 1:
-            temp_s1_aligned = s1[max_i - 1][0] + "." + s1[max_i - 1][1]
-            temp_s2_aligned = s2[max_j - 1][0] + "." + s2[max_j - 1][1]
+            path_s1.append(max_i - 1)
+            path_s2.append(max_j - 1)
             max_i -= 1
             max_j -= 1
-            i -= 1
-            j -= 1
             totAligned += 1
 
         elif traceMat[max_j][max_i] == 3:
-            temp_s1_aligned = s1[max_i - 1][0] + "." + s1[max_i - 1][1]
-            temp_s2_aligned = "__"
+            path_s1.append(max_i - 1)
+            path_s2.append(GAP)
             max_i -= 1
-            i -= 1
 
         elif traceMat[max_j][max_i] == 2:
-            temp_s1_aligned = "__"
-            temp_s2_aligned = s2[max_j - 1][0] + "." + s2[max_j - 1][1]
+            path_s1.append(GAP)
+            path_s2.append(max_j - 1)
             max_j -= 1
-            j -= 1
-
-        s1_aligned = temp_s1_aligned + ";" + s1_aligned
-        s2_aligned = temp_s2_aligned + ";" + s2_aligned
 
     if max_i != 0 and max_j != 0:
-        temp_s1_aligned = s1[max_i - 1][0] + "." + s1[max_i - 1][1]
-        temp_s2_aligned = s2[max_j - 1][0] + "." + s2[max_j - 1][1]
+        path_s1.append(max_i - 1)
+        path_s2.append(max_j - 1)
         max_i -= 1
         max_j -= 1
-        i -= 1
-        j -= 1
         totAligned += 1
 
-        s1_aligned = temp_s1_aligned + ";" + s1_aligned
-        s2_aligned = temp_s2_aligned + ";" + s2_aligned
+    # Steps were collected end to start
+    path_s1 = np.array(path_s1[::-1], dtype=np.int64)
+    path_s2 = np.array(path_s2[::-1], dtype=np.int64)
+
+    return path_s1, path_s2, totAligned, max_i, max_j
+
+
+def path_lengths(path_s1, path_s2):
+    """
+    Aligned sequence length (drugs on the longer side) and number of
+    trailing gaps on the s1 side of a path.
+    """
+    s_f_len = max(
+        np.count_nonzero(path_s1 != GAP), np.count_nonzero(path_s2 != GAP)
+    )
+
+    s1_end_gaps = len(path_s1)
+    nongap = np.flatnonzero(path_s1 != GAP)
+    if len(nongap):
+        s1_end_gaps = len(path_s1) - 1 - int(nongap[-1])
+
+    return int(s_f_len), s1_end_gaps
+
+
+def render_path(path, seq):
+    """
+    "t.drug;..." string of a path over an encoded sequence.
+    """
+    return ";".join(
+        "__" if k == GAP else seq[k][0] + "." + seq[k][1] for k in path
+    )
+
+
+def align_TSW(traceMat, s1, s2, s1_len, s2_len, max_index):
+    path_s1, path_s2, totAligned, max_i, max_j = trace_path(
+        traceMat, s1_len, s2_len, max_index
+    )
 
-    return s1_aligned[:-1], s2_aligned[:-1], totAligned, max_i, max_j
+    return render_path(path_s1, s1), render_path(path_s2, s2), totAligned, max_i, max_j
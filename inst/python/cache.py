@@ -0,0 +1,241 @@
+import hashlib
+import sqlite3
+
+import numpy as np
+
+
+class AlignmentCache:
+    """
+    Persistent cache of alignment rows, stored in SQLite.
+
+    Every (patient record, regimen) pair maps to the rows it aligned to,
+    keyed by a hash of the seq string, the regimen shortString and the run
+    parameters (g, T, method, mem, min_score, min_adjusted_score,
+    window_margin and the similarity matrix). Pairs without rows are
+    stored too, so a re-run only aligns records or regimens it has not
+    seen. When the stored rows exceed max_bytes, the least recently used
+    pairs are evicted.
+
+    Parameters
+    ----------
+    path : str
+        SQLite database file, created if needed.
+    max_bytes : int, optional
+        Bound on the stored row data, by default 1 GiB.
+
+    Examples
+    --------
+    >>> cache = AlignmentCache("alignments.sqlite")
+    >>> df = align_patients_regimens(patients, regimens, cache=cache)
+    """
+
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS alignments ("
+            "key TEXT PRIMARY KEY, n INTEGER, seqs TEXT, scores BLOB, pos BLOB, "
+            "nbytes INTEGER, last_used INTEGER)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS alignments_last_used ON alignments (last_used)"
+        )
+        self.db.commit()
+        nbytes, clock = self.db.execute(
+            "SELECT COALESCE(SUM(nbytes), 0), COALESCE(MAX(last_used), 0) FROM alignments"
+        ).fetchone()
+        self.nbytes = nbytes
+        self._clock = clock
+
+    @staticmethod
+    def params(
+        g, T, method, mem, min_score, s, min_adjusted_score=None, window_margin=None
+    ):
+        """
+        Key part of the run parameters. A user similarity matrix enters by
+        its content; the default one (s=None) only depends on the drugs.
+        """
+        s_key = "default"
+        if s is not None:
+            s_key = hashlib.sha1(s.to_json().encode("utf-8")).hexdigest()
+        params = f"{float(g)!r}|{float(T)!r}|{method}|{int(mem)}|{min_score!r}|{s_key}"
+        if min_adjusted_score is not None:
+            params += f"|{min_adjusted_score!r}"
+        if window_margin is not None:
+            params += f"|window{int(window_margin)}"
+        return params
+
+    @staticmethod
+    def key(record, regimen, params):
+        """
+        Cache key of one (seq string, regimen shortString) pair.
+        """
+        return hashlib.sha1(
+            f"{record}\x1f{regimen}\x1f{params}".encode("utf-8")
+        ).hexdigest()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM alignments").fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        Stored blocks of the given keys.
+
+        Returns
+        -------
+        dict
+            key -> (seqs, scores, pos) block, for the keys found.
+        """
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        self._clock += 1
+        for a in range(0, len(keys), 500):
+            part = keys[a : a + 500]
+            marks = ",".join("?" * len(part))
+            rows = self.db.execute(
+                f"SELECT key, n, seqs, scores, pos FROM alignments WHERE key IN ({marks})",
+                part,
+            ).fetchall()
+            for key, n, seqs, scores, pos in rows:
+                found[key] = (
+                    np.array(seqs.split("\n") if n else [], dtype=object).reshape(n, 2),
+                    np.frombuffer(scores, dtype=np.float64).reshape(n, 2),
+                    np.frombuffer(pos, dtype=np.int32).reshape(n, 6),
+                )
+            self.db.execute(
+                f"UPDATE alignments SET last_used = ? WHERE key IN ({marks})",
+                [self._clock] + part,
+            )
+        self.db.commit()
+        return found
+
+    def put_many(self, items):
+        """
+        Store (key, block) items, then evict the least recently used pairs
+        beyond max_bytes.
+        """
+        self._clock += 1
+        for key, (seqs, scores, pos) in items:
+            n = seqs.shape[0]
+            text = "\n".join(np.asarray(seqs, dtype=object).reshape(-1))
+            scores = np.ascontiguousarray(scores, dtype=np.float64).tobytes()
+            pos = np.ascontiguousarray(pos, dtype=np.int32).tobytes()
+            nbytes = len(text) + len(scores) + len(pos)
+            cur = self.db.execute(
+                "INSERT OR IGNORE INTO alignments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, n, text, scores, pos, nbytes, self._clock),
+            )
+            if cur.rowcount > 0:
+                self.nbytes += nbytes
+
+        if self.nbytes > self.max_bytes:
+            rows = self.db.execute(
+                "SELECT key, nbytes FROM alignments ORDER BY last_used"
+            ).fetchall()
+            evicted = []
+            for key, nbytes in rows:
+                if self.nbytes <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                self.nbytes -= nbytes
+            self.db.executemany("DELETE FROM alignments WHERE key = ?", evicted)
+        self.db.commit()
+
+    def lookup(self, records, regimen_seqs, eligible, params):
+        """
+        Split the pairs of a run into hits and misses.
+
+        Parameters
+        ----------
+        records : sequence of str
+            Patient seq strings.
+        regimen_seqs : sequence of str
+            Regimen shortStrings, by catalog index.
+        eligible : list of numpy.ndarray
+            Catalog indices of the regimens to align, per patient.
+        params : str
+            Output of AlignmentCache.params.
+
+        Returns
+        -------
+        missing : list of numpy.ndarray
+            The regimens of eligible that have to be aligned, per patient.
+        pending : tuple
+            State to pass to merge.
+        """
+        keys = [
+            [self.key(records[i], regimen_seqs[j], params) for j in eligible[i]]
+            for i in range(len(eligible))
+        ]
+        hits = self.get_many([k for ks in keys for k in ks])
+        missing = [
+            np.array(
+                [j for j, k in zip(eligible[i], keys[i]) if k not in hits],
+                dtype=np.int64,
+            )
+            for i in range(len(eligible))
+        ]
+        n_pairs = sum(len(ks) for ks in keys)
+        n_missing = sum(len(m) for m in missing)
+        self.hits += n_pairs - n_missing
+        self.misses += n_missing
+        return missing, (eligible, keys, hits)
+
+    def merge(self, results, pending, computed):
+        """
+        Append the rows of every pair of lookup to results, in pair order,
+        and store the computed ones.
+
+        Parameters
+        ----------
+        results : AlignmentResults
+            Output of the run.
+        pending : tuple
+            Second output of lookup.
+        computed : AlignmentResults
+            Rows of the missing pairs, with their patient and regimen
+            indices.
+        """
+        eligible, keys, hits = pending
+
+        # Computed rows come in pair order, one contiguous run per pair
+        n = computed.n_rows
+        segments = {}
+        if n:
+            pairs = np.stack([computed.patient[:n], computed.regimen[:n]], axis=1)
+            starts = np.flatnonzero(np.r_[True, (pairs[1:] != pairs[:-1]).any(axis=1)])
+            ends = np.r_[starts[1:], n]
+            for a, b in zip(starts, ends):
+                segments[tuple(pairs[a])] = (a, b)
+
+        new = []
+        for i in range(len(eligible)):
+            for j, k in zip(eligible[i], keys[i]):
+                block = hits.get(k)
+                if block is None:
+                    a, b = segments.get((i, j), (0, 0))
+                    block = (computed.seqs[a:b], computed.scores[a:b], computed.pos[a:b])
+                    new.append((k, block))
+                results.append(block, j, i)
+
+        self.put_many(new)
+
+    def clear(self):
+        """
+        Remove every stored pair.
+        """
+        self.db.execute("DELETE FROM alignments")
+        self.db.commit()
+        self.nbytes = 0
+
+    def close(self):
+        self.db.close()
+
+    def __repr__(self):
+        return (
+            f"AlignmentCache({self.path!r}, {len(self)} pairs, "
+            f"{self.nbytes} / {self.max_bytes} bytes)"
+        )
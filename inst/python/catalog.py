@@ -0,0 +1,241 @@
+import numpy as np
+from encoding import encode_py
+
+
+def _occurrence_ranks(ids):
+    """
+    Number of earlier occurrences of every id in ids.
+    """
+    seen = {}
+    ranks = np.empty(len(ids), dtype=np.int64)
+    for k, d in enumerate(ids):
+        ranks[k] = seen.get(d, 0)
+        seen[d] = ranks[k] + 1
+    return ranks
+
+
+class RegimenCatalog:
+    """
+    Regimens parsed once, to be reused across patients and repeated calls.
+
+    Every regimen shortString is encoded a single time into
+    - encoded : list of [time, drug] string pairs (as returned by encode_py)
+    - times : float64 array of time gaps
+    - drug_ids : int32 array of drug ids against the catalog vocabulary
+    - drug_set : frozenset of drug names, used for the eligibility check
+
+    The times and ids of all regimens are also kept as CSR arrays (offsets,
+    flat_times, flat_drug_ids), with ranks, the number of earlier
+    positions of the same drug in the regimen, for score_bounds.
+
+    Parameters
+    ----------
+    regimens : pandas.DataFrame
+        Regimen table with a name and a shortString column.
+    col_name_regimens : str, optional
+        Column holding the encoded regimen, by default "shortString".
+    col_name_regName : str, optional
+        Column holding the regimen name, by default "regName".
+
+    Examples
+    --------
+    >>> catalog = RegimenCatalog(regimens)
+    >>> df = align_patients_regimens(patients, catalog)
+    """
+
+    def __init__(
+        self, regimens, col_name_regimens="shortString", col_name_regName="regName"
+    ):
+        self.names = regimens[col_name_regName].to_numpy(dtype=object)
+        self.seqs = regimens[col_name_regimens].to_numpy(dtype=object)
+
+        self.vocabulary = []
+        self.drug2idx = {}
+        self.encoded = []
+        self.times = []
+        self.drug_ids = []
+        self.drug_sets = []
+
+        for seq in self.seqs:
+            s = encode_py(seq)
+            for t, d in s:
+                if d not in self.drug2idx:
+                    self.drug2idx[d] = len(self.vocabulary)
+                    self.vocabulary.append(d)
+
+            self.encoded.append(s)
+            self.times.append(np.array([float(t) for t, d in s], dtype=np.float64))
+            self.drug_ids.append(
+                np.array([self.drug2idx[d] for t, d in s], dtype=np.int32)
+            )
+            self.drug_sets.append(frozenset(d for t, d in s))
+
+        # Inverted index (drug id -> regimens containing it) and one bitmask
+        # per regimen over the vocabulary, for the eligibility prefilter
+        n_words = max(1, (len(self.vocabulary) + 63) // 64)
+        self.masks = np.zeros((len(self.seqs), n_words), dtype=np.uint64)
+        postings = [[] for _ in self.vocabulary]
+        for j, ids in enumerate(self.drug_ids):
+            for k in np.unique(ids):
+                self.masks[j, k >> 6] |= np.uint64(1) << np.uint64(k & 63)
+                postings[k].append(j)
+        self.postings = [np.array(p, dtype=np.int64) for p in postings]
+
+        self.offsets = np.zeros(len(self.seqs) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(x) for x in self.times])
+        self.flat_times = np.concatenate(self.times + [np.empty(0, dtype=np.float64)])
+        self.flat_drug_ids = np.concatenate(
+            self.drug_ids + [np.empty(0, dtype=np.int32)]
+        )
+        self.ranks = np.concatenate(
+            [_occurrence_ranks(ids) for ids in self.drug_ids]
+            + [np.empty(0, dtype=np.int64)]
+        )
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def drug_mask(self, drugs):
+        """
+        Bitmask of the given drug names over the catalog vocabulary.
+        Drugs that appear in no regimen are ignored.
+        """
+        mask = np.zeros(self.masks.shape[1], dtype=np.uint64)
+        for d in drugs:
+            k = self.drug2idx.get(d)
+            if k is not None:
+                mask[k >> 6] |= np.uint64(1) << np.uint64(k & 63)
+        return mask
+
+    def eligible(self, drugs):
+        """
+        Indices (ascending) of the regimens whose drugs are all in `drugs`.
+
+        Candidates are gathered from the posting lists of the given drugs,
+        then confirmed with a bitwise AND against the regimen masks, so the
+        cost depends on the number of candidates, not on the catalog size.
+        """
+        return self.eligible_ids(
+            [self.drug2idx[d] for d in drugs if d in self.drug2idx]
+        )
+
+    def eligible_ids(self, ids):
+        """
+        eligible() for drug ids instead of drug names.
+
+        Parameters
+        ----------
+        ids : array-like of int
+            Drug ids over the catalog vocabulary, e.g. a record slice of
+            encode_bulk with this vocabulary. Ids past the catalog
+            vocabulary are drugs of no regimen and are ignored.
+
+        Returns
+        -------
+        numpy.ndarray
+            int64 indices (ascending) of the eligible regimens.
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        ids = ids[ids < len(self.vocabulary)]
+        if ids.shape[0] == 0:
+            return np.empty(0, dtype=np.int64)
+
+        candidates = np.unique(np.concatenate([self.postings[k] for k in ids]))
+        mask = np.zeros(self.masks.shape[1], dtype=np.uint64)
+        for k in ids:
+            mask[k >> 6] |= np.uint64(1) << np.uint64(k & 63)
+        covered = ~(self.masks[candidates] & ~mask).any(axis=1)
+
+        return candidates[covered]
+
+    def score_bounds(self, sim, counts, regimen_ids):
+        """
+        Upper bounds on the scores of a record against catalog regimens,
+        computed without filling any matrix.
+
+        Every aligned (diagonal) step pairs a regimen drug with a distinct
+        record drug and adds at most their similarity (time penalties and
+        gaps only subtract, for T >= 0 and g >= 0). A regimen drug d can
+        therefore add at most max(0, best similarity of d to a record drug),
+        for no more of its positions than there are record drugs with a
+        positive similarity to d, and for at most len(record) steps.
+
+        Parameters
+        ----------
+        sim : numpy.ndarray
+            (len(vocabulary), k) similarity of every catalog drug (as the
+            regimen drug) to the k distinct drugs of the record.
+        counts : numpy.ndarray
+            (k,) occurrences of these drugs in the record.
+        regimen_ids : numpy.ndarray
+            Catalog indices of the regimens.
+
+        Returns
+        -------
+        score : numpy.ndarray
+            float64 bound on Score, per regimen.
+        step : numpy.ndarray
+            float64 bound on the score of one aligned step, which also
+            bounds adjustedS = Score / totAlign.
+        """
+        regimen_ids = np.asarray(regimen_ids, dtype=np.int64)
+        if regimen_ids.shape[0] == 0 or sim.shape[1] == 0:
+            zeros = np.zeros(regimen_ids.shape[0], dtype=np.float64)
+            return zeros, zeros
+
+        best = np.maximum(sim.max(axis=1), 0)
+        cap = (sim > 0).astype(np.int64) @ np.asarray(counts, dtype=np.int64)
+
+        # Positions of the regimens, in CSR order
+        starts = self.offsets[regimen_ids]
+        lengths = self.offsets[regimen_ids + 1] - starts
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1]) + np.repeat(starts - (ends - lengths), lengths)
+
+        drugs = self.flat_drug_ids[positions]
+        gain = np.where(self.ranks[positions] < cap[drugs], best[drugs], 0.0)
+        step = np.maximum.reduceat(gain, ends - lengths)
+        score = np.minimum(np.add.reduceat(gain, ends - lengths), np.sum(counts) * step)
+
+        return score, step
+
+    def windows(self, drugs, regimen, margin):
+        """
+        Candidate regions of a record for windowed alignment.
+
+        Every record position holding a drug of the regimen is padded by
+        margin positions on both sides, and overlapping or adjacent windows
+        are merged: a region is a run of regimen drugs less than
+        2 * margin + 1 positions apart, plus the margin.
+
+        Parameters
+        ----------
+        drugs : numpy.ndarray
+            Drug ids of the record over the catalog vocabulary (ids past it,
+            or -1, are drugs of no regimen).
+        regimen : int
+            Catalog index of the regimen.
+        margin : int
+            Record positions added on each side of a regimen drug.
+
+        Returns
+        -------
+        starts, ends : numpy.ndarray
+            int64 bounds of the disjoint windows (half-open, ascending).
+        """
+        drugs = np.asarray(drugs)
+        hits = np.flatnonzero(np.isin(drugs, self.drug_ids[regimen]))
+        if hits.shape[0] == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        starts = np.maximum(hits - margin, 0)
+        ends = np.minimum(hits + margin + 1, drugs.shape[0])
+        first = np.r_[True, starts[1:] > ends[:-1]]
+        last = np.r_[first[1:], True]
+        return starts[first], ends[last]
+
+    def __repr__(self):
+        return (
+            f"RegimenCatalog({len(self)} regimens, "
+            f"{len(self.vocabulary)} drugs)"
+        )
@@ -0,0 +1,420 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from encoding import encode_bulk
+
+COHORT_FORMAT = "artemis-cohort"
+COHORT_VERSION = 1
+
+
+class _ArrayFile:
+    """
+    1-d array appended block by block to a raw file, saved as .npy on close.
+    """
+
+    def __init__(self, path, name, dtype):
+        self.path = os.path.join(path, f"{name}.npy")
+        self.dtype = np.dtype(dtype)
+        self.size = 0
+        self.file = open(self.path + ".part", "wb")
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        values.tofile(self.file)
+        self.size += values.shape[0]
+
+    def close(self, block=1 << 24):
+        self.file.close()
+        out = np.lib.format.open_memmap(
+            self.path, mode="w+", dtype=self.dtype, shape=(self.size,)
+        )
+        if self.size:
+            raw = np.memmap(self.path + ".part", dtype=self.dtype, mode="r")
+            for a in range(0, self.size, block):
+                out[a : a + block] = raw[a : a + block]
+            del raw
+        out.flush()
+        del out
+        os.remove(self.path + ".part")
+
+
+class _StringFile:
+    """
+    Strings appended block by block, saved as one utf-8 byte array plus
+    int64 offsets.
+    """
+
+    def __init__(self, path, name):
+        self.offsets = _ArrayFile(path, f"{name}_offsets", np.int64)
+        self.data = _ArrayFile(path, f"{name}_data", np.uint8)
+        self.offsets.append([0])
+
+    def append(self, values):
+        encoded = [str(v).encode("utf-8") for v in values]
+        self.offsets.append(self.data.size + np.cumsum([len(b) for b in encoded]))
+        self.data.append(np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def close(self):
+        self.offsets.close()
+        self.data.close()
+
+
+class _LazyColumn:
+    """
+    Column of a CohortStore view read on indexing: `column[rows]` only
+    reads (and decodes) the distinct rows asked for.
+    """
+
+    def __init__(self, read, n):
+        self.read = read
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, rows):
+        unique, inverse = np.unique(np.asarray(rows), return_inverse=True)
+        return self.read(unique)[inverse]
+
+
+class CohortWriter:
+    """
+    Write a cohort store from encoded records, one block of patients at a
+    time, so a cohort larger than memory can be written.
+
+    Blocks are appended to raw files and only turned into the .npy arrays
+    of the store by close, which streams them in fixed-size pieces.
+
+    Parameters
+    ----------
+    path : str
+        Directory to write, created if needed.
+
+    Examples
+    --------
+    >>> writer = CohortWriter("cohort")
+    >>> writer.append(ids, offsets, times, drug_ids, records)
+    >>> store = writer.close(vocabulary)
+    """
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.n_patients = 0
+        self.id_kind = None
+        self._ids = None
+        self._offsets = _ArrayFile(path, "offsets", np.int64)
+        self._times = _ArrayFile(path, "times", np.float64)
+        self._drug_ids = _ArrayFile(path, "drug_ids", np.int32)
+        self._records = _StringFile(path, "records")
+        self._offsets.append([0])
+
+    def append(self, ids, offsets, times, drug_ids, records):
+        """
+        Append a block of patients.
+
+        Parameters
+        ----------
+        ids : array-like
+            Patient ids (integers, or anything else stored as strings).
+        offsets, times, drug_ids : numpy.ndarray
+            CSR arrays of the block (see encode_bulk), drug ids over the
+            vocabulary passed to close.
+        records : array-like of str
+            seq strings of the block.
+        """
+        ids = pd.Series(ids)
+        if self.id_kind is None:
+            self.id_kind = "int" if pd.api.types.is_integer_dtype(ids.dtype) else "str"
+            if self.id_kind == "int":
+                self._ids = _ArrayFile(self.path, "ids", np.int64)
+            else:
+                self._ids = _StringFile(self.path, "ids")
+        self._ids.append(ids.to_numpy())
+
+        offsets = np.asarray(offsets, dtype=np.int64)
+        self._offsets.append(self._times.size + offsets[1:] - offsets[0])
+        self._times.append(times[offsets[0] : offsets[-1]])
+        self._drug_ids.append(drug_ids[offsets[0] : offsets[-1]])
+        self._records.append(records)
+        self.n_patients += len(ids)
+
+    def close(self, vocabulary):
+        """
+        Finish the store.
+
+        Parameters
+        ----------
+        vocabulary : list of str
+            Drug names, by id.
+
+        Returns
+        -------
+        CohortStore
+            The opened store.
+        """
+        if self.id_kind is None:
+            self.id_kind = "int"
+            self._ids = _ArrayFile(self.path, "ids", np.int64)
+        for f in (self._ids, self._offsets, self._times, self._drug_ids, self._records):
+            f.close()
+
+        meta = {
+            "format": COHORT_FORMAT,
+            "version": COHORT_VERSION,
+            "n_patients": self.n_patients,
+            "n_events": self._times.size,
+            "id_kind": self.id_kind,
+            "vocabulary": list(vocabulary),
+        }
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        return CohortStore(self.path)
+
+
+class CohortStore:
+    """
+    Encoded cohort on disk, opened as memory maps.
+
+    The store is a directory written once from a patient table
+    (CohortStore.write) holding the records as CSR arrays (offsets, times,
+    drug_ids, see encode_bulk), the drug vocabulary, the patient ids and
+    the raw seq strings. Arrays are opened with np.load(mmap_mode="c"), so
+    opening is independent of the cohort size, processes aligning the same
+    store share its pages, and nothing is written back to the files.
+
+    Slicing (store[a:b]) gives a view on a range of patients without
+    copying; the offsets of a view still index the full times and drug_ids.
+
+    Parameters
+    ----------
+    path : str
+        Directory written by CohortStore.write.
+
+    Examples
+    --------
+    >>> CohortStore.write(patients, "cohort", vocabulary=catalog.vocabulary)
+    >>> store = CohortStore("cohort")
+    >>> df = align_patients_regimens(store, catalog)
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("format") != COHORT_FORMAT or meta.get("version") != COHORT_VERSION:
+            raise ValueError(f"{path} is not a version {COHORT_VERSION} cohort store")
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c")
+
+        self.path = path
+        self.vocabulary = meta["vocabulary"]
+        self.id_kind = meta["id_kind"]
+        self.all_offsets = load("offsets")
+        self.times = load("times")
+        self.drug_ids = load("drug_ids")
+        if self.id_kind == "int":
+            self._ids = load("ids")
+        else:
+            self._ids = (load("ids_offsets"), load("ids_data"))
+        self._records = (load("records_offsets"), load("records_data"))
+        self.start = 0
+        self.stop = meta["n_patients"]
+
+    @classmethod
+    def write(
+        cls,
+        patients,
+        path,
+        col_name_patient_id="person_id",
+        col_name_patient_record="seq",
+        vocabulary=None,
+    ):
+        """
+        Encode a patient table and write it as a cohort store.
+
+        Parameters
+        ----------
+        patients : pandas.DataFrame
+            Patient table (stringDF) with an id and a seq column.
+        path : str
+            Directory to write, created if needed.
+        vocabulary : list of str, optional
+            Drugs whose ids are fixed first, by default None. Passing the
+            RegimenCatalog vocabulary lets alignments use the drug ids
+            without remapping them.
+
+        Returns
+        -------
+        CohortStore
+            The opened store.
+        """
+        records = patients[col_name_patient_record].to_numpy(dtype=object)
+        offsets, times, drug_ids, vocab = encode_bulk(records, vocabulary)
+
+        writer = CohortWriter(path)
+        writer.append(patients[col_name_patient_id], offsets, times, drug_ids, records)
+        return writer.close(vocab)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("CohortStore only supports contiguous slices")
+        start, stop, _ = key.indices(len(self))
+        view = object.__new__(type(self))
+        view.__dict__.update(self.__dict__)
+        view.start = self.start + start
+        view.stop = self.start + max(start, stop)
+        return view
+
+    @property
+    def offsets(self):
+        """
+        Record boundaries of the patients of this view, into times and
+        drug_ids.
+        """
+        return self.all_offsets[self.start : self.stop + 1]
+
+    def _strings(self, arrays, rows=None):
+        offsets, data = arrays
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        return np.array(
+            [
+                bytes(data[offsets[k] : offsets[k + 1]]).decode("utf-8")
+                for k in self.start + rows
+            ],
+            dtype=object,
+        )
+
+    def patient_ids(self, rows=None):
+        """
+        Patient ids of this view (or of its rows `rows`), as an object
+        array.
+        """
+        if self.id_kind == "int":
+            ids = self._ids[self.start : self.stop]
+            return (ids if rows is None else ids[np.asarray(rows)]).astype(object)
+        return self._strings(self._ids, rows)
+
+    def records(self, rows=None):
+        """
+        Raw seq strings of this view (or of its rows `rows`), as an object
+        array.
+        """
+        return self._strings(self._records, rows)
+
+    def columns(self):
+        """
+        Patient ids and seq strings of this view as lazy columns: indexing
+        one with an array of rows only decodes those rows (see
+        AlignmentResults, which reads the rows of its output only).
+
+        Returns
+        -------
+        tuple
+            (patient ids, records) columns.
+        """
+        return (
+            _LazyColumn(self.patient_ids, len(self)),
+            _LazyColumn(self.records, len(self)),
+        )
+
+    def unique_records(self):
+        """
+        Group the identical records of this view, as
+        encoding.unique_records, on the CSR arrays: records with the same
+        events (times and drug ids) are aligned identically, so the seq
+        strings are not decoded.
+
+        Returns
+        -------
+        codes, first : numpy.ndarray
+            See encoding.unique_records.
+        """
+        offsets = np.asarray(self.offsets)
+        lengths = np.diff(offsets)
+
+        # One exact grouping per record length, on the events as rows of
+        # int64 (time bits, drug id) pairs
+        groups = np.empty(len(self), dtype=np.int64)
+        n_groups = 0
+        for length in np.unique(lengths):
+            rows = np.flatnonzero(lengths == length)
+            if length == 0:
+                groups[rows] = n_groups
+                n_groups += 1
+                continue
+            events = offsets[rows, None] + np.arange(length)
+            key = np.empty((rows.shape[0], 2 * length), dtype=np.int64)
+            key[:, :length] = self.times[events].view(np.int64)
+            key[:, length:] = self.drug_ids[events]
+            key = key.view(np.dtype((np.void, key.shape[1] * 8))).ravel()
+            inverse = np.unique(key, return_inverse=True)[1].ravel()
+            groups[rows] = n_groups + inverse
+            n_groups += int(inverse.max()) + 1
+
+        codes = pd.factorize(groups)[0].astype(np.int64)
+        first = np.unique(codes, return_index=True)[1].astype(np.int64)
+        return codes, first
+
+    def csr(self, vocabulary):
+        """
+        CSR arrays of this view with drug ids over a run vocabulary.
+
+        Parameters
+        ----------
+        vocabulary : list of str
+            Drugs that must keep their ids (e.g. RegimenCatalog.vocabulary).
+
+        Returns
+        -------
+        tuple
+            (offsets, times, drug_ids, run vocabulary). When vocabulary is
+            a prefix of the store vocabulary these are the memory maps
+            themselves; otherwise the drug ids of the view are remapped
+            (offsets then start at 0).
+        """
+        vocabulary = list(vocabulary)
+        if self.vocabulary[: len(vocabulary)] == vocabulary:
+            return self.offsets, self.times, self.drug_ids, list(self.vocabulary)
+
+        drug2idx = {d: k for k, d in enumerate(vocabulary)}
+        for d in self.vocabulary:
+            drug2idx.setdefault(d, len(drug2idx))
+        lookup = np.array([drug2idx[d] for d in self.vocabulary], dtype=np.int32)
+
+        offsets = self.offsets
+        a, b = offsets[0], offsets[-1]
+        return (
+            offsets - a,
+            self.times[a:b],
+            lookup[self.drug_ids[a:b]],
+            list(drug2idx),
+        )
+
+    def to_frame(self, col_name_patient_id="person_id", col_name_patient_record="seq"):
+        """
+        Patient table of this view.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Id and seq columns, as written.
+        """
+        ids = self.patient_ids()
+        if self.id_kind == "int":
+            ids = ids.astype(np.int64)
+        return pd.DataFrame(
+            {col_name_patient_id: ids, col_name_patient_record: self.records()}
+        )
+
+    def __repr__(self):
+        return (
+            f"CohortStore({self.path!r}, {len(self)} patients, "
+            f"{len(self.vocabulary)} drugs)"
+        )
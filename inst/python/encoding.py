@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+
+
+def encode_py(str_seq: str):
+    """
+    Encode a semicolon-separated string of drug records into structured pairs.
+
+    Each element of the input string has the form "x.y" (e.g., "0.c").
+    The function splits on ';' and then splits each element on '.'.
+
+    Parameters
+    ----------
+    str_seq : str
+        Input string of drug records, e.g. "0.c;0.c;1.a;1.b;1.c".
+        A trailing semicolon is allowed and will be ignored.
+
+    Returns
+    -------
+    list of list of str
+        Encoded records, where each record is represented as [x, y].
+
+    Examples
+    --------
+    >>> encode_py("0.c;0.c;1.a;1.b;1.c;")
+    [['0', 'c'], ['0', 'c'], ['1', 'a'], ['1', 'b'], ['1', 'c']]
+    """
+    # Remove trailing ';' if present and split by ';'
+    s_temp = str_seq.rstrip(";").split(";")
+
+    s_encoded = []
+
+    for item in s_temp:
+        # Split each "x.y" into [x, y]
+        t_vec = item.split(".")
+        s_encoded.append(t_vec)
+
+    return s_encoded
+
+
+def encode_bulk(seqs, vocabulary=None):
+    """
+    Encode a whole column of drug record strings into CSR arrays at once.
+
+    All records are joined and split in a single pass, times are converted
+    in one go and drug names are factorized, so the vocabulary is only
+    consulted once per distinct drug. Record k is then the zero-copy slice
+    offsets[k]:offsets[k + 1] of times and drug_ids.
+
+    Parameters
+    ----------
+    seqs : iterable of str
+        Drug record strings, e.g. a patients "seq" column.
+    vocabulary : list of str, optional
+        Known drugs, keeping their ids (e.g. RegimenCatalog.vocabulary).
+        New drugs are appended in order of first appearance.
+
+    Returns
+    -------
+    offsets : numpy.ndarray
+        int64 (n + 1,) record boundaries.
+    times : numpy.ndarray
+        float64 time gaps.
+    drug_ids : numpy.ndarray
+        int32 drug ids into the returned vocabulary.
+    vocabulary : list of str
+        Drug names, by id.
+
+    Examples
+    --------
+    >>> offsets, times, drug_ids, vocab = encode_bulk(["0.c;1.a;", "0.a"])
+    >>> offsets, drug_ids, vocab
+    (array([0, 2, 3]), array([0, 1, 1], dtype=int32), ['c', 'a'])
+    """
+    records = [seq.rstrip(";") for seq in seqs]
+    vocabulary = list(vocabulary) if vocabulary is not None else []
+
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum([seq.count(";") + 1 for seq in records], out=offsets[1:])
+
+    # "t.drug;t.drug" -> [t, drug, t, drug]
+    parts = ";".join(records).replace(";", ".").split(".") if records else []
+    if len(parts) != 2 * offsets[-1]:
+        raise ValueError("Malformed drug record, expected 't.drug;t.drug;...'")
+
+    times = np.fromiter(map(float, parts[0::2]), dtype=np.float64, count=offsets[-1])
+
+    # Codes in order of first appearance, mapped once per distinct drug
+    codes, names = pd.factorize(np.array(parts[1::2], dtype=object))
+    drug2idx = {d: k for k, d in enumerate(vocabulary)}
+    lookup = np.empty(len(names), dtype=np.int32)
+    for k, d in enumerate(names):
+        if d not in drug2idx:
+            drug2idx[d] = len(vocabulary)
+            vocabulary.append(d)
+        lookup[k] = drug2idx[d]
+
+    drug_ids = lookup[codes]
+
+    return offsets, times, drug_ids, vocabulary
+
+
+def decode_bulk(offsets, times, drug_ids, vocabulary):
+    """
+    Render CSR records back into drug record strings (inverse of
+    encode_bulk).
+
+    Whole-number time gaps are written without a decimal part, as in the
+    strings built from a CDM.
+
+    Parameters
+    ----------
+    offsets : numpy.ndarray
+        int64 (n + 1,) record boundaries into times and drug_ids.
+    times : numpy.ndarray
+        float64 time gaps.
+    drug_ids : numpy.ndarray
+        Drug ids into vocabulary.
+    vocabulary : list of str
+        Drug names, by id.
+
+    Returns
+    -------
+    numpy.ndarray
+        (n,) object array of "t.drug;t.drug;" strings.
+
+    Examples
+    --------
+    >>> decode_bulk(np.array([0, 2, 3]), np.array([0.0, 1.0, 0.0]),
+    ...             np.array([0, 1, 1]), ["c", "a"])
+    array(['0.c;1.a;', '0.a;'], dtype=object)
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    a, b = offsets[0], offsets[-1]
+    times = np.asarray(times[a:b], dtype=np.float64)
+    if np.all(times == np.round(times)):
+        labels = times.astype(np.int64).astype(str).astype(object)
+    else:
+        labels = np.array([repr(t) for t in times.tolist()], dtype=object)
+
+    names = np.asarray(vocabulary, dtype=object)
+    tokens = (labels + ".") + names[np.asarray(drug_ids[a:b])] + ";"
+    bounds = (offsets - a).tolist()
+    return np.array(
+        ["".join(tokens[i:j]) for i, j in zip(bounds[:-1], bounds[1:])], dtype=object
+    )
+
+
+def unique_records(seqs):
+    """
+    Group identical drug record strings.
+
+    Parameters
+    ----------
+    seqs : array-like of str
+        Drug record strings, e.g. a patients "seq" column.
+
+    Returns
+    -------
+    codes : numpy.ndarray
+        int64 index of the unique record of every input record.
+    first : numpy.ndarray
+        int64 position of the first occurrence of every unique record, in
+        order of first appearance.
+
+    Examples
+    --------
+    >>> unique_records(["0.a;", "0.b;", "0.a;"])
+    (array([0, 1, 0]), array([0, 1]))
+    """
+    codes, uniques = pd.factorize(np.asarray(seqs, dtype=object), use_na_sentinel=False)
+    codes = codes.astype(np.int64, copy=False)
+    first = np.full(len(uniques), len(codes), dtype=np.int64)
+    np.minimum.at(first, codes, np.arange(len(codes), dtype=np.int64))
+    return codes, first
@@ -0,0 +1,377 @@
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+import pandas as pd
+from encoding import decode_bulk
+from cohort import CohortWriter
+
+EXPOSURE_COLUMNS = [
+    "person_id",
+    "drug_exposure_start_date",
+    "ancestor_concept_id",
+    "concept_name",
+]
+
+
+def read_drug_exposures(
+    source, chunksize=1_000_000, file_format=None, table="drug_exposure", columns=None
+):
+    """
+    Read drug exposure rows (con_df, see getConDF) in chunks.
+
+    Parameters
+    ----------
+    source : str
+        CSV, Parquet or SQLite file.
+    chunksize : int, optional
+        Rows per chunk, by default 1_000_000.
+    file_format : str, optional
+        "csv", "parquet" or "sqlite", by default from the path suffix
+        (.parquet or .pq, .sqlite, .sqlite3 or .db, anything else is CSV).
+        Parquet needs pyarrow.
+    table : str, optional
+        Table to read from a SQLite file, by default "drug_exposure".
+    columns : list of str, optional
+        Columns to read, by default EXPOSURE_COLUMNS.
+
+    Yields
+    ------
+    pandas.DataFrame
+        Chunks of at most chunksize rows.
+    """
+    columns = list(columns) if columns is not None else EXPOSURE_COLUMNS
+    if file_format is None:
+        path = str(source)
+        if path.endswith((".parquet", ".pq")):
+            file_format = "parquet"
+        elif path.endswith((".sqlite", ".sqlite3", ".db")):
+            file_format = "sqlite"
+        else:
+            file_format = "csv"
+
+    if file_format == "csv":
+        yield from pd.read_csv(source, usecols=columns, chunksize=chunksize)
+    elif file_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("read_drug_exposures from parquet requires pyarrow") from e
+        for batch in pq.ParquetFile(source).iter_batches(
+            batch_size=chunksize, columns=columns
+        ):
+            yield batch.to_pandas()
+    elif file_format == "sqlite":
+        con = sqlite3.connect(source)
+        try:
+            query = 'SELECT {} FROM "{}"'.format(
+                ", ".join(f'"{c}"' for c in columns), table
+            )
+            yield from pd.read_sql_query(query, con, chunksize=chunksize)
+        finally:
+            con.close()
+    else:
+        raise ValueError(
+            f"Unknown file_format '{file_format}', use 'csv', 'parquet' or 'sqlite'"
+        )
+
+
+class _Partitions:
+    """
+    (patient, day, drug) triples split by patient into n_partitions, kept in
+    memory for a single partition and spilled to raw files otherwise.
+    """
+
+    FIELDS = (("patient", np.int64), ("day", np.int64), ("drug", np.int32))
+
+    def __init__(self, n_partitions, tmp_dir=None):
+        self.n = n_partitions
+        self.blocks = [[] for _ in range(n_partitions)]
+        self.tmp = tempfile.TemporaryDirectory(dir=tmp_dir) if n_partitions > 1 else None
+
+    def _file(self, k, field):
+        return os.path.join(self.tmp.name, f"{k}_{field}.bin")
+
+    def append(self, patient, day, drug):
+        if self.tmp is None:
+            self.blocks[0].append((patient, day, drug))
+            return
+        part = patient % self.n
+        order = np.argsort(part, kind="stable")
+        bounds = np.searchsorted(part[order], np.arange(self.n + 1))
+        for k in range(self.n):
+            rows = order[bounds[k] : bounds[k + 1]]
+            if rows.shape[0] == 0:
+                continue
+            for (field, dtype), values in zip(self.FIELDS, (patient, day, drug)):
+                with open(self._file(k, field), "ab") as f:
+                    values[rows].astype(dtype).tofile(f)
+
+    def load(self, k):
+        if self.tmp is None:
+            blocks = self.blocks[k]
+            self.blocks[k] = []
+            return tuple(
+                np.concatenate([b[i] for b in blocks] + [np.empty(0, dtype=dtype)])
+                for i, (_, dtype) in enumerate(self.FIELDS)
+            )
+        return tuple(
+            np.fromfile(self._file(k, field), dtype=dtype)
+            if os.path.exists(self._file(k, field))
+            else np.empty(0, dtype=dtype)
+            for field, dtype in self.FIELDS
+        )
+
+    def close(self):
+        if self.tmp is not None:
+            self.tmp.cleanup()
+
+
+def iter_encoded_exposures(
+    source,
+    valid_drugs,
+    vocabulary=None,
+    n_partitions=1,
+    chunksize=1_000_000,
+    file_format=None,
+    table="drug_exposure",
+    col_name_patient_id="person_id",
+    col_name_date="drug_exposure_start_date",
+    col_name_concept_id="ancestor_concept_id",
+    col_name_drug="concept_name",
+    tmp_dir=None,
+):
+    """
+    Encode drug exposure rows into CSR drug records, without building and
+    parsing seq strings (stringDF_from_cdm, R/inputOutput.R).
+
+    Rows are read in chunks and only kept as (patient, day, drug) integer
+    triples: rows of concepts outside valid_drugs are dropped, dates become
+    day numbers and patient ids and drug names are factorized. Every
+    partition of patients is then sorted by patient, day and drug name,
+    repeated exposures to a drug on the same day are dropped, and the time
+    gaps are the days since the previous exposure of the patient (0 for
+    the first one).
+
+    With n_partitions > 1 the triples are spilled to temporary files by
+    patient and encoded one partition at a time, so memory is bounded by a
+    chunk plus a partition.
+
+    Parameters
+    ----------
+    source : str or iterable of pandas.DataFrame
+        File for read_drug_exposures, or chunks of rows.
+    valid_drugs : pandas.DataFrame or array-like
+        Valid concept ids (loadDrugs), as a valid_concept_id column or
+        as the ids themselves.
+    vocabulary : list of str, optional
+        Drugs whose ids are fixed first, by default None. Passing the
+        RegimenCatalog vocabulary lets alignments use the drug ids without
+        remapping them.
+    n_partitions : int, optional
+        Number of patient partitions, by default 1 (in memory).
+    chunksize, file_format, table :
+        Passed to read_drug_exposures.
+    col_name_patient_id, col_name_date, col_name_concept_id, col_name_drug : str, optional
+        Columns of the exposure rows.
+    tmp_dir : str, optional
+        Where partitions are spilled, by default the system temp directory.
+
+    Yields
+    ------
+    tuple
+        (ids, offsets, times, drug_ids, vocabulary) per partition, patients
+        sorted by id within a partition. Drug names are written as in the
+        seq strings (commas as "_", spaces removed); vocabulary is complete
+        from the first partition on.
+    """
+    if isinstance(valid_drugs, pd.DataFrame):
+        valid_drugs = valid_drugs["valid_concept_id"]
+    valid_drugs = pd.unique(np.asarray(valid_drugs))
+
+    if isinstance(source, (str, os.PathLike)):
+        source = read_drug_exposures(
+            source,
+            chunksize,
+            file_format,
+            table,
+            [col_name_patient_id, col_name_date, col_name_concept_id, col_name_drug],
+        )
+
+    # Patient ids (when not integers) and drug names, by code
+    patient2code = {}
+    patient_ids = []
+    int_ids = None
+    drug2code = {}
+    drugs = []
+
+    partitions = _Partitions(n_partitions, tmp_dir)
+    try:
+        for chunk in source:
+            chunk = chunk[chunk[col_name_concept_id].isin(valid_drugs)]
+            if chunk.shape[0] == 0:
+                continue
+
+            ids = chunk[col_name_patient_id]
+            if int_ids is None:
+                int_ids = pd.api.types.is_integer_dtype(ids.dtype)
+            if int_ids:
+                patient = ids.to_numpy(dtype=np.int64)
+            else:
+                codes, uniques = pd.factorize(ids)
+                lookup = np.empty(len(uniques), dtype=np.int64)
+                for k, p in enumerate(uniques):
+                    lookup[k] = patient2code.setdefault(p, len(patient_ids))
+                    if lookup[k] == len(patient_ids):
+                        patient_ids.append(p)
+                patient = lookup[codes]
+
+            day = (
+                pd.to_datetime(chunk[col_name_date])
+                .to_numpy(dtype="datetime64[D]")
+                .astype(np.int64)
+            )
+
+            codes, uniques = pd.factorize(chunk[col_name_drug].astype(str))
+            lookup = np.empty(len(uniques), dtype=np.int32)
+            for k, d in enumerate(uniques):
+                lookup[k] = drug2code.setdefault(d, len(drugs))
+                if lookup[k] == len(drugs):
+                    drugs.append(d)
+            partitions.append(patient, day, lookup[codes])
+
+        # Seq drug names, and their ids over the vocabulary
+        vocabulary = list(vocabulary) if vocabulary is not None else []
+        name2idx = {d: k for k, d in enumerate(vocabulary)}
+        drug_idx = np.empty(len(drugs), dtype=np.int32)
+        for k, d in enumerate(drugs):
+            name = d.replace(",", "_").replace(" ", "")
+            if name not in name2idx:
+                name2idx[name] = len(vocabulary)
+                vocabulary.append(name)
+            drug_idx[k] = name2idx[name]
+        drug_rank = np.empty(len(drugs), dtype=np.int64)
+        drug_rank[np.argsort(np.array(drugs, dtype=object))] = np.arange(len(drugs))
+
+        if not int_ids:
+            ids = np.array(patient_ids, dtype=object)
+            patient_rank = np.empty(len(ids), dtype=np.int64)
+            patient_rank[np.argsort(ids)] = np.arange(len(ids))
+
+        for k in range(n_partitions):
+            patient, day, drug = partitions.load(k)
+            if patient.shape[0] == 0:
+                continue
+            key = patient if int_ids else patient_rank[patient]
+            order = np.lexsort((drug_rank[drug], day, key))
+            patient, day, drug = patient[order], day[order], drug[order]
+
+            # Same-day repeats of a drug
+            keep = np.r_[
+                True,
+                (patient[1:] != patient[:-1])
+                | (day[1:] != day[:-1])
+                | (drug[1:] != drug[:-1]),
+            ]
+            patient, day, drug = patient[keep], day[keep], drug[keep]
+
+            first = np.r_[True, patient[1:] != patient[:-1]]
+            gaps = np.r_[0, np.diff(day)].astype(np.float64)
+            gaps[first] = 0
+            starts = np.flatnonzero(first)
+            offsets = np.r_[starts, len(patient)].astype(np.int64)
+
+            yield (
+                patient[starts] if int_ids else ids[patient[starts]],
+                offsets,
+                gaps,
+                drug_idx[drug],
+                vocabulary,
+            )
+    finally:
+        partitions.close()
+
+
+def encode_drug_exposures(source, valid_drugs, **kwargs):
+    """
+    Encode drug exposure rows into a single set of CSR drug records.
+
+    Parameters
+    ----------
+    source : str or iterable of pandas.DataFrame
+        See iter_encoded_exposures.
+    valid_drugs : pandas.DataFrame or array-like
+        See iter_encoded_exposures.
+    **kwargs :
+        Passed to iter_encoded_exposures.
+
+    Returns
+    -------
+    tuple
+        (ids, offsets, times, drug_ids, vocabulary), as from encode_bulk
+        plus the patient ids. decode_bulk gives the seq strings.
+
+    Examples
+    --------
+    >>> ids, offsets, times, drug_ids, vocab = encode_drug_exposures(
+    ...     "con_df.csv", loadDrugs())
+    >>> patients = pd.DataFrame(
+    ...     {"person_id": ids, "seq": decode_bulk(offsets, times, drug_ids, vocab)})
+    """
+    parts = list(iter_encoded_exposures(source, valid_drugs, **kwargs))
+    if not parts:
+        return (
+            np.empty(0, dtype=np.int64),
+            np.zeros(1, dtype=np.int64),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.int32),
+            list(kwargs.get("vocabulary") or []),
+        )
+
+    sizes = np.cumsum([0] + [p[1][-1] for p in parts[:-1]])
+    ids = np.concatenate([p[0] for p in parts])
+    offsets = np.concatenate(
+        [[0]] + [p[1][1:] + n for p, n in zip(parts, sizes)]
+    ).astype(np.int64)
+    times = np.concatenate([p[2] for p in parts])
+    drug_ids = np.concatenate([p[3] for p in parts])
+    return ids, offsets, times, drug_ids, parts[0][4]
+
+
+def write_drug_exposures(source, path, valid_drugs, **kwargs):
+    """
+    Encode drug exposure rows straight into a cohort store, one partition
+    of patients at a time.
+
+    Parameters
+    ----------
+    source : str or iterable of pandas.DataFrame
+        See iter_encoded_exposures.
+    path : str
+        Directory of the CohortStore, created if needed.
+    valid_drugs : pandas.DataFrame or array-like
+        See iter_encoded_exposures.
+    **kwargs :
+        Passed to iter_encoded_exposures (e.g. n_partitions, vocabulary).
+
+    Returns
+    -------
+    CohortStore
+        The opened store.
+
+    Examples
+    --------
+    >>> store = write_drug_exposures("con_df.parquet", "cohort", loadDrugs(),
+    ...                              vocabulary=catalog.vocabulary, n_partitions=16)
+    >>> df = align_patients_regimens(store, catalog)
+    """
+    writer = CohortWriter(path)
+    vocabulary = kwargs.get("vocabulary") or []
+    for ids, offsets, times, drug_ids, vocabulary in iter_encoded_exposures(
+        source, valid_drugs, **kwargs
+    ):
+        writer.append(
+            ids, offsets, times, drug_ids, decode_bulk(offsets, times, drug_ids, vocabulary)
+        )
+    return writer.close(vocabulary)
@@ -4,21 +4,88 @@ import math as math
 import re
 
 
-def init_Hmat(s1_len, s2_len):
+class Workspace:
+    """
+    Grow-only arena for the DP matrices, meant to be owned by one worker.
+
+    Hands out views of preallocated buffers (one buffer per name) and only
+    reallocates a buffer when a larger, or differently typed, request
+    arrives. A view is valid until the next request under the same name.
+
+    Attributes
+    ----------
+    nbytes : int
+        Memory currently held by the buffers.
+    peak_nbytes : int
+        Largest nbytes seen.
+    n_allocations : int
+        Number of buffers (re)allocated so far.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.nbytes = 0
+        self.peak_nbytes = 0
+        self.n_allocations = 0
+
+    def empty(self, name, shape, dtype=float):
+        """
+        Uninitialised view of the given shape and dtype.
+        """
+        size = math.prod(shape)
+        buf = self.buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.shape[0] < size:
+            if buf is not None:
+                self.nbytes -= buf.nbytes
+            buf = np.empty(max(size, 1), dtype=dtype)
+            self.buffers[name] = buf
+            self.nbytes += buf.nbytes
+            self.peak_nbytes = max(self.peak_nbytes, self.nbytes)
+            self.n_allocations += 1
+
+        return buf[:size].reshape(shape)
+
+    def zeros(self, name, shape, dtype=float):
+        """
+        Zero-filled view of the given shape and dtype.
+        """
+        view = self.empty(name, shape, dtype)
+        view.fill(0)
+        return view
+
+    def __repr__(self):
+        return (
+            f"Workspace({len(self.buffers)} buffers, {self.nbytes} bytes, "
+            f"peak {self.peak_nbytes} bytes)"
+        )
+
+
+# All init functions draw from `workspace` (a Workspace) when given one,
+# and allocate a fresh array otherwise.
+def init_Hmat(s1_len, s2_len, workspace=None):
+    if workspace is not None:
+        return workspace.zeros("H", (s2_len + 1, s1_len + 1), float)
     H = np.zeros((s2_len + 1, s1_len + 1), float)
     return H
 
 
-def init_TRmat(s1, s1_len, s2, s2_len):
+def init_TRmat(s1, s1_len, s2, s2_len, workspace=None):
+    if workspace is not None:
+        return workspace.zeros("TR", (s2_len + 1, s1_len + 1), float)
     TR = np.zeros((s2_len + 1, s1_len + 1), float)
     return TR
 
 
-def init_TCmat(s1, s1_len, s2, s2_len):
+def init_TCmat(s1, s1_len, s2, s2_len, workspace=None):
+    if workspace is not None:
+        return workspace.zeros("TC", (s2_len + 1, s1_len + 1), float)
     TC = np.zeros((s2_len + 1, s1_len + 1), float)
     return TC
 
 
-def init_traceMat(s1_len, s2_len):
-    traceMat = np.zeros((s2_len + 1, s1_len + 1), float)
+def init_traceMat(s1_len, s2_len, workspace=None):
+    if workspace is not None:
+        return workspace.zeros("traceMat", (s2_len + 1, s1_len + 1), np.int8)
+    # Moves are 0-3, one byte per cell is enough
+    traceMat = np.zeros((s2_len + 1, s1_len + 1), np.int8)
     return traceMat
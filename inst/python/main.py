@@ -1,60 +1,56 @@
 import numpy as np
 import pandas as pd
 import math as math
-from re import search as search_python
-from re import findall
-from init import init_Hmat, init_TRmat, init_TCmat, init_traceMat
-from score import TSW_scoreMat, find_best_score
-from align import align_TSW
+import os
+from concurrent.futures import ProcessPoolExecutor
+from init import init_Hmat, init_TRmat, init_TCmat, init_traceMat, Workspace
+from score import TSW_scoreMat, find_best_score, find_best_score_col
+from align import trace_path, path_lengths, render_path
+from encoding import encode_py, encode_bulk, decode_bulk, unique_records
+from catalog import RegimenCatalog
+from results import AlignmentResults, write_alignments
+from cohort import CohortStore, CohortWriter
+from ingest import (
+    read_drug_exposures,
+    iter_encoded_exposures,
+    encode_drug_exposures,
+    write_drug_exposures,
+)
+from cache import AlignmentCache
+from postprocess import (
+    process_alignments,
+    remove_overlaps,
+    combine_overlaps,
+    calculate_eras,
+    regimen_stats,
+)
 from tqdm import tqdm
 
 pd.options.display.max_columns = None
 
 
-def find_gaps(pat, seq):
-    gaps_init = search_python(pat, seq)
-    if gaps_init is not None:
-        gaps = len(findall("__", gaps_init[0]))
-    else:
-        gaps = 0
-
-    return gaps
-
-
-def encode_py(str_seq: str):
+def similarity_matrix(labels):
     """
-    Encode a semicolon-separated string of drug records into structured pairs.
-
-    Each element of the input string has the form "x.y" (e.g., "0.c").
-    The function splits on ';' and then splits each element on '.'.
+    Generate the default similarity matrix for a list of drug names.
+    Same drugs will have similarity of 1, all others -1.1.
 
     Parameters
     ----------
-    str_seq : str
-        Input string of drug records, e.g. "0.c;0.c;1.a;1.b;1.c".
-        A trailing semicolon is allowed and will be ignored.
+    labels : list
+        Unique drug names.
 
     Returns
     -------
-    list of list of str
-        Encoded records, where each record is represented as [x, y].
-
-    Examples
-    --------
-    >>> encode_py("0.c;0.c;1.a;1.b;1.c;")
-    [['0', 'c'], ['0', 'c'], ['1', 'a'], ['1', 'b'], ['1', 'c']]
+    pandas.DataFrame
+        Similarity matrix labelled by drug name on both axes.
     """
-    # Remove trailing ';' if present and split by ';'
-    s_temp = str_seq.rstrip(";").split(";")
-
-    s_encoded = []
-
-    for item in s_temp:
-        # Split each "x.y" into [x, y]
-        t_vec = item.split(".")
-        s_encoded.append(t_vec)
+    n = len(labels)
+    mat = np.identity(n, dtype=np.float64)
+    mat[mat == 0] = -1.1
 
-    return s_encoded
+    # Build DataFrame with row/col labels
+    df = pd.DataFrame(mat, index=labels, columns=labels)
+    return df
 
 
 def make_matrix(val1, val2):
@@ -78,17 +74,21 @@ def make_matrix(val1, val2):
 
     # Keep unique elements
     unique_vals = list(dict.fromkeys(all_second))
-    n = len(unique_vals)
-    mat = np.identity(n, dtype=np.float64)
-    mat[mat == 0] = -1.1
-
-    # Build DataFrame with row/col labels
-    df = pd.DataFrame(mat, index=unique_vals, columns=unique_vals)
-    return df
+    return similarity_matrix(unique_vals)
 
 
 def temporal_alignment(
-    s1, s2, g=0.4, T=0.5, s=None, verbose=0, mem=-1, removeOverlap=1, method="PropDiff"
+    s1,
+    s2,
+    g=0.4,
+    T=0.5,
+    s=None,
+    verbose=0,
+    mem=-1,
+    removeOverlap=1,
+    method="PropDiff",
+    min_score=None,
+    workspace=None,
 ):
     """
     Align s1 to s2.
@@ -108,12 +108,19 @@ def temporal_alignment(
     verbose : int, optional
         Verbosity level, by default 0.
     mem : int, optional
-        Number of top alignments to return, by default -1 (all).
+        Number of top alignments to return, by default -1 (all). A ValueError
+        is raised when it is larger than the length of a drug record plus one.
     removeOverlap : int, optional
         Whether to remove overlapping drugs in s1 after each alignment, by default 1 (True
         in R).
     method : str, optional
         Method for time penalty calculation, by default "PropDiff".
+    min_score : float, optional
+        Only trace back the endpoints with a score above min_score, by
+        default None (all selected endpoints).
+    workspace : Workspace, optional
+        Arena the score and traceback matrices are taken from, by default
+        None (fresh arrays for this pair).
 
     Returns
     -------
@@ -123,37 +130,135 @@ def temporal_alignment(
     if s is None:
         s = make_matrix(s1, s2)
 
+    returnDat = AlignmentResults()
+    returnDat.append(
+        _alignment_block(s1, s2, g, T, s, verbose, mem, method, min_score, workspace)
+    )
+
+    return returnDat.to_frame()
+
+
+def _alignment_block(s1, s2, g, T, s, verbose, mem, method, min_score, workspace):
+    """
+    Body of temporal_alignment: the aligned rows as typed columns
+    (seqs, scores, pos), see AlignmentResults.
+    s2 is re-ordered in place.
+    """
     s1_len = len(s1)
     s2_len = len(s2)
 
-    # Initialise the 3 score matrices and the traceback matrix
-    H = init_Hmat(s1_len, s2_len)
-    TR = init_TRmat(s1, s1_len, s2, s2_len)
-    TC = init_TCmat(s1, s1_len, s2, s2_len)
-    traceMat = init_traceMat(s1_len, s2_len)
+    H, traceMat = _score_matrices(s1, s2, g, T, s, method, workspace)
+
+    # Find best scoring cell
+    mem_index, mem_score = find_best_score(H, s1_len, s2_len, mem, verbose)
+    mem_index, mem_score = _select_endpoints(mem_index, mem_score, min_score)
+
+    return _trace_block(traceMat, s1, s2, mem_index, mem_score)
+
+
+def _window_block(s1, s2, starts, ends, g, T, s, verbose, mem, method, min_score, workspace):
+    """
+    _alignment_block with the DP restricted to the record windows
+    starts:ends (see RegimenCatalog.windows).
+
+    Every window is scored on its own and gives the last H column of its
+    record rows, rows outside the windows score 0. The endpoints are then
+    selected over the whole record (mem=-1 counts the full record length)
+    and traced back in their window; endpoints outside the windows are not
+    aligned. s2 is not modified.
+    """
+    s1_len = len(s1)
+    s2_len = len(s2)
+
+    H_col = np.zeros(s2_len + 1)
+    windows = []
+    for a, b in zip(starts, ends):
+        s2_window = [x[:] for x in s2[a:b]]
+        H, traceMat = _score_matrices(s1, s2_window, g, T, s, method, workspace)
+        H_col[a : b + 1] = H[:, s1_len]
+        # The workspace views are reused by the next window
+        windows.append((s2_window, traceMat.copy()))
+
+    mem_index, mem_score = find_best_score_col(H_col, s1_len, s2_len, mem, verbose)
+    mem_index, mem_score = _select_endpoints(mem_index, mem_score, min_score)
+
+    rows = mem_index[:, 0]
+    window = np.searchsorted(starts, rows, side="right") - 1
+    inside = (window >= 0) & (rows <= np.asarray(ends)[np.maximum(window, 0)])
+    mem_index, mem_score, window = mem_index[inside], mem_score[inside], window[inside]
+
+    n = len(mem_index)
+    seqs = np.empty((n, 2), dtype=object)
+    scores = np.empty((n, 2), dtype=np.float64)
+    pos = np.empty((n, 6), dtype=np.int32)
+    for k, (s2_window, traceMat) in enumerate(windows):
+        rows = np.flatnonzero(window == k)
+        if len(rows) == 0:
+            continue
+        index = mem_index[rows]
+        index[:, 0] -= int(starts[k])
+        seqs[rows], scores[rows], pos[rows] = _trace_block(
+            traceMat, s1, s2_window, index, mem_score[rows]
+        )
+        pos[rows, 2:4] += int(starts[k])
 
-    # Setup pattern for detecting sequence lengths, by number of "."s (Aligned drugs)
-    pat = r"\."
-    # Setup pattern for detecting sequence gaps, by number of "__"s (Aligned gaps)
-    pat_end_gap = r"(__;)+__$|__$"
+    return seqs, scores, pos
 
-    # Init return Dat
-    returnDat = []
+
+def _score_matrices(s1, s2, g, T, s, method, workspace):
+    """
+    Fill the DP matrices of the pair, returns H and the traceback matrix
+    (views of `workspace`). s2 is re-ordered in place.
+    """
+    s1_len = len(s1)
+    s2_len = len(s2)
+
+    # Initialise the 3 score matrices and the traceback matrix
+    H = init_Hmat(s1_len, s2_len, workspace)
+    TR = init_TRmat(s1, s1_len, s2, s2_len, workspace)
+    TC = init_TCmat(s1, s1_len, s2, s2_len, workspace)
+    traceMat = init_traceMat(s1_len, s2_len, workspace)
 
     # Impute score matrix, retrieve relevant vars
     TSW_scoreMat(s1, s1_len, s2, s2_len, g, T, H, TR, TC, traceMat, s, method)
 
-    # Find best scoring cell
-    mem_index, mem_score = find_best_score(H, s1_len, s2_len, mem, verbose)
+    return H, traceMat
+
+
+def _select_endpoints(mem_index, mem_score, min_score):
+    """
+    Endpoints of find_best_score scoring above min_score (all if None).
+    adjustedS = Score / totAlign with totAlign >= 1: endpoints at or below
+    min_score can never pass an adjustedS > min_score filter.
+    """
+    if min_score is None:
+        return mem_index, mem_score
+    keep = mem_score > min_score
+    return mem_index[keep], mem_score[keep]
+
+
+def _trace_block(traceMat, s1, s2, mem_index, mem_score):
+    """
+    Trace back the endpoints mem_index, as the (seqs, scores, pos) columns
+    of AlignmentResults.
+    """
+    s1_len = len(s1)
+    s2_len = len(s2)
+
+    # Integer paths first, the strings are rendered in one pass at the end
+    paths = []
+    n = len(mem_index)
+    seqs = np.empty((n, 2), dtype=object)
+    scores = np.empty((n, 2), dtype=np.float64)
+    pos = np.empty((n, 6), dtype=np.int32)
 
     for i in range(0, len(mem_index)):
-        s1_aligned_t, s2_aligned_t, totAligned_t, s1_start, s2_start = align_TSW(
-            traceMat, s1, s2, s1_len, s2_len, mem_index[i]
+        path_s1, path_s2, totAligned_t, s1_start, s2_start = trace_path(
+            traceMat, s1_len, s2_len, mem_index[i]
         )
+        paths.append((path_s1, path_s2))
 
-        s_f_len = max(len(findall(pat, s2_aligned_t)), len(findall(pat, s1_aligned_t)))
-
-        s1_end_gaps = find_gaps(pat_end_gap, s1_aligned_t)
+        s_f_len, s1_end_gaps = path_lengths(path_s1, path_s2)
 
         s1_end = mem_index[i][1]
         s2_end = mem_index[i][0] - s1_end_gaps
@@ -164,22 +269,212 @@ def temporal_alignment(
 
         adjustedS = mem_score[i] / totAligned_t
 
-        row = {
-            "Regimen": s1_aligned_t,
-            "DrugRecord": s2_aligned_t,
-            "Score": mem_score[i],
-            "adjustedS": adjustedS,
-            "regimen_Start": s1_start + 1,
-            "regimen_End": s1_end,
-            "drugRec_Start": s2_start + 1,
-            "drugRec_End": s2_end,
-            "Aligned_Seq_len": s_f_len,
-            "totAlign": totAligned_t,
-        }
-        returnDat.append(row)
-    returnDat = pd.DataFrame(returnDat)
+        scores[i] = mem_score[i], adjustedS
+        pos[i] = (
+            s1_start + 1,
+            s1_end,
+            s2_start + 1,
+            s2_end,
+            s_f_len,
+            totAligned_t,
+        )
+
+    for i, (path_s1, path_s2) in enumerate(paths):
+        seqs[i, 0] = render_path(path_s1, s1)
+        seqs[i, 1] = render_path(path_s2, s2)
+
+    return seqs, scores, pos
+
+
+def align_patient_regimens(
+    patient,
+    regimens,
+    regimen_ids=None,
+    g=0.4,
+    T=0.5,
+    s=None,
+    verbose=0,
+    mem=-1,
+    method="PropDiff",
+    min_score=None,
+    workspace=None,
+):
+    """
+    Align one patient record against many regimens in one batched call.
+
+    The patient side (encoding, similarity matrix, workspace) is prepared
+    once, and all rows are collected into one AlignmentResults, turned into
+    a single DataFrame at the end.
+
+    Parameters
+    ----------
+    patient : str or list
+        Drug record, as a seq string or encoded (output of encode_py).
+    regimens : RegimenCatalog or pandas.DataFrame
+        Regimen catalog, or a regimen table with regName and shortString.
+    regimen_ids : list of int, optional
+        Catalog indices of the regimens to align, by default the eligible
+        ones (every regimen drug in the record).
+    min_score, workspace :
+        As in temporal_alignment.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Alignment rows with regName and Regimen_full, in regimen_ids order.
+    """
+    if not isinstance(regimens, RegimenCatalog):
+        regimens = RegimenCatalog(regimens)
 
-    return returnDat
+    s2 = encode_py(patient) if isinstance(patient, str) else patient
+    if regimen_ids is None:
+        regimen_ids = regimens.eligible(set(item[1] for item in s2))
+    if s is None:
+        s = similarity_matrix(
+            list(dict.fromkeys(regimens.vocabulary + [item[1] for item in s2]))
+        )
+    if workspace is None:
+        workspace = Workspace()
+
+    results = AlignmentResults(regimens)
+    _align_patient_batch(
+        s2, regimens, regimen_ids, g, T, s, verbose, mem, method, min_score,
+        workspace, results,
+    )
+
+    return results.to_frame()
+
+
+def _align_patient_batch(
+    s2, regimens, regimen_ids, g, T, s, verbose, mem, method, min_score,
+    workspace, results, patient=-1, window_margin=None,
+):
+    """
+    Append the alignments of the encoded record s2 against the catalog
+    regimens `regimen_ids` to `results`, as rows of patient index `patient`.
+    With window_margin, every pair is aligned on its record windows
+    (see _window_block).
+    """
+    if window_margin is not None:
+        drugs = np.array(
+            [regimens.drug2idx.get(item[1], -1) for item in s2], dtype=np.int64
+        )
+        for j in regimen_ids:
+            starts, ends = regimens.windows(drugs, j, window_margin)
+            results.append(
+                _window_block(
+                    regimens.encoded[j], s2, starts, ends, g, T, s, verbose,
+                    mem, method, min_score, workspace,
+                ),
+                j,
+                patient,
+            )
+        return
+
+    for j in regimen_ids:
+        # Scoring re-orders the record in place, each regimen gets a copy
+        s2_copy = [x[:] for x in s2]
+        results.append(
+            _alignment_block(
+                regimens.encoded[j], s2_copy, g, T, s, verbose, mem, method,
+                min_score, workspace,
+            ),
+            j,
+            patient,
+        )
+
+
+def _align_patients_chunk(
+    patients,
+    regimens,
+    col_name_patient_id="person_id",
+    col_name_patient_record="seq",
+    g=0.4,
+    T=0.5,
+    s=None,
+    verbose=0,
+    mem=-1,
+    removeOverlap=1,
+    method="PropDiff",
+    min_score=None,
+    regimen_ids=None,
+    progress=True,
+    window_margin=None,
+):
+    """
+    Align every patient in `patients` against all eligible regimens of the
+    RegimenCatalog `regimens` (or against regimen_ids[i] for patient i),
+    on record windows with window_margin (see _window_block).
+
+    Returns the AlignmentResults columns of the chunk (patient indices
+    within the chunk), rows in patient then regimen order.
+    Errors are re-raised as RuntimeError naming the patient that caused them.
+    All pairs share one Workspace for their matrices.
+    """
+    patient_ids = patients[col_name_patient_id].to_numpy(dtype=object)
+    patient_records = patients[col_name_patient_record].to_numpy(dtype=object)
+    results = AlignmentResults()
+    workspace = Workspace()
+
+    for i in tqdm(
+        range(patients.shape[0]),
+        desc="Processing patients",
+        disable=not progress,
+    ):
+        try:
+            s2 = encode_py(patient_records[i])
+            _align_patient_batch(
+                s2,
+                regimens,
+                regimens.eligible(set(item[1] for item in s2))
+                if regimen_ids is None
+                else regimen_ids[i],
+                g,
+                T,
+                s,
+                verbose,
+                mem,
+                method,
+                min_score,
+                workspace,
+                results,
+                i,
+                window_margin,
+            )
+        except Exception as e:
+            raise RuntimeError(
+                f"Alignment failed for patient {patient_ids[i]}: "
+                f"{type(e).__name__}: {e}"
+            ) from e
+
+    return results
+
+
+def _score_threshold(min_score, min_adjusted_score):
+    """
+    Score cutoff of a run: rows need Score > min_score, and as
+    adjustedS = Score / totAlign <= Score, adjustedS > min_adjusted_score
+    needs Score > min_adjusted_score too. None if neither is set.
+    """
+    cutoffs = [x for x in (min_score, min_adjusted_score) if x is not None]
+    return max(cutoffs) if cutoffs else None
+
+
+def _bounded_regimens(regimens, s, s2, regimen_ids, min_score, min_adjusted_score):
+    """
+    The regimens of regimen_ids whose score bounds against the encoded
+    record s2 allow a row with Score > min_score and adjustedS >
+    min_adjusted_score.
+    """
+    drugs, counts = np.unique([item[1] for item in s2], return_counts=True)
+    # s[x][y]: similarity of regimen drug x to record drug y
+    sim = s.loc[drugs, regimens.vocabulary].to_numpy(dtype=np.float64).T
+    score, step = regimens.score_bounds(sim, counts, regimen_ids)
+
+    keep = score > min_score
+    if min_adjusted_score is not None:
+        keep &= step > min_adjusted_score
+    return regimen_ids[keep]
 
 
 def align_patients_regimens(
@@ -196,46 +491,296 @@ def align_patients_regimens(
     mem=-1,
     removeOverlap=1,
     method="PropDiff",
+    low_memory=False,
+    min_score=None,
+    workers=1,
+    cache=None,
+    min_adjusted_score=None,
+    window_margin=None,
 ):
-    dfs = []
+    """
+    Align all patient drug records against all regimens.
 
-    for i, row1 in tqdm(
-        patients.iterrows(), desc="Processing patients", total=patients.shape[0]
-    ):
-        s1 = encode_py(row1[col_name_patient_record])
-        s1_drugs = set(item[1] for item in s1)
-
-        for j, row2 in regimens.iterrows():
-            s2 = encode_py(row2[col_name_regimens])
-            s2_drugs = set(item[1] for item in s2)
-
-            # Condition: all drugs from regimen in patient record
-            if s2_drugs.issubset(s1_drugs):
-                # Avoid modifying original s1 within temporal_alignment
-                s1_copy = [x[:] for x in s1]
-
-                df = temporal_alignment(
-                    s2,
-                    s1_copy,
-                    g=g,
-                    T=T,
-                    s=s,
-                    verbose=verbose,
-                    mem=mem,
-                    removeOverlap=removeOverlap,
-                    method=method,
+    Patients with identical seq strings are aligned once and the rows are
+    repeated for each of them, in input order.
+
+    Parameters
+    ----------
+    patients : pandas.DataFrame or CohortStore
+        Patient table with an id and an encoded drug record column, or a
+        cohort store written from one.
+    regimens : pandas.DataFrame or RegimenCatalog
+        Regimen table, or a RegimenCatalog built once from it and reused
+        across calls.
+    s : pandas.DataFrame, optional
+        Similarity matrix labelled by drug name, by default None: the
+        default matrix is built once over all drugs of the run.
+    low_memory : bool, optional
+        Accepted for compatibility with the Cython backend, by default
+        False. The Python backend has no rolling-row scoring: it always
+        keeps the full H, TR and TC matrices of a pair, and only its
+        traceback matrix is small (int8, whatever this flag says).
+    min_score : float, optional
+        Drop alignments with Score <= min_score before their traceback, by
+        default None (keep all). They can never pass an adjustedS >
+        min_score filter (postprocessDF uses 0.501).
+    workers : int, optional
+        Number of worker processes, by default 1 (run in this process).
+        With workers > 1 the patients are split into chunks that are aligned
+        in a ProcessPoolExecutor; 0 or less uses all available cores.
+        Results are merged in input order.
+    cache : AlignmentCache or str, optional
+        Persistent cache (or the path of its SQLite file), by default None.
+        Only the (record, regimen) pairs not found in it are aligned; the
+        output is the same as without a cache.
+    min_adjusted_score : float, optional
+        Drop alignments with adjustedS <= min_adjusted_score, by default
+        None (keep all). As adjustedS <= Score, endpoints with Score below
+        the cutoff are not traced back. With min_score or
+        min_adjusted_score, pairs whose score bounds
+        (RegimenCatalog.score_bounds) cannot pass are not aligned at all
+        (for g >= 0 and T >= 0).
+    window_margin : int, optional
+        Windowed mode, by default None (align whole records). Each regimen
+        is only aligned inside the regions of the record where its drugs
+        occur (RegimenCatalog.windows), padded by window_margin record
+        entries. Only the DP is windowed: the endpoints of a pair are
+        selected over all its windows as over the whole record (mem=-1
+        counts the full record length), rows ending outside every window
+        are dropped. Rows keep the positions of the full record.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per alignment, with regimen and patient columns added.
+    """
+    if not isinstance(regimens, RegimenCatalog):
+        regimens = RegimenCatalog(
+            regimens,
+            col_name_regimens=col_name_regimens,
+            col_name_regName=col_name_regName,
+        )
+
+    # Identical records are aligned once, through their first patient. The
+    # Python kernels work on the seq strings: a CohortStore only decodes
+    # those of the unique records, and the ids and records of the output
+    if isinstance(patients, CohortStore):
+        patient_ids, patient_records = patients.columns()
+        codes, first = patients.unique_records()
+        unique_patients = pd.DataFrame(
+            {
+                col_name_patient_id: patients.patient_ids(first),
+                col_name_patient_record: patients.records(first),
+            }
+        )
+    else:
+        patient_ids = patients[col_name_patient_id].to_numpy(dtype=object)
+        patient_records = patients[col_name_patient_record].to_numpy(dtype=object)
+        codes, first = unique_records(patient_records)
+        unique_patients = patients.iloc[first]
+    results = AlignmentResults(regimens, patient_ids, patient_records)
+    unique_seqs = unique_patients[col_name_patient_record].to_numpy(dtype=object)
+
+    if isinstance(cache, str):
+        cache = AlignmentCache(cache)
+    if cache is not None:
+        params = AlignmentCache.params(
+            g, T, method, mem, min_score, s, min_adjusted_score, window_margin
+        )
+
+    # One similarity matrix for the whole run, shared by every pair
+    if s is None:
+        vocabulary = encode_bulk(unique_seqs, regimens.vocabulary)[3]
+        s = similarity_matrix(vocabulary)
+
+    # Endpoints with Score <= min_score are not traced back, and pairs whose
+    # score bounds rule out any row are not aligned
+    min_score = _score_threshold(min_score, min_adjusted_score)
+    prune = min_score is not None and g >= 0 and T >= 0
+
+    # Pairs to align: all eligible ones (within the bounds), or the misses
+    # of the cache
+    regimen_ids = None
+    if cache is not None or prune:
+        regimen_ids = []
+        for seq in unique_seqs:
+            s2 = encode_py(seq)
+            ids = regimens.eligible(set(item[1] for item in s2))
+            if prune:
+                ids = _bounded_regimens(
+                    regimens, s, s2, ids, min_score, min_adjusted_score
                 )
+            regimen_ids.append(ids)
+    if cache is not None:
+        regimen_ids, pending = cache.lookup(
+            unique_seqs, regimens.seqs, regimen_ids, params
+        )
+
+    if window_margin is not None:
+        window_margin = int(window_margin)
+
+    kwargs = dict(
+        col_name_patient_id=col_name_patient_id,
+        col_name_patient_record=col_name_patient_record,
+        g=g,
+        T=T,
+        s=s,
+        verbose=verbose,
+        mem=mem,
+        removeOverlap=removeOverlap,
+        method=method,
+        min_score=min_score,
+        window_margin=window_margin,
+    )
+
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = int(workers)
 
-                df["regName"] = row2[col_name_regName]
-                df["Regimen_full"] = row2[col_name_regimens]
-                df["personID"] = row1[col_name_patient_id]
-                df["DrugRecord_full"] = row1[col_name_patient_record]
-                dfs.append(df)
-    if not dfs:
+    n_unique = unique_patients.shape[0]
+    if workers == 1 or n_unique <= 1:
+        computed = _align_patients_chunk(
+            unique_patients, regimens, regimen_ids=regimen_ids, **kwargs
+        )
+    else:
+        # A few chunks per worker keeps the pool busy on uneven records
+        n_chunks = min(n_unique, workers * 4)
+        bounds = np.linspace(0, n_unique, n_chunks + 1).astype(int)
+
+        computed = AlignmentResults()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _align_patients_chunk,
+                    unique_patients.iloc[bounds[k] : bounds[k + 1]],
+                    regimens,
+                    regimen_ids=None
+                    if regimen_ids is None
+                    else regimen_ids[bounds[k] : bounds[k + 1]],
+                    progress=False,
+                    **kwargs,
+                )
+                for k in range(n_chunks)
+            ]
+            for k, future in enumerate(
+                tqdm(futures, desc="Processing patient chunks")
+            ):
+                computed.extend(future.result(), patient_offset=bounds[k])
+
+    if min_adjusted_score is not None:
+        n = computed.n_rows
+        computed.keep(computed.scores[:n, 1] > min_adjusted_score)
+
+    if cache is not None:
+        merged = AlignmentResults()
+        cache.merge(merged, pending, computed)
+        computed = merged
+
+    # Rows of every unique record, for each patient sharing it
+    results.extend_shared(computed, codes)
+
+    if not len(results):
         return pd.DataFrame()  # Return empty DataFrame if no alignments found
 
-    result = pd.concat(dfs, ignore_index=True)
-    return result
+    return results.to_frame()
+
+
+def iter_alignments(
+    patients,
+    regimens,
+    batch_size=1000,
+    col_name_patient_id="person_id",
+    col_name_patient_record="seq",
+    col_name_regimens="shortString",
+    col_name_regName="regName",
+    g=0.4,
+    T=0.5,
+    s=None,
+    verbose=0,
+    mem=-1,
+    removeOverlap=1,
+    method="PropDiff",
+    low_memory=False,
+    min_score=None,
+    workers=1,
+    cache=None,
+    min_adjusted_score=None,
+    window_margin=None,
+):
+    """
+    Streaming align_patients_regimens: yield one result chunk per batch of
+    patients, as soon as the batch is aligned.
+
+    The regimen catalog is built once and shared by all batches, so memory
+    is bounded by the largest batch instead of the whole cohort. With
+    workers > 1 every batch is split over the worker processes.
+
+    Parameters
+    ----------
+    patients : pandas.DataFrame, CohortStore or iterable of pandas.DataFrame
+        Patient table or cohort store, cut into batches of batch_size
+        patients, or an iterable of patient tables (e.g.
+        pd.read_csv(..., chunksize=n)), each one taken as a batch.
+    batch_size : int, optional
+        Patients per batch, by default 1000.
+    Other parameters :
+        As in align_patients_regimens.
+
+    Yields
+    ------
+    pandas.DataFrame
+        Alignment rows of a batch. Batches without alignments are skipped;
+        the index continues across chunks, so pd.concat of all chunks
+        equals the align_patients_regimens result.
+
+    Examples
+    --------
+    >>> write_alignments(iter_alignments(patients, regimens), "out.csv")
+    """
+    if not isinstance(regimens, RegimenCatalog):
+        regimens = RegimenCatalog(
+            regimens,
+            col_name_regimens=col_name_regimens,
+            col_name_regName=col_name_regName,
+        )
+    if isinstance(cache, str):
+        cache = AlignmentCache(cache)
+
+    if isinstance(patients, (pd.DataFrame, CohortStore)):
+        batch_size = max(int(batch_size), 1)
+        rows = patients.iloc if isinstance(patients, pd.DataFrame) else patients
+        batches = (
+            rows[k : k + batch_size] for k in range(0, len(patients), batch_size)
+        )
+    else:
+        batches = patients
+
+    n_rows = 0
+    for batch in tqdm(batches, desc="Processing patient batches"):
+        df = align_patients_regimens(
+            batch,
+            regimens,
+            col_name_patient_id=col_name_patient_id,
+            col_name_patient_record=col_name_patient_record,
+            g=g,
+            T=T,
+            s=s,
+            verbose=verbose,
+            mem=mem,
+            removeOverlap=removeOverlap,
+            method=method,
+            low_memory=low_memory,
+            min_score=min_score,
+            workers=workers,
+            cache=cache,
+            min_adjusted_score=min_adjusted_score,
+            window_margin=window_margin,
+        )
+        if df.shape[0] == 0:
+            continue
+        df.index = pd.RangeIndex(n_rows, n_rows + df.shape[0])
+        n_rows += df.shape[0]
+        yield df
 
 
 def main():
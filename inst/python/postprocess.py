@@ -0,0 +1,564 @@
+import re
+
+import numpy as np
+import pandas as pd
+from encoding import encode_bulk
+
+def _group_starts(keys):
+    """
+    First position of every run of equal values in a sorted key array.
+    """
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def _overlapping_pairs(patient, start, end):
+    """
+    All (x, y) row pairs with y < x of the same patient whose intervals
+    overlap (end[y] >= start[x]), in x then y order.
+
+    Rows are sorted by (patient, start), so the later rows overlapping row
+    y are the run y + 1 .. hi[y] - 1, hi[y] being the first row of another
+    patient or starting after end[y]. A binary search of every end among
+    the starts finds it, so only the real overlaps are generated.
+
+    Parameters
+    ----------
+    patient : numpy.ndarray
+        Patient code of every row, ascending.
+    start, end : numpy.ndarray
+        Interval bounds of every row, start ascending within a patient.
+
+    Returns
+    -------
+    x, y : numpy.ndarray
+        int64 row positions.
+    """
+    n = len(patient)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # (patient, bound) as a single sortable int64 key
+    values, codes = np.unique(np.r_[start, end], return_inverse=True)
+    key = patient.astype(np.int64) * (len(values) + 1)
+    hi = np.searchsorted(key + codes[:n], key + codes[n:], side="right")
+
+    counts = np.maximum(hi - np.arange(n) - 1, 0)
+    y = np.repeat(np.arange(n), counts)
+    offsets = np.cumsum(counts) - counts
+    x = y + 1 + np.arange(len(y)) - np.repeat(offsets, counts)
+
+    order = np.lexsort((y, x))
+    return x[order], y[order]
+
+
+def unique_aligned_drugs(regimen):
+    """
+    Number of distinct drugs in an aligned regimen string (gaps excluded).
+
+    Examples
+    --------
+    >>> unique_aligned_drugs("0.a;__;7.b;0.a")
+    2
+    """
+    drugs = re.split(r";|~", re.sub(r"[0-9]*\.", "", regimen))
+    return len(set(drugs) - {"__"})
+
+
+def add_cumulative_times(df):
+    """
+    Map the drug record positions of alignment rows to cumulative days.
+
+    Every record is taken from the DrugRecord_full of the first row of its
+    patient; its time gaps are summed from 0 (the first gap is ignored).
+    drugRec_Start and drugRec_End are clamped to the record, and t_start
+    and t_end are the cumulative days at these positions.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Alignment rows with personID, DrugRecord_full, drugRec_Start and
+        drugRec_End, rows grouped by patient.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        A copy with clamped positions and t_start, t_end columns.
+    end_of_data : numpy.ndarray
+        Last cumulative day of every patient, in order of appearance.
+    """
+    df = df.copy()
+    patient = pd.factorize(df["personID"])[0]
+    starts = _group_starts(patient)
+
+    records = df["DrugRecord_full"].to_numpy(dtype=object)[starts]
+    offsets, times, _, _ = encode_bulk(records)
+    lengths = np.diff(offsets)
+
+    # Cumulative days of every record, starting at 0
+    times = times.copy()
+    times[offsets[:-1][lengths > 0]] = 0
+    cumulative = np.cumsum(times)
+    cumulative -= np.repeat(cumulative[offsets[:-1]] - times[offsets[:-1]], lengths)
+    end_of_data = np.maximum.reduceat(cumulative, offsets[:-1]) if len(times) else times
+
+    base = offsets[patient]
+    n = lengths[patient]
+    start = np.maximum(df["drugRec_Start"].to_numpy(), 1)
+    end = np.minimum(df["drugRec_End"].to_numpy(), n)
+    df["drugRec_Start"] = start.astype(df["drugRec_Start"].dtype)
+    df["drugRec_End"] = end.astype(df["drugRec_End"].dtype)
+    df["t_start"] = cumulative[base + start - 1]
+    df["t_end"] = cumulative[base + end - 1]
+
+    return df, end_of_data
+
+
+def _remove_lower_scored(patient, rec_start, rec_end, name, score):
+    """
+    Stage 1 of remove_overlaps on rows sorted by (patient, drugRec_Start,
+    drugRec_End): rows of different regimens overlapping on the drug record
+    are compared pairwise, the lower adjustedS is removed (ties keep both).
+
+    Pairs are taken in (row, earlier row) order, skipping removed rows, as
+    in the sequential R loop. A row x only meets earlier rows, so all rows
+    of the same rank within their patient are resolved at once: x removes
+    the earlier rows it beats up to the first one that beats it, which
+    removes x.
+    """
+    n = len(patient)
+    removed = np.zeros(n, dtype=bool)
+    x, y = _overlapping_pairs(patient, rec_start, rec_end)
+    keep = name[y] != name[x]
+    x, y = x[keep], y[keep]
+    if len(x) == 0:
+        return removed
+
+    rank = np.arange(n) - np.repeat(
+        _group_starts(patient), np.diff(np.r_[_group_starts(patient), n])
+    )
+    order = np.argsort(rank[x], kind="stable")
+    x, y = x[order], y[order]
+    steps = _group_starts(rank[x])
+
+    for a, b in zip(steps, np.r_[steps[1:], len(x)]):
+        xs, ys = x[a:b], y[a:b]
+        active = ~removed[ys]
+        sx, sy = score[xs], score[ys]
+
+        # First earlier row beating x, per x
+        rows = _group_starts(xs)
+        counts = np.diff(np.r_[rows, len(xs)])
+        pos = np.arange(len(xs)) - np.repeat(rows, counts)
+        blocked = np.where(active & (sy > sx), pos, len(xs))
+        first = np.minimum.reduceat(blocked, rows)
+
+        beaten = active & (sy < sx) & (pos < np.repeat(first, counts))
+        removed[ys[beaten]] = True
+        removed[xs[rows][first < len(xs)]] = True
+
+    return removed
+
+
+def _remove_fewer_components(patient, t_start, t_end, comp_no):
+    """
+    Stage 2 of remove_overlaps on rows sorted by (patient, t_start, t_end):
+    a row overlapping (in days) a row with more distinct drugs is removed.
+    """
+    removed = np.zeros(len(patient), dtype=bool)
+    x, y = _overlapping_pairs(patient, t_start, t_end)
+    keep = comp_no[y] != comp_no[x]
+    x, y = x[keep], y[keep]
+    removed[np.where(comp_no[y] < comp_no[x], y, x)] = True
+    return removed
+
+
+def _remove_sub_regimens(patient, t_start, t_end, name, tot_align, score):
+    """
+    Stage 3 of remove_overlaps on rows sorted by (patient, t_start, t_end):
+    of two rows of the same regimen and totAlign overlapping by more than
+    one day boundary, the one with the lower adjustedS is removed.
+    """
+    removed = np.zeros(len(patient), dtype=bool)
+    x, y = _overlapping_pairs(patient, t_start, t_end)
+    keep = (
+        (t_start[y] != t_end[x])
+        & (t_end[y] != t_start[x])
+        & (name[y] == name[x])
+        & (tot_align[y] == tot_align[x])
+        & (score[y] != score[x])
+    )
+    x, y = x[keep], y[keep]
+    removed[np.where(score[y] < score[x], y, x)] = True
+    return removed
+
+
+def remove_overlaps(df):
+    """
+    Remove overlapping regimens from alignment rows of many patients.
+
+    Vectorised equivalent of removeOverlaps (R/postprocessAlign.R), run on
+    all patients at once:
+
+    1. Rows of different regimens overlapping on the drug record
+       (drugRec_Start, drugRec_End): the lower adjustedS is removed, taking
+       pairs in drug record order and skipping removed rows.
+    2. Rows overlapping in days (t_start, t_end): the one with fewer
+       distinct aligned drugs (compNo) is removed.
+    3. Rows of the same regimen and totAlign overlapping in days by more
+       than a boundary: the lower adjustedS is removed.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Alignment rows with personID, regName, Regimen, drugRec_Start,
+        drugRec_End, t_start, t_end, adjustedS and totAlign (see
+        add_cumulative_times), rows grouped by patient.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The remaining rows with a compNo column, grouped by patient in
+        order of appearance and sorted by t_start, t_end.
+    """
+    df = df.reset_index(drop=True)
+    patient = pd.factorize(df["personID"])[0]
+    name = pd.factorize(df["regName"])[0]
+    regimens, regimen_codes = pd.factorize(df["Regimen"])[::-1]
+    comp_no = np.array([unique_aligned_drugs(r) for r in regimens], dtype=np.int64)
+    comp_no = comp_no[regimen_codes]
+    rec_start = df["drugRec_Start"].to_numpy()
+    rec_end = df["drugRec_End"].to_numpy()
+    t_start = df["t_start"].to_numpy(dtype=np.float64)
+    t_end = df["t_end"].to_numpy(dtype=np.float64)
+    score = df["adjustedS"].to_numpy(dtype=np.float64)
+    tot_align = df["totAlign"].to_numpy()
+
+    rows = np.lexsort((rec_end, rec_start, patient))
+    rows = rows[
+        ~_remove_lower_scored(
+            patient[rows], rec_start[rows], rec_end[rows], name[rows], score[rows]
+        )
+    ]
+
+    rows = rows[np.lexsort((t_end[rows], t_start[rows], patient[rows]))]
+    rows = rows[
+        ~_remove_fewer_components(
+            patient[rows], t_start[rows], t_end[rows], comp_no[rows]
+        )
+    ]
+    rows = rows[
+        ~_remove_sub_regimens(
+            patient[rows],
+            t_start[rows],
+            t_end[rows],
+            name[rows],
+            tot_align[rows],
+            score[rows],
+        )
+    ]
+
+    out = df.iloc[rows].reset_index(drop=True)
+    out["compNo"] = comp_no[rows]
+    return out
+
+
+def combine_overlaps(df, regimen_combine=28):
+    """
+    Merge consecutive rows of the same regimen less than regimen_combine
+    days apart, for many patients at once (combineOverlaps, R/postprocessAlign.R).
+
+    Rows of a patient are sorted by regName, t_start and t_end; a run of
+    the same regimen continues while a row starts less than regimen_combine
+    days after the end of the previous one.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Rows with personID, regName, drugRec_Start, drugRec_End, t_start,
+        t_end, adjustedS, Score and totAlign, rows grouped by patient.
+    regimen_combine : float, optional
+        Allowed days between two rows of the same regimen, by default 28.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per run: personID, regName, drugRec_Start, drugRec_End,
+        t_start, t_end, adjustedS and Score (means), totAlign (sum) and
+        component, per patient in regName then t_start order.
+    """
+    patient = pd.factorize(df["personID"])[0]
+    name = pd.factorize(df["regName"], sort=True)[0]
+    t_start = df["t_start"].to_numpy(dtype=np.float64)
+    t_end = df["t_end"].to_numpy(dtype=np.float64)
+    order = np.lexsort((t_end, t_start, name, patient))
+
+    patient, name, t_start, t_end = (
+        patient[order],
+        name[order],
+        t_start[order],
+        t_end[order],
+    )
+    new_run = np.r_[
+        True,
+        (patient[1:] != patient[:-1])
+        | (name[1:] != name[:-1])
+        | ((t_start[1:] - t_end[:-1]) >= regimen_combine),
+    ]
+    runs = np.flatnonzero(new_run)
+    counts = np.diff(np.r_[runs, len(order)])
+
+    def column(col):
+        return df[col].to_numpy()[order]
+
+    first = order[runs]
+    reg_name = df["regName"].to_numpy(dtype=object)[first]
+    return pd.DataFrame(
+        {
+            "personID": df["personID"].to_numpy()[first],
+            "regName": reg_name,
+            "drugRec_Start": np.minimum.reduceat(column("drugRec_Start"), runs),
+            "drugRec_End": np.maximum.reduceat(column("drugRec_End"), runs),
+            "t_start": np.minimum.reduceat(t_start, runs),
+            "t_end": np.maximum.reduceat(t_end, runs),
+            "adjustedS": np.add.reduceat(column("adjustedS").astype(np.float64), runs)
+            / counts,
+            "Score": np.add.reduceat(column("Score").astype(np.float64), runs) / counts,
+            "totAlign": np.add.reduceat(column("totAlign"), runs),
+            "component": reg_name,
+        }
+    )
+
+
+def process_alignments(raw, regimen_combine=28, regimens=None):
+    """
+    Post-process raw alignments of all patients at once.
+
+    Vectorised equivalent of processAlignments (R/main.R), which runs
+    postprocessDF patient by patient: rows with totAlign > 1 and
+    adjustedS > 0.501 are kept, mapped to cumulative days
+    (add_cumulative_times), cleared of overlaps (remove_overlaps) and merged
+    into runs (combine_overlaps).
+
+    Parameters
+    ----------
+    raw : pandas.DataFrame
+        Output of align_patients_regimens (e.g. via generateRawAlignments).
+    regimen_combine : float, optional
+        Allowed days between two rows of the same regimen before they are
+        merged, by default 28.
+    regimens : pandas.DataFrame, optional
+        Regimen table with regName and cycleLength, by default None. When
+        given, the cycleLength of every component is added, keeping the
+        longest cycle when a regimen name has several.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per regimen run: personID, regName, drugRec_Start,
+        drugRec_End, t_start, t_end, adjustedS, Score, totAlign, component,
+        timeToNextRegimen (NaN for the last run of a patient), timeToEOD
+        (days from the end of the last run to the end of the record, 0 for
+        the other runs) and regLength, per patient in order of appearance
+        and by t_start.
+    """
+    if raw.shape[0] == 0:
+        return pd.DataFrame()
+
+    df = raw.copy()
+    for col in ("Score", "adjustedS", "drugRec_Start", "drugRec_End", "totAlign"):
+        df[col] = pd.to_numeric(df[col])
+    df = df[(df["totAlign"] > 1) & (df["adjustedS"] > 0.501)]
+    if df.shape[0] == 0:
+        return pd.DataFrame()
+
+    # Rows grouped by patient, in order of appearance
+    patient = pd.factorize(df["personID"])[0]
+    df = df.iloc[np.argsort(patient, kind="stable")]
+
+    df, end_of_data = add_cumulative_times(df)
+    df = remove_overlaps(df)
+    df = combine_overlaps(df, regimen_combine)
+
+    # Runs of a patient by t_start
+    patient = pd.factorize(df["personID"])[0]
+    df = df.iloc[np.lexsort((df["t_start"].to_numpy(), patient))].reset_index(drop=True)
+    patient = pd.factorize(df["personID"])[0]
+
+    t_start = df["t_start"].to_numpy()
+    t_end = df["t_end"].to_numpy()
+    last = np.r_[patient[1:] != patient[:-1], True]
+    next_start = np.r_[t_start[1:], np.nan]
+    df["timeToNextRegimen"] = np.where(last, np.nan, np.maximum(0, next_start - t_end))
+    df["timeToEOD"] = np.where(last, end_of_data[patient] - t_end, 0.0)
+    df["regLength"] = t_end - t_start + 1
+
+    if regimens is not None:
+        cycles = regimens[["regName", "cycleLength"]].rename(
+            columns={"regName": "component"}
+        )
+        df = df.merge(cycles, on="component").sort_values("component", kind="stable")
+        df = df.sort_values("cycleLength", ascending=False, kind="stable")
+        df = df[~df.drop(columns="cycleLength").duplicated()].reset_index(drop=True)
+        df = df[["component"] + [c for c in df.columns if c != "component"]]
+
+    return df
+
+
+def calculate_eras(processed, discontinuation_time=120):
+    """
+    Merge processed regimens into treatment eras and flag the treatment
+    lines, for all patients at once (calculateEras, R/main.R).
+
+    Rows of a patient are sorted by t_start and a row starting before the
+    end of the previous row is dropped. Consecutive rows of the same
+    component less than discontinuation_time days apart form one era.
+
+    Parameters
+    ----------
+    processed : pandas.DataFrame
+        Output of process_alignments (personID, component, t_start, t_end,
+        adjustedS and timeToEOD).
+    discontinuation_time : float, optional
+        Days without the regimen after which it is discontinued, by
+        default 120.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per era: component, personID, adjustedS (mean weighted by
+        t_end - t_start), t_start, t_end, timeToEOD (min), regLength
+        (t_end - t_start), timeToNextRegimen (to the next era of the
+        patient, 0 if negative, NaN for the last era) and the First_Line,
+        Second_Line and Other flags, per patient in order of appearance.
+    """
+    columns = [
+        "component",
+        "personID",
+        "adjustedS",
+        "t_start",
+        "t_end",
+        "timeToEOD",
+        "regLength",
+        "timeToNextRegimen",
+        "First_Line",
+        "Second_Line",
+        "Other",
+    ]
+    if processed.shape[0] == 0:
+        return pd.DataFrame(columns=columns)
+
+    patient = pd.factorize(processed["personID"])[0]
+    t_start = processed["t_start"].to_numpy(dtype=np.float64)
+    order = np.lexsort((t_start, patient))
+    df = processed.iloc[order]
+    patient, t_start = patient[order], t_start[order]
+    t_end = df["t_end"].to_numpy(dtype=np.float64)
+
+    # Drop rows starting before the end of the previous (sorted) row
+    new_patient = np.r_[True, patient[1:] != patient[:-1]]
+    keep = new_patient | np.r_[True, t_start[1:] >= t_end[:-1]]
+    df = df[keep]
+    patient, t_start, t_end = patient[keep], t_start[keep], t_end[keep]
+
+    # A new era unless the same component restarts within the time limit
+    component = pd.factorize(df["component"])[0]
+    new_patient = np.r_[True, patient[1:] != patient[:-1]]
+    new_era = new_patient | np.r_[
+        True,
+        ((t_start[1:] - t_end[:-1]) >= discontinuation_time)
+        | (component[1:] != component[:-1]),
+    ]
+    eras = np.flatnonzero(new_era)
+    era = np.cumsum(new_era) - 1
+
+    # Mean score weighted by length (NaN for an era of zero length)
+    length = t_end - t_start
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weighted = (
+            df["adjustedS"].to_numpy(dtype=np.float64)
+            * length
+            / np.add.reduceat(length, eras)[era]
+        )
+    adjusted = np.add.reduceat(weighted, eras)
+
+    start = np.minimum.reduceat(t_start, eras)
+    end = np.maximum.reduceat(t_end, eras)
+    patient = patient[eras]
+    last = np.r_[patient[1:] != patient[:-1], True]
+    firsts = _group_starts(patient)
+    line = np.arange(len(eras)) - np.repeat(firsts, np.diff(np.r_[firsts, len(eras)]))
+    next_start = np.r_[start[1:], np.nan]
+
+    return pd.DataFrame(
+        {
+            "component": df["component"].to_numpy()[eras],
+            "personID": df["personID"].to_numpy()[eras],
+            "adjustedS": adjusted,
+            "t_start": start,
+            "t_end": end,
+            "timeToEOD": np.minimum.reduceat(
+                df["timeToEOD"].to_numpy(dtype=np.float64), eras
+            ),
+            "regLength": end - start,
+            "timeToNextRegimen": np.where(last, np.nan, np.maximum(0, next_start - end)),
+            "First_Line": (line == 0).astype(np.int64),
+            "Second_Line": (line == 1).astype(np.int64),
+            "Other": (line > 1).astype(np.int64),
+        },
+        columns=columns,
+    )
+
+
+def _value_range(low, high):
+    """
+    "(low-high)" labels, numbers printed as R does (15 significant digits).
+    """
+    return [f"({a:.15g}-{b:.15g})" for a, b in zip(low, high)]
+
+
+def regimen_stats(eras):
+    """
+    Summary statistics per regimen over treatment eras
+    (generateRegimenStats, R/main.R).
+
+    Parameters
+    ----------
+    eras : pandas.DataFrame
+        Output of calculate_eras.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per regimen (sorted by name): regName, mean, median and
+        range of the score and of the length of treatment
+        (t_end - t_start + 1), likelihood of the first, second and other
+        eras, count and frequency.
+    """
+    grouped = (
+        eras[["component", "adjustedS", "First_Line", "Second_Line", "Other"]]
+        .assign(t_total=eras["t_end"] - eras["t_start"] + 1)
+        .groupby("component", sort=True)
+    )
+    score = grouped["adjustedS"].agg(["mean", "median", "min", "max"])
+    times = grouped["t_total"].agg(["mean", "median", "min", "max"])
+    lines = grouped[["First_Line", "Second_Line", "Other"]].mean()
+    count = grouped.size()
+
+    return pd.DataFrame(
+        {
+            "regName": score.index.to_numpy(dtype=object),
+            "Mean Score": score["mean"].to_numpy(),
+            "Median Score": score["median"].to_numpy(),
+            "Score Range": _value_range(score["min"], score["max"]),
+            "Mean Length of Treatment": times["mean"].to_numpy(),
+            "Median Length of Treatment": times["median"].to_numpy(),
+            "Length of Treatment Range": _value_range(times["min"], times["max"]),
+            "First Era Likelihood": lines["First_Line"].to_numpy(),
+            "Second Era Likelihood": lines["Second_Line"].to_numpy(),
+            "Other Era Likelihood": lines["Other"].to_numpy(),
+            "Count": count.to_numpy(),
+            "Frequency": count.to_numpy() / count.sum(),
+        }
+    )
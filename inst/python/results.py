@@ -0,0 +1,256 @@
+import numpy as np
+import pandas as pd
+
+ALIGNMENT_COLUMNS = [
+    "Regimen",
+    "DrugRecord",
+    "Score",
+    "adjustedS",
+    "regimen_Start",
+    "regimen_End",
+    "drugRec_Start",
+    "drugRec_End",
+    "Aligned_Seq_len",
+    "totAlign",
+]
+
+
+class AlignmentResults:
+    """
+    Columnar accumulator of alignment rows.
+
+    Alignment blocks are appended into growable typed columns
+    - seqs : object (n, 2), Regimen and DrugRecord strings
+    - scores : float64 (n, 2), Score and adjustedS
+    - pos : int32 (n, 6), regimen_Start, regimen_End, drugRec_Start,
+      drugRec_End, Aligned_Seq_len and totAlign
+    - regimen, patient : int32 catalog and patient indices of every row
+
+    and a single DataFrame is built at the end by to_frame. The regimen and
+    patient string columns are only looked up from the indices then.
+
+    Parameters
+    ----------
+    catalog : RegimenCatalog, optional
+        Source of regName and Regimen_full, by default None (no columns).
+    patient_ids : numpy.ndarray, optional
+        Source of personID, by default None (no patient columns). Any
+        column indexable by an int array works, e.g. the lazy columns of
+        CohortStore.columns, which only decode the rows of the output.
+    patient_records : numpy.ndarray, optional
+        Source of DrugRecord_full, by default None.
+    capacity : int, optional
+        Initial number of rows, by default 1024. Columns double when full.
+    """
+
+    def __init__(
+        self, catalog=None, patient_ids=None, patient_records=None, capacity=1024
+    ):
+        self.catalog = catalog
+        self.patient_ids = patient_ids
+        self.patient_records = patient_records
+        self.n_rows = 0
+        self.seqs = np.empty((capacity, 2), dtype=object)
+        self.scores = np.empty((capacity, 2), dtype=np.float64)
+        self.pos = np.empty((capacity, 6), dtype=np.int32)
+        self.regimen = np.empty(capacity, dtype=np.int32)
+        self.patient = np.empty(capacity, dtype=np.int32)
+
+    def __len__(self):
+        return self.n_rows
+
+    def _reserve(self, n):
+        """
+        Grow the columns (doubling) to hold n more rows.
+        """
+        cap = self.regimen.shape[0]
+        if self.n_rows + n <= cap:
+            return
+        cap = max(self.n_rows + n, 2 * cap)
+        for name in ("seqs", "scores", "pos", "regimen", "patient"):
+            old = getattr(self, name)
+            new = np.empty((cap,) + old.shape[1:], dtype=old.dtype)
+            new[: self.n_rows] = old[: self.n_rows]
+            setattr(self, name, new)
+
+    def append(self, block, regimen=-1, patient=-1):
+        """
+        Append an alignment block.
+
+        Parameters
+        ----------
+        block : tuple
+            (seqs, scores, pos) arrays, as returned by _alignment_block.
+        regimen : int or numpy.ndarray, optional
+            Catalog index of the rows, by default -1.
+        patient : int or numpy.ndarray, optional
+            Patient index of the rows, by default -1.
+        """
+        seqs, scores, pos = block
+        n = seqs.shape[0]
+        if n == 0:
+            return
+        self._reserve(n)
+        a = self.n_rows
+        b = a + n
+        self.seqs[a:b] = seqs
+        self.scores[a:b] = scores
+        self.pos[a:b] = pos
+        self.regimen[a:b] = regimen
+        self.patient[a:b] = patient
+        self.n_rows = b
+
+    def extend(self, other, patient_offset=0):
+        """
+        Append all rows of another AlignmentResults.
+
+        Parameters
+        ----------
+        other : AlignmentResults
+            Rows to append (e.g. of a chunk of patients).
+        patient_offset : int, optional
+            Added to the patient indices of other, by default 0.
+        """
+        n = other.n_rows
+        self.append(
+            (other.seqs[:n], other.scores[:n], other.pos[:n]),
+            other.regimen[:n],
+            other.patient[:n] + patient_offset,
+        )
+
+    def keep(self, mask):
+        """
+        Keep only the rows where mask is True, in order.
+
+        Parameters
+        ----------
+        mask : numpy.ndarray
+            bool (n_rows,) selection.
+        """
+        n = self.n_rows
+        k = int(np.count_nonzero(mask))
+        for name in ("seqs", "scores", "pos", "regimen", "patient"):
+            col = getattr(self, name)
+            col[:k] = col[:n][mask]
+        self.n_rows = k
+
+    def extend_shared(self, other, codes):
+        """
+        Append the rows of records aligned once to every patient sharing
+        them.
+
+        Parameters
+        ----------
+        other : AlignmentResults
+            Rows of the unique records, whose patient indices are unique
+            record indices in increasing order.
+        codes : numpy.ndarray
+            Unique record index of every patient.
+        """
+        n = other.n_rows
+        if n == 0 or len(codes) == 0:
+            return
+        counts = np.bincount(other.patient[:n], minlength=int(codes.max()) + 1)
+        starts = np.cumsum(counts) - counts
+        lengths = counts[codes]
+
+        # Row k of patient i is row starts[codes[i]] + k of other
+        ends = np.cumsum(lengths)
+        rows = np.arange(ends[-1]) + np.repeat(starts[codes] - (ends - lengths), lengths)
+        self.append(
+            (other.seqs[rows], other.scores[rows], other.pos[rows]),
+            other.regimen[rows],
+            np.repeat(np.arange(len(codes)), lengths),
+        )
+
+    def to_frame(self):
+        """
+        Build the result DataFrame.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Alignment columns, then regName and Regimen_full (with a
+            catalog) and personID and DrugRecord_full (with patient ids).
+        """
+        n = self.n_rows
+        columns = (
+            [self.seqs[:n, k] for k in range(2)]
+            + [self.scores[:n, k] for k in range(2)]
+            + [self.pos[:n, k] for k in range(6)]
+        )
+        df = pd.DataFrame(dict(zip(ALIGNMENT_COLUMNS, columns)))
+        if self.catalog is not None:
+            df["regName"] = self.catalog.names[self.regimen[:n]]
+            df["Regimen_full"] = self.catalog.seqs[self.regimen[:n]]
+        if self.patient_ids is not None:
+            df["personID"] = self.patient_ids[self.patient[:n]]
+            df["DrugRecord_full"] = self.patient_records[self.patient[:n]]
+        return df
+
+    def __repr__(self):
+        return f"AlignmentResults({self.n_rows} rows)"
+
+
+def write_alignments(chunks, path, file_format=None):
+    """
+    Append result chunks to a CSV or Parquet file.
+
+    Only one chunk is held in memory at a time, so a cohort streamed with
+    iter_alignments is written in constant memory. An existing file is
+    always replaced: without any chunk, the CSV is empty and the Parquet
+    file has no columns.
+
+    Parameters
+    ----------
+    chunks : iterable of pandas.DataFrame
+        Result chunks, e.g. from iter_alignments.
+    path : str
+        Output file.
+    file_format : str, optional
+        "csv" or "parquet", by default from the path suffix (.parquet or
+        .pq, anything else is CSV). Parquet needs pyarrow.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    if file_format is None:
+        file_format = "parquet" if str(path).endswith((".parquet", ".pq")) else "csv"
+    if file_format not in ("csv", "parquet"):
+        raise ValueError(f"Unknown file_format '{file_format}', use 'csv' or 'parquet'")
+
+    if file_format == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("write_alignments to parquet requires pyarrow") from e
+
+    n_rows = 0
+    if file_format == "csv":
+        # Truncated up front, so no chunks still replace an earlier result
+        with open(path, "w", newline="") as f:
+            header = True
+            for df in chunks:
+                df.to_csv(f, header=header, index=False)
+                header = False
+                n_rows += df.shape[0]
+        return n_rows
+
+    writer = None
+    try:
+        for df in chunks:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            n_rows += df.shape[0]
+        if writer is None:
+            pq.write_table(pa.table({}), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return n_rows
@@ -164,40 +164,42 @@ def TSW_scoreMat(s1, s1_len, s2, s2_len, g, T, H, TR, TC, traceMat, s, method):
 
 
 def find_best_score(H, s1_len, s2_len, mem, verbose):
-    mem_score = H[:, s1_len]
-    mem_score = mem_score.tolist()
-    # mem_index = [(i, s1_len) for i in range(s2_len + 1)]
+    return find_best_score_col(H[:, s1_len], s1_len, s2_len, mem, verbose)
 
-    mem_index = np.empty((s2_len + 1, 2), dtype=np.int32)
-    mem_index[:, 0] = np.arange(s2_len + 1)
-    mem_index[:, 1] = s1_len  # broadcast scalar
 
-    mem_array = np.asarray(list(zip(mem_score, mem_index)), dtype=object)
-    mem_array = mem_array[mem_array[:, 0].argsort()]
+def find_best_score_col(H_col, s1_len, s2_len, mem, verbose):
+    """
+    find_best_score on the last column of H only.
+    """
+    mem_score = np.array(H_col, dtype=float)
+    n = s2_len + 1
+
+    # Mem = 0 : Exactly 1 alignment
+    if mem == 0:
+        return np.empty((0, 2), dtype=np.int32), np.empty(0, dtype=float)
 
-    # Select from mem according to the requested number of alignments
     # Mem = -1 : As many non-overlapping alignments as possible
     if mem == -1:
         mem = max(1, math.floor(s2_len / s1_len))
-        mem_min = mem_array[-mem][0]
-        mem_array = mem_array[mem_min * 0.9 <= mem_array[:, 0]]  #
-        mem_score, mem_index = mem_array[:, 0], mem_array[:, 1]
         if verbose == 2:
             print("Calculated mem: ")
             print(mem)
 
-    # Mem = 0 : Exactly 1 alignment
-    elif mem == 0:
-        mem_index = []
-        mem_score = []
+    # Mem >= 1 : Return N alignments and all alignments within 90% of the
+    # Nth best score. Partial selection finds the Nth best in O(n), only the
+    # band around it gets sorted.
+    if mem > n:
+        raise ValueError(f"mem={mem} is larger than the number of scores ({n})")
+    k = n - mem
+    mem_min = np.partition(mem_score, k)[k]
+    rows = np.flatnonzero(mem_min * 0.9 <= mem_score)
 
-    # Mem >= 1 : Return N alignments and all alignments with the same score as the Nth alignment
-    else:
-        mem_min = mem_array[-mem][0]
-        mem_array = mem_array[mem_min * 0.9 <= mem_array[:, 0]]
-        mem_score, mem_index = mem_array[:, 0], mem_array[:, 1]
+    # Highest score first, ties by highest row (a stable sort, reversed)
+    order = np.lexsort((rows, mem_score[rows]))[::-1]
+    rows = rows[order]
 
-    mem_score = mem_score[::-1]
-    mem_index = mem_index[::-1]
+    mem_index = np.empty((len(rows), 2), dtype=np.int32)
+    mem_index[:, 0] = rows
+    mem_index[:, 1] = s1_len
 
-    return mem_index, mem_score
+    return mem_index, mem_score[rows]
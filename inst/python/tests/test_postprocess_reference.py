@@ -0,0 +1,218 @@
+"""
+Reference test of the vectorised post-processing against per-patient ports
+of the R code (postprocessDF in R/postprocessAlign.R, calculateEras in
+R/main.R), on a seeded generate_cohort run.
+
+Run from the repository root with
+
+    python -m pytest inst/python/tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "cython", "benchmark"))
+
+from encoding import encode_py  # noqa: E402
+from main import align_patients_regimens  # noqa: E402
+from postprocess import (  # noqa: E402
+    calculate_eras,
+    process_alignments,
+    unique_aligned_drugs,
+)
+from sampling import generate_cohort  # noqa: E402
+
+
+def _overlap(a_start, a_end, b_start, b_end):
+    # foverlaps type "any" on closed intervals
+    return a_start <= b_end and b_start <= a_end
+
+
+def postprocess_patient(output, regimen_combine=28):
+    """
+    Port of postprocessDF for the rows of one patient, loop for loop.
+    """
+    df = output[(output["totAlign"] > 1) & (output["adjustedS"] > 0.501)].copy()
+    if df.shape[0] == 0:
+        return None
+
+    # createDrugDF / add_cumultive_times_to_df
+    record = encode_py(df["DrugRecord_full"].iloc[0])
+    gaps = [float(t) for t, _ in record]
+    gaps[0] = 0
+    cumulative = np.cumsum(gaps)
+    df["drugRec_Start"] = np.maximum(df["drugRec_Start"], 1)
+    df["drugRec_End"] = np.minimum(df["drugRec_End"], len(record))
+    df["t_start"] = cumulative[df["drugRec_Start"] - 1]
+    df["t_end"] = cumulative[df["drugRec_End"] - 1]
+
+    # removeOverlaps, step 1: pairs (i < j) in foverlaps order, skipping
+    # removed rows
+    df = df.sort_values(["drugRec_Start", "drugRec_End"], kind="stable")
+    rows = df.to_dict("records")
+    removed = set()
+    for j, b in enumerate(rows):
+        for i, a in enumerate(rows[:j]):
+            if a["regName"] == b["regName"] or not _overlap(
+                a["drugRec_Start"], a["drugRec_End"], b["drugRec_Start"], b["drugRec_End"]
+            ):
+                continue
+            if i in removed or j in removed:
+                continue
+            if a["adjustedS"] < b["adjustedS"]:
+                removed.add(i)
+            elif b["adjustedS"] < a["adjustedS"]:
+                removed.add(j)
+    rows = [r for k, r in enumerate(rows) if k not in removed]
+
+    # Step 2: fewer distinct aligned drugs
+    for r in rows:
+        r["compNo"] = unique_aligned_drugs(r["Regimen"])
+    removed = set()
+    for i, a in enumerate(rows):
+        for j, b in enumerate(rows):
+            if i != j and a["compNo"] != b["compNo"]:
+                if _overlap(a["t_start"], a["t_end"], b["t_start"], b["t_end"]):
+                    removed.add(i if a["compNo"] < b["compNo"] else j)
+    rows = [r for k, r in enumerate(rows) if k not in removed]
+
+    # Step 3: sub-regimens
+    removed = set()
+    for i, a in enumerate(rows):
+        for j in range(i + 1, len(rows)):
+            b = rows[j]
+            if (
+                _overlap(a["t_start"], a["t_end"], b["t_start"], b["t_end"])
+                and a["t_start"] != b["t_end"]
+                and a["t_end"] != b["t_start"]
+                and a["regName"] == b["regName"]
+                and a["totAlign"] == b["totAlign"]
+                and a["adjustedS"] != b["adjustedS"]
+            ):
+                removed.add(i if a["adjustedS"] < b["adjustedS"] else j)
+    df = pd.DataFrame([r for k, r in enumerate(rows) if k not in removed])
+
+    # combineOverlaps
+    df = df.sort_values(["regName", "t_start", "t_end"], kind="stable")
+    runs = []
+    for k, r in enumerate(df.to_dict("records")):
+        if k == 0 or r["regName"] != prev["regName"] or (
+            r["t_start"] - prev["t_end"] >= regimen_combine
+        ):
+            runs.append([])
+        runs[-1].append(r)
+        prev = r
+    out = pd.DataFrame(
+        [
+            {
+                "personID": run[0]["personID"],
+                "regName": run[0]["regName"],
+                "drugRec_Start": min(r["drugRec_Start"] for r in run),
+                "drugRec_End": max(r["drugRec_End"] for r in run),
+                "t_start": min(r["t_start"] for r in run),
+                "t_end": max(r["t_end"] for r in run),
+                "adjustedS": np.mean([r["adjustedS"] for r in run]),
+                "Score": np.mean([r["Score"] for r in run]),
+                "totAlign": sum(r["totAlign"] for r in run),
+                "component": run[0]["regName"],
+            }
+            for run in runs
+        ]
+    )
+
+    out = out.sort_values("t_start", kind="stable").reset_index(drop=True)
+    out["timeToNextRegimen"] = np.maximum(0, out["t_start"].shift(-1) - out["t_end"])
+    out["timeToEOD"] = 0.0
+    out.loc[out.index[-1], "timeToEOD"] = cumulative.max() - out["t_end"].iloc[-1]
+    out["regLength"] = out["t_end"] - out["t_start"] + 1
+    return out
+
+
+def eras_patient(processed, discontinuation_time=120):
+    """
+    Port of the era summary (tempDF1) of calculateEras for one patient.
+
+    calculateEras returns the unmerged rows instead, and its era
+    timeToNextRegimen is lag(t_start) - t_end, which is negative. As
+    calculate_eras does, the time to the next era is measured here,
+    0 if negative.
+    """
+    df = processed.sort_values("t_start", kind="stable").reset_index(drop=True)
+    drop = [k for k in range(1, len(df)) if df["t_start"][k] < df["t_end"][k - 1]]
+    rows = df.drop(index=drop).to_dict("records")
+
+    eras = []
+    for k, r in enumerate(rows):
+        gap = r["t_start"] - rows[k - 1]["t_end"] if k else None
+        if k and gap < discontinuation_time and r["component"] == rows[k - 1]["component"]:
+            eras[-1].append(r)
+        else:
+            eras.append([r])
+
+    out = []
+    for era in eras:
+        length = np.array([r["t_end"] - r["t_start"] for r in era])
+        score = np.array([r["adjustedS"] for r in era])
+        with np.errstate(invalid="ignore"):
+            # NaN for an era of zero length, as 0 / 0 in R
+            adjusted = np.sum(score * length / length.sum())
+        out.append(
+            {
+                "component": era[0]["component"],
+                "personID": era[0]["personID"],
+                "adjustedS": adjusted,
+                "t_start": min(r["t_start"] for r in era),
+                "t_end": max(r["t_end"] for r in era),
+                "timeToEOD": min(r["timeToEOD"] for r in era),
+            }
+        )
+    out = pd.DataFrame(out)
+    out["regLength"] = out["t_end"] - out["t_start"]
+    out["timeToNextRegimen"] = np.maximum(0, out["t_start"].shift(-1) - out["t_end"])
+    line = np.arange(len(out))
+    out["First_Line"] = 1 * (line == 0)
+    out["Second_Line"] = 1 * (line == 1)
+    out["Other"] = 1 * (line > 1)
+    return out
+
+
+@pytest.fixture(scope="module")
+def raw():
+    patients, regimens = generate_cohort(n_patients=60, n_regimens=40, seed=7)
+    return align_patients_regimens(patients, regimens[["regName", "shortString"]])
+
+
+@pytest.mark.parametrize("regimen_combine", [0, 28, 1000])
+def test_process_alignments_matches_postprocessDF(raw, regimen_combine):
+    expected = pd.concat(
+        [
+            postprocess_patient(raw[raw["personID"] == p], regimen_combine)
+            for p in raw["personID"].unique()
+        ],
+        ignore_index=True,
+    )
+    got = process_alignments(raw, regimen_combine)
+
+    assert list(got.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("discontinuation_time", [0, 30, 120, 10000])
+def test_calculate_eras_matches_calculateEras(raw, discontinuation_time):
+    processed = process_alignments(raw)
+    expected = pd.concat(
+        [
+            eras_patient(processed[processed["personID"] == p], discontinuation_time)
+            for p in processed["personID"].unique()
+        ],
+        ignore_index=True,
+    )
+    got = calculate_eras(processed, discontinuation_time)
+
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)